@@ -0,0 +1,92 @@
+"""
+In-process cache of users' course access status
+"""
+
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import config
+
+logger = logging.getLogger(__name__)
+
+class AccessCache:
+    """Maps user_id to (has_paid, invite_link).
+
+    Paid users are few and all kept in memory. Users known not to have paid
+    are kept in a bounded LRU so repeated /start taps from browsing users
+    don't reach SQLite either. The cache is only correct as long as every
+    write to payments/chat_invites goes through it (write-through); other
+    processes writing the same database learn about them via listeners
+    (see sharding.py).
+    """
+
+    def __init__(self, max_unpaid: int = config.ACCESS_CACHE_MAX_UNPAID):
+        self.max_unpaid = max_unpaid
+        self._paid: Dict[int, Optional[str]] = {}
+        self._unpaid: "OrderedDict[int, None]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # Bumped on every write so a lookup racing a write doesn't cache stale data
+        self.generation = 0
+        # Called with the user_id of every payment or invite written through this cache
+        self.listeners: List[Callable[[int], None]] = []
+
+    def get(self, user_id: int) -> Optional[Tuple[bool, Optional[str]]]:
+        """Return cached status or None on a miss"""
+        if user_id in self._paid:
+            self.hits += 1
+            return True, self._paid[user_id]
+        if user_id in self._unpaid:
+            self._unpaid.move_to_end(user_id)
+            self.hits += 1
+            return False, None
+        self.misses += 1
+        return None
+
+    def set(self, user_id: int, has_paid: bool, invite_link: Optional[str] = None) -> None:
+        if has_paid:
+            self._unpaid.pop(user_id, None)
+            self._paid[user_id] = invite_link
+        else:
+            self._paid.pop(user_id, None)
+            self._unpaid[user_id] = None
+            self._unpaid.move_to_end(user_id)
+            while len(self._unpaid) > self.max_unpaid:
+                self._unpaid.popitem(last=False)
+
+    def warm(self, rows: Iterable[Tuple[int, Optional[str]]]) -> None:
+        """Load (user_id, invite_link) rows of every paid user"""
+        for user_id, invite_link in rows:
+            self.set(user_id, True, invite_link)
+        logger.info(f"Access cache warmed with {len(self._paid)} paid users")
+
+    def record_payment(self, user_id: int) -> None:
+        self.generation += 1
+        self.set(user_id, True, self._paid.get(user_id))
+        self._changed(user_id)
+
+    def record_invite(self, user_id: int, invite_link: str) -> None:
+        self.generation += 1
+        if user_id in self._paid:
+            self._paid[user_id] = invite_link
+        else:
+            # Link without a known payment: let the next lookup ask the database
+            self.invalidate(user_id)
+        self._changed(user_id)
+
+    def _changed(self, user_id: int) -> None:
+        for listener in self.listeners:
+            listener(user_id)
+
+    def invalidate(self, user_id: int) -> None:
+        self.generation += 1
+        self._paid.pop(user_id, None)
+        self._unpaid.pop(user_id, None)
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'paid_users': len(self._paid),
+            'unpaid_users': len(self._unpaid),
+        }
@@ -0,0 +1,128 @@
+"""
+Buffered funnel analytics
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+import config
+import metrics
+from async_database import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+# Steps of the purchase funnel, in order. 'email' and 'name' mean the step
+# was completed, i.e. the conversation moved on to AWAITING_NAME/AWAITING_PHONE
+FUNNEL = ('start', 'about_course', 'purchase', 'email', 'name', 'invoice', 'payment')
+
+def _user_bucket(user_id: int) -> float:
+    """Stable pseudo-random number in [0, 1) per user"""
+    return (user_id * 2654435761) % 2 ** 32 / 2 ** 32
+
+class AnalyticsLog:
+    """Write-behind log of user events.
+
+    record() only appends to a list; a background task writes the buffer
+    with executemany on the DB writer thread every `flush_interval` seconds,
+    or as soon as `batch_size` events are waiting. Only analytics_funnel is
+    written, one row per (step, user), which is what the funnel report
+    counts; repeated events of a user add no rows.
+
+    When writes fall behind and more than `sample_above` events are
+    buffered, events are kept only for a share of users proportional to the
+    backlog, picked by user_id so sampled users keep their whole path. Kept
+    events carry a weight of 1/rate, so reported counts stay estimates of
+    the real ones. Beyond `max_buffer` events are dropped.
+    """
+
+    def __init__(
+        self,
+        db: AsyncDatabase,
+        batch_size: int = config.ANALYTICS_BATCH_SIZE,
+        flush_interval: float = config.ANALYTICS_FLUSH_INTERVAL,
+        sample_above: int = config.ANALYTICS_SAMPLE_ABOVE,
+        max_buffer: int = config.ANALYTICS_MAX_BUFFER
+    ):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sample_above = sample_above
+        self.max_buffer = max_buffer
+        self._buffer: List[Tuple[float, int, str, float]] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self.sample_rate = 1.0
+        self.written = 0
+        self.sampled_out = 0
+        self.dropped = 0
+        metrics.registry.register_stats('bot_analytics', self.stats)
+
+    def record(self, event: str, user_id: int) -> None:
+        """Queue an event; never waits"""
+        pending = len(self._buffer)
+        if pending >= self.max_buffer:
+            self.dropped += 1
+            return
+        self.sample_rate = 1.0 if pending < self.sample_above else self.sample_above / pending
+        if self.sample_rate < 1.0 and _user_bucket(user_id) >= self.sample_rate:
+            self.sampled_out += 1
+            return
+        self._buffer.append((time.time(), user_id, event, 1.0 / self.sample_rate))
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the flush task and write what is still buffered"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Write buffered events in batches of batch_size"""
+        async with self._flush_lock:
+            while self._buffer:
+                batch = self._buffer[:self.batch_size]
+                del self._buffer[:self.batch_size]
+                try:
+                    await self.db.add_analytics_events(batch)
+                except Exception as e:
+                    logger.error(f"Failed to write {len(batch)} analytics events, will retry: {e}")
+                    # Keep them unless that would push newer events out
+                    if len(self._buffer) + len(batch) <= self.max_buffer:
+                        self._buffer[:0] = batch
+                    else:
+                        self.dropped += len(batch)
+                    return
+                self.written += len(batch)
+
+    async def funnel(self, since: float = 0.0) -> List[Tuple[str, float]]:
+        """Estimated users at each FUNNEL step, in funnel order, of those who started since a unix time"""
+        counts: Dict[str, float] = {
+            event: users for event, users in await self.db.get_funnel_counts(FUNNEL[0], since)
+        }
+        return [(step, counts.get(step, 0.0)) for step in FUNNEL]
+
+    def stats(self) -> dict:
+        return {
+            'buffered': len(self._buffer),
+            'written': self.written,
+            'sampled_out': self.sampled_out,
+            'dropped': self.dropped,
+            'sample_rate': self.sample_rate,
+        }
@@ -0,0 +1,199 @@
+"""
+Async facade over Database for use inside the event loop
+"""
+
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, Tuple
+import config
+from database import Database
+from access_cache import AccessCache
+
+logger = logging.getLogger(__name__)
+
+class AsyncDatabase:
+    """Runs Database queries on worker threads so handlers never block the loop.
+
+    All writes go through a single writer thread, which keeps SQLite from
+    contending on its write lock. Reads are spread across a small pool of
+    reader threads; with WAL they don't wait on the writer. Every thread
+    uses its own long-lived connection from the Database connection manager.
+
+    The schema is created on the writer thread as soon as this object
+    exists, so startup can go on building the application meanwhile; the
+    first queries wait for it.
+    """
+
+    def __init__(self, db: Database, readers: int = config.DB_READER_THREADS,
+                 executors: Optional[Tuple[ThreadPoolExecutor, ThreadPoolExecutor]] = None):
+        self.db = db
+        self.access_cache = AccessCache()
+        # (writer, readers) shared by several databases, e.g. one per hosted bot; closed by their owner
+        self._owns_executors = executors is None
+        self._writer, self._readers = executors or (
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer'),
+            ThreadPoolExecutor(max_workers=readers, thread_name_prefix='db-reader')
+        )
+        self.schema_seconds: Optional[float] = None
+        self._schema = self._writer.submit(self._init_schema)
+
+    def _init_schema(self) -> None:
+        started = time.perf_counter()
+        self.db.init_db()
+        self.schema_seconds = time.perf_counter() - started
+
+    async def _run(self, executor: ThreadPoolExecutor, func: Callable, *args, **kwargs) -> Any:
+        if self._schema is not None:
+            await asyncio.wrap_future(self._schema)
+            self._schema = None
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+    async def read(self, func: Callable, *args, **kwargs) -> Any:
+        """Run a read-only Database call on a reader thread"""
+        return await self._run(self._readers, func, *args, **kwargs)
+
+    async def write(self, func: Callable, *args, **kwargs) -> Any:
+        """Run a Database call that modifies data on the writer thread"""
+        return await self._run(self._writer, func, *args, **kwargs)
+
+    async def record_payment(self, user_id: int, username: str, customer_info: dict,
+                             transaction_id: str, amount: float, currency: str):
+        await self.write(
+            self.db.record_payment, user_id, username, customer_info,
+            transaction_id, amount, currency
+        )
+        self.access_cache.record_payment(user_id)
+
+    async def record_payment_event(self, user_id: int, username: str, customer_info: dict,
+                                   transaction_id: str, telegram_charge_id: str, amount: float,
+                                   currency: str, chat_id: int, outbox_kind: str, outbox_payload: str) -> bool:
+        recorded = await self.write(
+            self.db.record_payment_event, user_id, username, customer_info, transaction_id,
+            telegram_charge_id, amount, currency, chat_id, outbox_kind, outbox_payload
+        )
+        self.access_cache.record_payment(user_id)
+        return recorded
+
+    async def get_due_outbox(self, now: float, limit: int) -> list:
+        return await self.read(self.db.get_due_outbox, now, limit)
+
+    async def get_next_outbox_attempt(self) -> Optional[float]:
+        return await self.read(self.db.get_next_outbox_attempt)
+
+    async def retry_outbox(self, entry_id: int, attempts: int, next_attempt_at: float, error: str):
+        return await self.write(self.db.retry_outbox, entry_id, attempts, next_attempt_at, error)
+
+    async def finish_outbox(self, entry_id: int, status: str, attempts: int, error: Optional[str] = None):
+        return await self.write(self.db.finish_outbox, entry_id, status, attempts, error)
+
+    async def add_pending_invoice(self, nonce: str, user_id: int, amount: int, currency: str,
+                                  customer_info: str, expires_at: float):
+        return await self.write(self.db.add_pending_invoice, nonce, user_id, amount, currency,
+                                customer_info, expires_at)
+
+    async def get_pending_invoices(self, now: float) -> list:
+        return await self.read(self.db.get_pending_invoices, now)
+
+    async def delete_pending_invoice(self, nonce: str):
+        return await self.write(self.db.delete_pending_invoice, nonce)
+
+    async def delete_expired_invoices(self, now: float) -> int:
+        return await self.write(self.db.delete_expired_invoices, now)
+
+    async def add_analytics_events(self, events: list):
+        return await self.write(self.db.add_analytics_events, events)
+
+    async def get_funnel_counts(self, entry_event: str, since: float) -> list:
+        return await self.read(self.db.get_funnel_counts, entry_event, since)
+
+    async def record_chat_invite(self, user_id: int, invite_link: str):
+        await self.write(self.db.record_chat_invite, user_id, invite_link)
+        self.access_cache.record_invite(user_id, invite_link)
+
+    async def get_access_status(self, user_id: int) -> tuple:
+        """Return (has_paid, invite_link), served from memory when possible"""
+        cached = self.access_cache.get(user_id)
+        if cached is not None:
+            return cached
+        generation = self.access_cache.generation
+        has_paid, invite_link = await self.read(self.db.get_access_status, user_id)
+        if generation == self.access_cache.generation:
+            self.access_cache.set(user_id, has_paid, invite_link)
+        return has_paid, invite_link
+
+    async def warm_access_cache(self):
+        """Load every paid user into the access cache"""
+        self.access_cache.warm(await self.read(self.db.get_paid_users))
+
+    async def get_payment_status(self, user_id: int) -> bool:
+        return await self.read(self.db.get_payment_status, user_id)
+
+    async def get_chat_invite(self, user_id: int) -> Optional[str]:
+        return await self.read(self.db.get_chat_invite, user_id)
+
+    async def get_user_info(self, user_id: int) -> Optional[dict]:
+        return await self.read(self.db.get_user_info, user_id)
+
+    async def get_media_file(self, path: str) -> Optional[tuple]:
+        return await self.read(self.db.get_media_file, path)
+
+    async def get_media_files(self) -> list:
+        return await self.read(self.db.get_media_files)
+
+    async def record_media_file(self, path: str, fingerprint: str, file_id: str):
+        return await self.write(self.db.record_media_file, path, fingerprint, file_id)
+
+    async def delete_media_file(self, path: str):
+        return await self.write(self.db.delete_media_file, path)
+
+    async def create_broadcast(self, created_by: int, text: Optional[str] = None,
+                               source_chat_id: Optional[int] = None,
+                               source_message_id: Optional[int] = None) -> int:
+        return await self.write(self.db.create_broadcast, created_by, text, source_chat_id, source_message_id)
+
+    async def update_broadcast_progress(self, broadcast_id: int, last_user_id: int, sent: int, failed: int):
+        return await self.write(self.db.update_broadcast_progress, broadcast_id, last_user_id, sent, failed)
+
+    async def finish_broadcast(self, broadcast_id: int, status: str = 'done'):
+        return await self.write(self.db.finish_broadcast, broadcast_id, status)
+
+    async def get_running_broadcasts(self) -> list:
+        return await self.read(self.db.get_running_broadcasts)
+
+    async def get_paid_user_ids_after(self, after_user_id: int, limit: int) -> list:
+        return await self.read(self.db.get_paid_user_ids_after, after_user_id, limit)
+
+    async def load_user_data(self, user_id: int) -> Optional[str]:
+        return await self.read(self.db.load_user_data, user_id)
+
+    async def load_conversations(self, name: str) -> list:
+        return await self.read(self.db.load_conversations, name)
+
+    async def save_persistence_batch(self, user_data: list, conversations: list):
+        return await self.write(self.db.save_persistence_batch, user_data, conversations)
+
+    async def add_pooled_invites(self, invite_links: list):
+        return await self.write(self.db.add_pooled_invites, invite_links)
+
+    async def get_pooled_invites(self) -> list:
+        return await self.read(self.db.get_pooled_invites)
+
+    async def claim_pooled_invite(self, invite_link: str, user_id: int) -> bool:
+        if not await self.write(self.db.claim_pooled_invite, invite_link, user_id):
+            return False
+        self.access_cache.record_invite(user_id, invite_link)
+        return True
+
+    async def ping(self) -> bool:
+        return await self.read(self.db.ping)
+
+    def close(self):
+        """Wait for queued queries, then close worker threads and connections"""
+        if self._owns_executors:
+            self._writer.shutdown(wait=True)
+            self._readers.shutdown(wait=True)
+        self.db.close()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test: the full bot against the local fake Bot API
+
+Builds the application exactly like bot.py does, points it at
+benchmarks/fake_bot_api.py and plays synthetic users through /start, the
+info menus, the reviews album, the purchase conversation, pre-checkout,
+successful_payment and the access check; --scenario menu instead browses
+the menu screens and back, as most visitors do. The funnel also checks that
+the price on the start screen is the one invoiced (--course-price sets a
+price other than config's). A step's latency is the time
+from queueing its update until the bot makes the API call that finishes
+handling it, so polling, handler code, SQLite and the (simulated) API
+latency are all included.
+
+The bot, the fake API and the generator share one process and event loop.
+A temporary database and generated media files are used, so nothing in
+/app is touched.
+
+Usage: python -m benchmarks.bot_load [--users N] [--concurrency N]
+       [--latency SECONDS] [--jitter SECONDS] [--flood-rate P]
+       [--step-timeout SECONDS] [--scenario funnel|menu] [--seed N]
+       [--course-title TEXT] [--course-price KOPEKS]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+from itertools import count
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import config
+from bot import BotHandlers, build_application
+from markups import PROFILE_NAME_BUTTON_PREFIX
+from payment_handler import PaymentHandler
+from text_constants import escape_markdown, format_price
+from benchmarks.fake_bot_api import BOT_USER, CONTROL_METHODS, TOKEN, FakeBotAPI
+
+STUDENTS_CHAT_ID = "-1001234567890"
+FIRST_USER_ID = 10_000_000
+
+_ids = count(1)
+
+def make_media(media_dir: Path, reviews: int) -> None:
+    """Placeholder images; the fake API never decodes them"""
+    reviews_dir = media_dir / "reviews"
+    reviews_dir.mkdir(parents=True)
+    for path in [media_dir / "cover_image.jpg", media_dir / "lecturer_image.jpg"] + [
+        reviews_dir / f"review_{i:02d}.jpg" for i in range(reviews)
+    ]:
+        path.write_bytes(b'\xff\xd8\xff\xe0' + os.urandom(20 * 1024))
+
+class SyntheticUser:
+    """Builds the updates one user sends while going through the funnel"""
+
+    def __init__(self, n: int):
+        self.id = FIRST_USER_ID + n
+        self.user = {
+            'id': self.id,
+            'is_bot': False,
+            'first_name': 'Load',
+            'last_name': f'User{n}',
+            'username': f'load_user_{n}'
+        }
+        self.chat = {'id': self.id, 'type': 'private'}
+        self.invoice_payload = ''
+        self.invoice_amount: Optional[int] = None
+        self.start_text: Optional[str] = None
+        # Buttons are tapped on the last message the bot showed this user
+        self.menu_message: Dict[str, Any] = {
+            'message_id': next(_ids),
+            'date': int(time.time()),
+            'chat': self.chat,
+            'from': BOT_USER,
+            'text': 'menu'
+        }
+
+    def message(self, **content) -> Dict[str, Any]:
+        return {'message': {
+            'message_id': next(_ids),
+            'date': int(time.time()),
+            'chat': self.chat,
+            'from': self.user,
+            **content
+        }}
+
+    def command(self, command: str) -> Dict[str, Any]:
+        return self.message(text=command, entities=[{'type': 'bot_command', 'offset': 0, 'length': len(command)}])
+
+    def callback(self, data: str) -> Dict[str, Any]:
+        return {'callback_query': {
+            'id': str(next(_ids)),
+            'from': self.user,
+            'chat_instance': str(self.id),
+            'data': data,
+            'message': self.menu_message
+        }}
+
+    def contact(self) -> Dict[str, Any]:
+        return self.message(contact={'phone_number': '+79211234567', 'first_name': 'Load', 'user_id': self.id})
+
+    def pre_checkout(self) -> Dict[str, Any]:
+        return {'pre_checkout_query': {
+            'id': str(next(_ids)),
+            'from': self.user,
+            'currency': config.CURRENCY,
+            'total_amount': self.invoice_amount,
+            'invoice_payload': self.invoice_payload
+        }}
+
+    def successful_payment(self) -> Dict[str, Any]:
+        return self.message(successful_payment={
+            'currency': config.CURRENCY,
+            'total_amount': self.invoice_amount,
+            'invoice_payload': self.invoice_payload,
+            'telegram_payment_charge_id': f"tg_{self.id}",
+            'provider_payment_charge_id': f"provider_{self.id}"
+        })
+
+# A menu screen is shown by editing the tapped message, or by sending a new one and deleting that
+SCREEN_SHOWN = ('editMessageText', 'editMessageCaption', 'editMessageMedia', 'deleteMessage')
+
+# (handler, update factory, API call that completes handling)
+SCENARIO: List[Tuple[str, Callable[[SyntheticUser], Dict[str, Any]], Tuple[str, ...]]] = [
+    ('start', lambda u: u.command('/start'), ('sendPhoto', 'sendMessage')),
+    ('about_course', lambda u: u.callback('about_course'), SCREEN_SHOWN),
+    ('about_lecturer', lambda u: u.callback('about_lecturer'), SCREEN_SHOWN),
+    ('reviews', lambda u: u.callback('reviews'), SCREEN_SHOWN),
+    ('contact', lambda u: u.callback('contact'), SCREEN_SHOWN),
+    ('purchase', lambda u: u.callback('purchase'), ('deleteMessage',)),
+    ('email', lambda u: u.message(text=f"load{u.id}@example.com"), ('sendMessage',)),
+    ('name', lambda u: u.message(text=f"{PROFILE_NAME_BUTTON_PREFIX} Load User"), ('sendMessage',)),
+    ('phone', lambda u: u.contact(), ('sendInvoice',)),
+    ('pre_checkout', lambda u: u.pre_checkout(), ('answerPreCheckoutQuery',)),
+    ('successful_payment', lambda u: u.successful_payment(), ('sendMessage',)),
+    ('access', lambda u: u.callback('access'), SCREEN_SHOWN),
+]
+
+# Looking through the menu with the back button, without buying
+MENU_SCENARIO: List[Tuple[str, Callable[[SyntheticUser], Dict[str, Any]], Tuple[str, ...]]] = [
+    ('start', lambda u: u.command('/start'), ('sendPhoto', 'sendMessage')),
+    ('about_lecturer', lambda u: u.callback('about_lecturer'), SCREEN_SHOWN),
+    ('back', lambda u: u.callback('start'), SCREEN_SHOWN),
+    ('contact', lambda u: u.callback('contact'), SCREEN_SHOWN),
+    ('back', lambda u: u.callback('start'), SCREEN_SHOWN),
+    ('access', lambda u: u.callback('access'), SCREEN_SHOWN),
+    ('back', lambda u: u.callback('start'), SCREEN_SHOWN),
+    ('about_course', lambda u: u.callback('about_course'), SCREEN_SHOWN),
+    ('back', lambda u: u.callback('start'), SCREEN_SHOWN),
+]
+
+SCENARIOS = {'funnel': SCENARIO, 'menu': MENU_SCENARIO}
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+async def play_user(api: FakeBotAPI, user: SyntheticUser, args, latencies: Dict[str, List[float]],
+                    errors: Dict[str, int]) -> None:
+    for name, make_update, completes_with in SCENARIOS[args.scenario]:
+        waiter = api.expect(user.id, completes_with)
+        started = time.perf_counter()
+        api.push_update(make_update(user))
+        try:
+            await asyncio.wait_for(waiter, args.step_timeout)
+        except asyncio.TimeoutError:
+            errors[name] += 1
+        else:
+            latencies[name].append(time.perf_counter() - started)
+        # Payments must carry the payload and amount of the invoice the bot sent
+        user.invoice_payload = api.invoice_payloads.get(user.id, user.invoice_payload)
+        user.invoice_amount = api.invoice_amounts.get(user.id, user.invoice_amount)
+        user.menu_message = api.last_messages.get(user.id, user.menu_message)
+        if name == 'start' and user.start_text is None:
+            user.start_text = user.menu_message.get('caption') or user.menu_message.get('text')
+        if args.think_time:
+            await asyncio.sleep(random.uniform(0, args.think_time))
+
+async def run(args):
+    random.seed(args.seed)
+    workdir = Path(tempfile.mkdtemp(prefix="bot_load_"))
+    make_media(workdir / "media", args.reviews)
+    config.BOT_MODE = "polling"
+    config.METRICS_PORT = 0
+    config.COVER_IMAGE_PATH = workdir / "media" / "cover_image.jpg"
+    config.LECTURER_IMAGE_PATH = workdir / "media" / "lecturer_image.jpg"
+    config.REVIEWS_PATH = workdir / "media" / "reviews"
+
+    api = FakeBotAPI(latency=args.latency, jitter=args.jitter, flood_rate=args.flood_rate, seed=args.seed)
+    await api.start()
+
+    payment_handler = PaymentHandler(
+        provider_token="fake-provider-token",
+        currency=config.CURRENCY,
+        students_chat_id=STUDENTS_CHAT_ID,
+        db_file=workdir / "course_bot.db",
+        course_title=args.course_title,
+        course_price=args.course_price
+    )
+    handlers = BotHandlers(payment_handler)
+    handlers.health.health_file = workdir / "health.json"
+    application = build_application(handlers, token=TOKEN, base_url=api.base_url)
+
+    await application.initialize()
+    await handlers.post_init(application)
+    await application.updater.start_polling(poll_interval=0, timeout=10)
+    await application.start()
+
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    users = asyncio.Queue()
+    everyone = [SyntheticUser(n) for n in range(args.users)]
+    for user in everyone:
+        users.put_nowait(user)
+
+    async def worker():
+        while not users.empty():
+            await play_user(api, users.get_nowait(), args, latencies, errors)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+
+    await application.updater.stop()
+    await application.stop()
+    await handlers.post_stop(application)
+    await application.shutdown()
+    payment_handler.db.close()
+    await api.stop()
+
+    completed = sum(len(values) for values in latencies.values())
+    failed = sum(errors.values())
+    print(f"users:       {args.users} ({args.concurrency} concurrent) in {elapsed:.2f}s")
+    print(f"throughput:  {completed / elapsed:.0f} updates/s, {args.users / elapsed:.1f} users/s")
+    print(f"timeouts:    {failed}")
+    print()
+    print(f"{'handler':<20}{'count':>7}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for name in dict.fromkeys(name for name, _, _ in SCENARIOS[args.scenario]):
+        values = sorted(latencies[name])
+        row = [percentile(values, p) * 1000 for p in (50, 95, 99)] + [(values[-1] if values else 0.0) * 1000]
+        print(f"{name:<20}{len(values):>7}{errors[name]:>8}" + ''.join(f"{v:>9.1f}" for v in row))
+    print()
+    print(f"API calls:   {dict(sorted(api.calls.items()))}")
+    handling_calls = sum(n for method, n in api.calls.items() if method not in CONTROL_METHODS)
+    print(f"per update:  {handling_calls / max(completed, 1):.2f} API calls")
+    invoiced = [user for user in everyone if user.invoice_amount is not None]
+    if invoiced:
+        # The start screen escapes the price for MarkdownV2
+        mismatched = [user for user in invoiced
+                      if f"Цена: {escape_markdown(format_price(user.invoice_amount))} рублей" not in (user.start_text or '')]
+        print(f"price:       {len(invoiced) - len(mismatched)} of {len(invoiced)} users saw the price they were invoiced")
+    if api.pre_checkout_rejections:
+        print(f"rejected:    {dict(api.pre_checkout_rejections)}")
+    if api.floods:
+        print(f"429 served:  {dict(sorted(api.floods.items()))}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.02, help="Seconds added to every API call")
+    parser.add_argument('--jitter', type=float, default=0.01, help="Extra random API delay, up to SECONDS")
+    parser.add_argument('--flood-rate', type=float, default=0.0, help="Share of API calls answered with 429")
+    parser.add_argument('--think-time', type=float, default=0.0, help="Random pause between a user's steps")
+    parser.add_argument('--step-timeout', type=float, default=10.0)
+    parser.add_argument('--reviews', type=int, default=12, help="Generated review images")
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='funnel')
+    parser.add_argument('--course-title', default=config.COURSE_TITLE)
+    parser.add_argument('--course-price', type=int, default=config.COURSE_PRICE, help="In kopeks")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(args.log_level)
+    asyncio.run(run(args))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: connect-per-query vs long-lived tuned SQLite connections
+
+Usage: python -m benchmarks.db_connections [--queries N] [--users N]
+"""
+
+import argparse
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+from database import Database
+
+def seed(db: Database, users: int):
+    for user_id in range(users):
+        db.record_payment(
+            user_id=user_id,
+            username=f"user{user_id}",
+            customer_info={'full_name': 'Test User', 'email': 'test@example.com', 'phone': '+79211234567'},
+            transaction_id=f"tx{user_id}",
+            amount=10000,
+            currency="RUB"
+        )
+        db.record_chat_invite(user_id, f"https://t.me/+invite{user_id}")
+
+def run_connect_per_query(db_file: Path, queries: int, users: int) -> float:
+    """Reproduces the previous behaviour: open and close a connection for every query"""
+    start = time.perf_counter()
+    for i in range(queries):
+        conn = sqlite3.connect(db_file)
+        try:
+            conn.execute("SELECT EXISTS(SELECT 1 FROM payments WHERE user_id = ?)", (i % users,)).fetchone()
+        finally:
+            conn.close()
+        conn = sqlite3.connect(db_file)
+        try:
+            conn.execute("SELECT invite_link FROM chat_invites WHERE user_id = ?", (i % users,)).fetchone()
+        finally:
+            conn.close()
+    return time.perf_counter() - start
+
+def run_long_lived(db: Database, queries: int, users: int) -> float:
+    start = time.perf_counter()
+    for i in range(queries):
+        db.get_payment_status(i % users)
+        db.get_chat_invite(i % users)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--queries', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = Path(tmp) / 'bench.db'
+        db = Database(db_file)
+        seed(db, args.users)
+
+        total_queries = args.queries * 2
+        baseline = run_connect_per_query(db_file, args.queries, args.users)
+        pooled = run_long_lived(db, args.queries, args.users)
+        db.close()
+
+    print(f"{'mode':<20}{'total, s':>12}{'per query, us':>16}")
+    print(f"{'connect-per-query':<20}{baseline:>12.3f}{baseline / total_queries * 1e6:>16.1f}")
+    print(f"{'long-lived':<20}{pooled:>12.3f}{pooled / total_queries * 1e6:>16.1f}")
+    print(f"speedup: {baseline / pooled:.1f}x")
+
+if __name__ == '__main__':
+    main()
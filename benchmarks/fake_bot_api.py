@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Telegram Bot API
+
+Serves the methods bot.py uses (getUpdates, sendMessage, sendPhoto,
+sendMediaGroup, sendInvoice, editMessageText, editMessageCaption,
+editMessageMedia, answerCallbackQuery, answerPreCheckoutQuery,
+createChatInviteLink, deleteMessage and the startup calls) with canned
+responses. Latency, jitter and a share of 429 flood errors are configurable.
+Updates are injected with push_update() and handed out through getUpdates
+long polling, so the bot runs its normal polling code path.
+
+Usage: python -m benchmarks.fake_bot_api [--port N] [--latency SECONDS]
+       [--jitter SECONDS] [--flood-rate P]
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter, defaultdict
+from email.parser import BytesParser
+from email.policy import HTTP
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qsl
+from http_server import HTTPServer, Request, Response
+
+TOKEN = "123456:fake-bot-api"
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Course Bot', 'username': 'course_bot'}
+
+# Calls that are part of the bot's own machinery, never delayed or flooded
+CONTROL_METHODS = {'getMe', 'getUpdates', 'deleteWebhook', 'setWebhook', 'getWebhookInfo', 'close', 'logOut'}
+
+class FakeBotAPI:
+    """In-process Bot API server for load tests.
+
+    Every call is counted per method. Callers can wait for the bot to make
+    a specific call to a chat with expect(), which is how the load
+    generator knows an update has been fully handled.
+    """
+
+    def __init__(
+        self,
+        token: str = TOKEN,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        flood_rate: float = 0.0,
+        retry_after: int = 1,
+        seed: Optional[int] = None
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.calls: Counter = Counter()
+        self.floods: Counter = Counter()
+        self.http = HTTPServer(host, port, max_body_size=50 * 1024 * 1024)
+        self.http.prefix_route('POST', f'/bot{token}/', self._handle)
+        self.http.prefix_route('GET', f'/bot{token}/', self._handle)
+
+        self._methods: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+            'getMe': lambda params: BOT_USER,
+            'sendMessage': self._send_message,
+            'sendPhoto': self._send_photo,
+            'sendMediaGroup': self._send_media_group,
+            'sendInvoice': self._send_invoice,
+            'editMessageText': self._edit_message_text,
+            'editMessageCaption': self._edit_message_caption,
+            'editMessageMedia': self._edit_message_media,
+            'copyMessage': lambda params: {'message_id': self._next_message_id()},
+            'createChatInviteLink': self._create_chat_invite_link,
+            'answerCallbackQuery': lambda params: True,
+            'answerPreCheckoutQuery': self._answer_pre_checkout_query,
+            'deleteMessage': lambda params: True,
+            'deleteWebhook': lambda params: True,
+            'setWebhook': lambda params: True,
+        }
+        self._updates: List[Dict[str, Any]] = []
+        self._update_id = 0
+        self._updates_ready = asyncio.Event()
+        self._message_id = 0
+        self._file_id = 0
+        self._invite_id = 0
+        # chat_id -> payload and amount of the last invoice sent there
+        self.invoice_payloads: Dict[int, str] = {}
+        self.invoice_amounts: Dict[int, int] = {}
+        self.pre_checkout_rejections: Counter = Counter()
+        # chat_id -> last message sent or edited there, the one a user would tap buttons on
+        self.last_messages: Dict[int, Dict[str, Any]] = {}
+        # callback/pre-checkout query id -> chat of the user who sent it
+        self._query_chats: Dict[str, int] = {}
+        self._waiters: Dict[Tuple[int, str], List[asyncio.Future]] = defaultdict(list)
+
+    def add_token(self, token: str) -> None:
+        """Answer a second bot's calls too; all bots share one update queue and call log"""
+        self.http.prefix_route('POST', f'/bot{token}/', self._handle)
+        self.http.prefix_route('GET', f'/bot{token}/', self._handle)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.http.host}:{self.http.bound_port}"
+
+    async def start(self) -> None:
+        await self.http.start()
+
+    async def stop(self) -> None:
+        self._updates_ready.set()
+        await self.http.stop()
+
+    def push_update(self, update: Dict[str, Any]) -> int:
+        """Queue an update for getUpdates; update_id is assigned here"""
+        self._update_id += 1
+        update['update_id'] = self._update_id
+        for kind in ('callback_query', 'pre_checkout_query'):
+            if kind in update:
+                self._query_chats[update[kind]['id']] = update[kind]['from']['id']
+        self._updates.append(update)
+        self._updates_ready.set()
+        return self._update_id
+
+    def expect(self, chat_id: int, methods: Iterable[str]) -> asyncio.Future:
+        """Future resolved with the method name when the bot next calls one of methods for chat_id"""
+        future = asyncio.get_running_loop().create_future()
+        for method in methods:
+            self._waiters[(chat_id, method)].append(future)
+        return future
+
+    def _notify(self, method: str, params: Dict[str, Any]) -> None:
+        if 'chat_id' in params:
+            chat_id = int(params['chat_id'])
+        elif params.get('callback_query_id') in self._query_chats:
+            chat_id = self._query_chats.pop(params['callback_query_id'])
+        elif params.get('pre_checkout_query_id') in self._query_chats:
+            chat_id = self._query_chats.pop(params['pre_checkout_query_id'])
+        else:
+            return
+        waiters = self._waiters.pop((chat_id, method), None)
+        for future in waiters or ():
+            if not future.done():
+                future.set_result(method)
+
+    @staticmethod
+    def _parse_params(request: Request) -> Dict[str, Any]:
+        content_type = request.headers.get('content-type', '')
+        if content_type.startswith('multipart/form-data'):
+            message = BytesParser(policy=HTTP).parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode('latin-1') + request.body
+            )
+            params = {}
+            for part in message.iter_parts():
+                name = part.get_param('name', header='content-disposition')
+                if part.get_filename() is None:
+                    # PTB sends form fields as UTF-8 without declaring a charset
+                    params[name] = part.get_payload(decode=True).decode()
+            return params
+        if content_type.startswith('application/json'):
+            return json.loads(request.body or b'{}')
+        return dict(parse_qsl(request.body.decode()))
+
+    async def _handle(self, request: Request) -> Response:
+        method = request.path.rsplit('/', 1)[1]
+        params = self._parse_params(request)
+        self.calls[method] += 1
+
+        if method == 'getUpdates':
+            return self._ok(await self._get_updates(params))
+
+        if method not in CONTROL_METHODS:
+            delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+            if delay:
+                await asyncio.sleep(delay)
+            if self.flood_rate and self.random.random() < self.flood_rate:
+                self.floods[method] += 1
+                return self._error(429, f"Too Many Requests: retry after {self.retry_after}",
+                                   {'retry_after': self.retry_after})
+
+        handler = self._methods.get(method)
+        if handler is None:
+            return self._error(404, f"Not Found: method {method} is not emulated")
+        result = handler(params)
+        self._notify(method, params)
+        return self._ok(result)
+
+    async def _get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        timeout = float(params.get('timeout') or 0)
+        self._updates = [update for update in self._updates if update['update_id'] >= offset]
+        if not self._updates and timeout:
+            self._updates_ready.clear()
+            try:
+                await asyncio.wait_for(self._updates_ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    @staticmethod
+    def _ok(result: Any) -> Response:
+        return Response(
+            body=json.dumps({'ok': True, 'result': result}).encode(),
+            content_type='application/json'
+        )
+
+    @staticmethod
+    def _error(code: int, description: str, parameters: Optional[Dict[str, Any]] = None) -> Response:
+        payload = {'ok': False, 'error_code': code, 'description': description}
+        if parameters:
+            payload['parameters'] = parameters
+        return Response(code, json.dumps(payload).encode(), content_type='application/json')
+
+    def _next_message_id(self) -> int:
+        self._message_id += 1
+        return self._message_id
+
+    def _photo_sizes(self) -> List[Dict[str, Any]]:
+        self._file_id += 1
+        return [{
+            'file_id': f"photo{self._file_id}",
+            'file_unique_id': f"unique{self._file_id}",
+            'width': 1280,
+            'height': 720
+        }]
+
+    def _message(self, params: Dict[str, Any], **content) -> Dict[str, Any]:
+        chat_id = int(params['chat_id'])
+        return {
+            'message_id': self._next_message_id(),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'supergroup'},
+            'from': BOT_USER,
+            **content
+        }
+
+    def _remember(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        self.last_messages[message['chat']['id']] = message
+        return message
+
+    def _send_message(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return self._remember(self._message(params, text=params.get('text', '')))
+
+    def _send_photo(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return self._remember(self._message(params, photo=self._photo_sizes(), caption=params.get('caption', '')))
+
+    def _edited(self, params: Dict[str, Any], **content) -> Dict[str, Any]:
+        message = self._message(params, edit_date=int(time.time()), **content)
+        message['message_id'] = int(params['message_id'])
+        return self._remember(message)
+
+    def _edit_message_text(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return self._edited(params, text=params.get('text', ''))
+
+    def _edit_message_caption(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        previous = self.last_messages.get(int(params['chat_id']), {})
+        return self._edited(params, photo=previous.get('photo') or self._photo_sizes(),
+                            caption=params.get('caption', ''))
+
+    def _edit_message_media(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        media = json.loads(params['media'])
+        if media['media'].startswith('attach://'):
+            photo = self._photo_sizes()
+        else:
+            photo = [{'file_id': media['media'], 'file_unique_id': media['media'], 'width': 1280, 'height': 720}]
+        return self._edited(params, photo=photo, caption=media.get('caption', ''))
+
+    def _send_media_group(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        media = json.loads(params['media'])
+        group_id = str(self._next_message_id())
+        return [self._message(params, photo=self._photo_sizes(), media_group_id=group_id) for _ in media]
+
+    def _send_invoice(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        chat_id = int(params['chat_id'])
+        total_amount = sum(price['amount'] for price in json.loads(params.get('prices', '[]')))
+        self.invoice_payloads[chat_id] = params.get('payload', '')
+        self.invoice_amounts[chat_id] = total_amount
+        return self._message(params, invoice={
+            'title': params.get('title', ''),
+            'description': params.get('description', ''),
+            'start_parameter': params.get('start_parameter', ''),
+            'currency': params.get('currency', ''),
+            'total_amount': total_amount
+        })
+
+    def _answer_pre_checkout_query(self, params: Dict[str, Any]) -> bool:
+        if str(params.get('ok')).lower() != 'true':
+            self.pre_checkout_rejections[params.get('error_message', '')] += 1
+        return True
+
+    def _create_chat_invite_link(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        self._invite_id += 1
+        return {
+            'invite_link': f"https://t.me/+fake{self._invite_id:08d}",
+            'creator': BOT_USER,
+            'creates_join_request': False,
+            'is_primary': False,
+            'is_revoked': False,
+            'member_limit': int(params.get('member_limit') or 0) or None
+        }
+
+async def serve(args):
+    api = FakeBotAPI(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        jitter=args.jitter,
+        flood_rate=args.flood_rate
+    )
+    await api.start()
+    print(f"Fake Bot API at {api.base_url}/bot{TOKEN}/ (Ctrl+C to stop)")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await api.stop()
+        print(f"calls: {dict(api.calls)}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every API call")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Extra random delay, up to SECONDS")
+    parser.add_argument('--flood-rate', type=float, default=0.0, help="Share of calls answered with 429")
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Throughput of multi-process mode by number of worker processes
+
+Runs sharding.Dispatcher with 1, 2, 4... workers against the local fake
+Bot API and plays the synthetic users of benchmarks/bot_load.py through
+the whole funnel for each worker count. The dispatcher, the fake API and
+the load generator share this process; the workers are separate
+processes, so a count above the number of CPU cores can't go faster. On
+a single core all counts come out about the same; run it on the host
+sharding is meant for.
+
+A temporary database and generated media files are used per run, so
+nothing in /app is touched.
+
+Usage: python -m benchmarks.shard_scaling [--workers 1,2,4] [--users N]
+       [--concurrency N] [--latency SECONDS] [--jitter SECONDS]
+       [--scenario funnel|menu]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List
+import config
+from sharding import Dispatcher
+from benchmarks.bot_load import SCENARIOS, STUDENTS_CHAT_ID, SyntheticUser, make_media, percentile, play_user
+from benchmarks.fake_bot_api import TOKEN, FakeBotAPI
+
+async def run_once(args, workers: int) -> dict:
+    random.seed(args.seed)
+    workdir = Path(tempfile.mkdtemp(prefix="shard_scaling_"))
+    media_dir = workdir / "media"
+    make_media(media_dir, args.reviews)
+    settings = {
+        'BOT_MODE': "polling",
+        'METRICS_PORT': 0,
+        'BACKUP_INTERVAL': 0,
+        'PROVIDER_TOKEN': "fake-provider-token",
+        'STUDENTS_CHAT_ID': STUDENTS_CHAT_ID,
+        'DB_FILE': workdir / "course_bot.db",
+        'COVER_IMAGE_PATH': media_dir / "cover_image.jpg",
+        'LECTURER_IMAGE_PATH': media_dir / "lecturer_image.jpg",
+        'REVIEWS_PATH': media_dir / "reviews",
+        'HEALTH_FILE': workdir / "health.json",
+    }
+    for name, value in settings.items():
+        setattr(config, name, value)
+
+    api = FakeBotAPI(latency=args.latency, jitter=args.jitter, seed=args.seed)
+    await api.start()
+    dispatcher = Dispatcher(
+        workers=workers,
+        socket_path=workdir / "shards.sock",
+        token=TOKEN,
+        base_url=api.base_url,
+        overrides=settings
+    )
+    await dispatcher.start()
+
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    users = asyncio.Queue()
+    for n in range(args.users):
+        users.put_nowait(SyntheticUser(n))
+
+    async def worker():
+        while not users.empty():
+            await play_user(api, users.get_nowait(), args, latencies, errors)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+
+    await dispatcher.stop()
+    await api.stop()
+    values = sorted(v for step in latencies.values() for v in step)
+    return {
+        'workers': workers,
+        'elapsed': elapsed,
+        'updates': len(values),
+        'timeouts': sum(errors.values()),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+    }
+
+async def run(args):
+    counts = [int(n) for n in args.workers.split(',')]
+    print(f"{args.users} users, {args.concurrency} concurrent, {os.cpu_count()} CPU cores")
+    print()
+    print(f"{'workers':<9}{'updates/s':>11}{'speedup':>9}{'timeouts':>10}{'p50 ms':>9}{'p95 ms':>9}")
+    baseline = None
+    for workers in counts:
+        result = await run_once(args, workers)
+        throughput = result['updates'] / result['elapsed']
+        baseline = baseline or throughput
+        print(f"{workers:<9}{throughput:>11.0f}{throughput / baseline:>8.2f}x{result['timeouts']:>10}"
+              f"{result['p50'] * 1000:>9.1f}{result['p95'] * 1000:>9.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', default='1,2,4', help="Comma-separated worker counts to compare")
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every API call")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Extra random API delay, up to SECONDS")
+    parser.add_argument('--think-time', type=float, default=0.0, help="Random pause between a user's steps")
+    parser.add_argument('--step-timeout', type=float, default=10.0)
+    parser.add_argument('--reviews', type=int, default=12, help="Generated review images")
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='funnel')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(args.log_level)
+    asyncio.run(run(args))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: escaping on every .format() vs precompiled, memoized templates
+
+Usage: python -m benchmarks.templates [--iterations N]
+"""
+
+import argparse
+import timeit
+import config
+import templates
+import text_constants
+
+INVITE_LINK = "https://t.me/+AbCdEf_123-xyz"
+
+COURSE = templates.CourseTexts(config.COURSE_TITLE, config.COURSE_PRICE)
+
+def legacy_access_paid() -> str:
+    return text_constants.ACCESS_SUCCESS.format(
+        course_title=text_constants.escape_markdown(config.COURSE_TITLE),
+        invite_link=text_constants.escape_markdown(INVITE_LINK)
+    )
+
+def legacy_access_not_purchased() -> str:
+    price_str = text_constants.escape_markdown(f"{config.COURSE_PRICE / 100:,.0f}".replace(',', ' '))
+    return text_constants.ACCESS_NOT_PURCHASED.format(
+        course_title=text_constants.escape_markdown(config.COURSE_TITLE),
+        course_price=price_str
+    )
+
+def template_access_paid() -> str:
+    return COURSE.access_success(INVITE_LINK)
+
+def template_access_not_purchased() -> str:
+    return COURSE.access_not_purchased
+
+CASES = [
+    ("access, paid", legacy_access_paid, template_access_paid),
+    ("access, not purchased", legacy_access_not_purchased, template_access_not_purchased),
+]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200000)
+    args = parser.parse_args()
+
+    print(f"{'case':<24}{'legacy, ns':>12}{'template, ns':>14}{'speedup':>10}")
+    for name, legacy, compiled in CASES:
+        assert legacy() == compiled(), f"Output mismatch in {name}"
+        legacy_ns = timeit.timeit(legacy, number=args.iterations) / args.iterations * 1e9
+        compiled_ns = timeit.timeit(compiled, number=args.iterations) / args.iterations * 1e9
+        print(f"{name:<24}{legacy_ns:>12.0f}{compiled_ns:>14.0f}{legacy_ns / compiled_ns:>9.1f}x")
+
+if __name__ == '__main__':
+    main()
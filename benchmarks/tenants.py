@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Memory cost of hosting several course bots in one process
+
+Starts N tenants through tenants.TenantRunner against the local fake Bot
+API and reports how much the process RSS grew while each one started.
+The first tenant also pays for what the rest share (HTTP pools, database
+threads, imported code), so the marginal cost is the median over the
+others. --isolated gives every bot its own pools and threads instead,
+which is what N separate single-bot setups would each need.
+
+A temporary directory holds the databases and generated media, so
+nothing in /app is touched.
+
+Usage: python -m benchmarks.tenants [--tenants N] [--isolated] [--reviews N]
+"""
+
+import argparse
+import asyncio
+import logging
+import statistics
+import tempfile
+from pathlib import Path
+import config
+from tenants import Tenant, TenantRunner, rss_bytes
+from benchmarks.bot_load import STUDENTS_CHAT_ID, make_media
+from benchmarks.fake_bot_api import FakeBotAPI
+
+MIB = 2 ** 20
+
+async def run(args):
+    workdir = Path(tempfile.mkdtemp(prefix="bot_tenants_"))
+    config.BOT_MODE = "polling"
+    config.METRICS_PORT = 0
+    config.BACKUP_INTERVAL = 0
+    config.HEALTH_FILE = workdir / "health.json"
+
+    api = FakeBotAPI()
+    await api.start()
+    tenants = []
+    for n in range(args.tenants):
+        token = f"{100000 + n}:fake-tenant-{n}"
+        api.add_token(token)
+        tenant = Tenant(
+            name=f"course{n}",
+            token=token,
+            provider_token="fake-provider-token",
+            students_chat_id=STUDENTS_CHAT_ID,
+            media_dir=workdir / "media" / f"course{n}",
+            db_file=workdir / "data" / f"course{n}.db"
+        )
+        make_media(tenant.media_dir, args.reviews)
+        tenants.append(tenant)
+
+    before = rss_bytes()
+    runner = TenantRunner(tenants, base_url=api.base_url, shared=not args.isolated)
+    await runner.start()
+    total = rss_bytes() - before
+    report = runner.memory_report()
+    await runner.stop()
+    await api.stop()
+
+    print(f"tenants:     {len(report)} ({'isolated' if args.isolated else 'shared'} pools and threads)")
+    print(f"total:       +{total / MIB:.1f} MiB RSS, {rss_bytes() / MIB:.1f} MiB at the end")
+    print(f"first:       +{report[0]['startup_rss_bytes'] / MIB:.2f} MiB")
+    if len(report) > 1:
+        marginal = statistics.median(row['startup_rss_bytes'] for row in report[1:])
+        print(f"marginal:    +{marginal / MIB:.2f} MiB per further tenant (median)")
+    print()
+    print(f"{'tenant':<12}{'MiB':>8}{'file_ids':>10}{'invoices':>10}")
+    for row in report:
+        print(f"{row['tenant']:<12}{row['startup_rss_bytes'] / MIB:>8.2f}"
+              f"{row['media_file_ids']:>10}{row['pending_invoices']:>10}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tenants', type=int, default=10)
+    parser.add_argument('--isolated', action='store_true', help="Separate HTTP pools and DB threads per bot")
+    parser.add_argument('--reviews', type=int, default=12, help="Generated review images per tenant")
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(args.log_level)
+    asyncio.run(run(args))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Webhook throughput harness: POSTs recorded updates at a local WebhookServer
+
+Updates are read from a JSONL file (one Telegram Update object per line) or
+generated synthetically. They go through a real Application with the
+bot's UserOrderedUpdateProcessor and AdmissionQueue, as built by
+bot.build_application in webhook mode, with a single handler that
+optionally sleeps per update to simulate slow handlers and exercise
+backpressure. The Bot API is the local fake, so no Telegram connection
+is made. --no-admission uses a plain bounded queue instead, which PTB
+empties as fast as updates arrive.
+
+Usage: python -m benchmarks.webhook_load [--updates FILE] [--requests N]
+       [--concurrency N] [--queue-size N] [--handler-delay SECONDS]
+       [--workers N] [--max-pending N] [--no-admission]
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+from itertools import cycle
+from pathlib import Path
+from typing import List
+import httpx
+from telegram import Update
+from telegram.ext import Application, ContextTypes, TypeHandler
+from update_processor import AdmissionQueue, UserOrderedUpdateProcessor
+from webhook import WebhookServer
+from benchmarks.fake_bot_api import TOKEN, FakeBotAPI
+
+SECRET = "benchmark-secret"
+
+def synthetic_updates(count: int) -> List[dict]:
+    updates = []
+    for i in range(count):
+        user = {'id': 1000 + i % 500, 'is_bot': False, 'first_name': 'Load'}
+        updates.append({
+            'update_id': i,
+            'message': {
+                'message_id': i,
+                'date': int(time.time()),
+                'chat': {'id': user['id'], 'type': 'private'},
+                'from': user,
+                'text': '/start',
+                'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}]
+            }
+        })
+    return updates
+
+def load_updates(path: Path) -> List[dict]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+async def sample(application: Application, peaks: Counter):
+    """Track the most updates buffered and in flight at once"""
+    while True:
+        peaks['queue'] = max(peaks['queue'], application.update_queue.qsize())
+        peaks['tasks'] = max(peaks['tasks'], len(asyncio.all_tasks()))
+        peaks['queue_depth'] = max(peaks['queue_depth'], application.update_processor.stats()['queue_depth'])
+        await asyncio.sleep(0.01)
+
+async def run(args):
+    updates = load_updates(args.updates) if args.updates else synthetic_updates(args.requests)
+    bodies = [json.dumps(update).encode() for update in updates]
+
+    api = FakeBotAPI()
+    await api.start()
+    processor = UserOrderedUpdateProcessor(workers=args.workers, max_pending=args.max_pending)
+    if args.no_admission:
+        queue = asyncio.Queue(maxsize=args.queue_size)
+    else:
+        queue = AdmissionQueue(processor, maxsize=args.queue_size)
+    application = (
+        Application.builder()
+        .token(TOKEN)
+        .base_url(f"{api.base_url}/bot")
+        .updater(None)
+        .concurrent_updates(processor)
+        .update_queue(queue)
+        .build()
+    )
+    processed = Counter()
+
+    async def handle(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if args.handler_delay:
+            await asyncio.sleep(args.handler_delay)
+        processed['updates'] += 1
+
+    application.add_handler(TypeHandler(Update, handle))
+    await application.initialize()
+    await application.start()
+
+    server = WebhookServer(
+        application.bot,
+        application.update_queue,
+        listen='127.0.0.1',
+        port=0,
+        url_path='/telegram',
+        secret_token=SECRET,
+        queue_timeout=args.queue_timeout
+    )
+    await server.start()
+    url = f"http://127.0.0.1:{server.http.bound_port}/telegram"
+
+    peaks = Counter()
+    sampler = asyncio.create_task(sample(application, peaks))
+    statuses = Counter()
+    payloads = cycle(bodies)
+
+    async def client(requests: int):
+        headers = {'Content-Type': 'application/json', 'X-Telegram-Bot-Api-Secret-Token': SECRET}
+        async with httpx.AsyncClient() as http:
+            for _ in range(requests):
+                response = await http.post(url, content=next(payloads), headers=headers)
+                statuses[response.status_code] += 1
+
+    per_client = args.requests // args.concurrency
+    start = time.perf_counter()
+    await asyncio.gather(*(client(per_client) for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+
+    sampler.cancel()
+    left = application.update_queue.qsize()
+    await server.stop()
+    await application.update_queue.join()
+    await application.stop()
+    await application.shutdown()
+    await api.stop()
+
+    total = per_client * args.concurrency
+    print(f"requests:    {total} in {elapsed:.2f}s ({total / elapsed:.0f} req/s)")
+    print(f"statuses:    {dict(statuses)}")
+    print(f"processed:   {processed['updates']} updates, {left} left in queue")
+    print(f"peaks:       {peaks['queue']} queued, {peaks['queue_depth']} waiting in the processor, "
+          f"{peaks['tasks']} asyncio tasks")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=Path, help="JSONL file with recorded updates")
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--queue-size', type=int, default=1000)
+    parser.add_argument('--queue-timeout', type=float, default=1.0)
+    parser.add_argument('--handler-delay', type=float, default=0.0)
+    parser.add_argument('--workers', type=int, default=8, help="Updates handled in parallel")
+    parser.add_argument('--max-pending', type=int, default=1024, help="Updates admitted into the processor")
+    parser.add_argument('--no-admission', action='store_true', help="Plain bounded queue, no admission control")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
@@ -3,18 +3,21 @@ Telegram Bot for Course Sales and Management
 Updated by RainZerg on 2025-03-24 12:55:43 UTC
 """
 
+# First import, so the startup timer covers everything below
+import startup
+import asyncio
+import json
 import logging
 import re
+import signal
+import time
 from pathlib import Path
-from typing import Optional, Dict, Any, Tuple
+from typing import Optional, Dict, Any, Set, Tuple
 from telegram import (
+    Bot,
     Update, 
-    InlineKeyboardButton, 
     InlineKeyboardMarkup, 
-    InputMediaPhoto,
-    KeyboardButton, 
     ReplyKeyboardMarkup,
-    ReplyKeyboardRemove,
     Contact
 )
 from telegram.ext import (
@@ -27,19 +30,56 @@ from telegram.ext import (
     filters,
     ConversationHandler
 )
+from telegram.request import BaseRequest
+from telegram.error import Forbidden
 import config
-import text_constants
-from text_constants import *
+from text_constants import (
+    BROADCAST_STARTED,
+    BROADCAST_USAGE,
+    FUNNEL_HEADER,
+    FUNNEL_PERIOD_ALL,
+    FUNNEL_PERIOD_DAYS,
+    FUNNEL_STEP,
+    FUNNEL_USAGE,
+    CONTACT_MESSAGE,
+    COURSE_DESCRIPTION,
+    GENERAL_ERROR,
+    LECTURER_INFO,
+    NO_REVIEWS_MESSAGE,
+    PAYMENT_EMAIL_INVALID,
+    PAYMENT_EMAIL_REQUEST,
+    PAYMENT_INFO_THANKS,
+    PAYMENT_NAME_REQUEST,
+    PAYMENT_PHONE_INVALID,
+    PAYMENT_PHONE_MANUAL_REQUEST,
+    PAYMENT_PHONE_REQUEST,
+    REVIEWS_MESSAGE
+)
+import templates
 from payment_handler import PaymentHandler, CustomerInfo
+from media_cache import MediaRegistry
+from navigation import Navigator, Screen
+from reviews import ReviewsAlbum
+from markups import (
+    registry as markups,
+    CUSTOM_NAME_BUTTON_TEXT,
+    MANUAL_PHONE_BUTTON_TEXT,
+    PROFILE_NAME_BUTTON_PREFIX
+)
+from update_processor import AdmissionQueue, UserOrderedUpdateProcessor
+from broadcast import BroadcastEngine
+from persistence import SQLitePersistence
+import metrics
+from backup_job import BackupJob
+from health import HealthMonitor
+from outbox import DELIVER_ACCESS, Outbox, OutboxEntry, Undeliverable
+from analytics import AnalyticsLog
 
 # States for conversation handler
 AWAITING_EMAIL = 1
 AWAITING_NAME = 2
 AWAITING_PHONE = 3
 
-# Constants
-PHONE_BUTTON_TEXT = "📱 Отправить номер телефона"
-
 # Set up logging
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -50,8 +90,91 @@ logger = logging.getLogger(__name__)
 class BotHandlers:
     """Centralized class for bot handlers and utilities"""
     
-    def __init__(self, payment_handler: PaymentHandler):
+    def __init__(
+        self,
+        payment_handler: PaymentHandler,
+        media_dir: Optional[Path] = None,
+        admin_ids: Optional[Set[int]] = None,
+        health_file: Optional[Path] = config.HEALTH_FILE,
+        serve_metrics: bool = True,
+        primary: bool = True
+    ):
+        """media_dir and admin_ids default to config; tenants.py passes its own per hosted bot.
+
+        Of several processes serving one bot (see sharding.py) only the
+        primary one delivers the outbox, sends broadcasts, refills the
+        invite pool and takes backups.
+        """
         self.payment_handler = payment_handler
+        self.primary = primary
+        self.admin_ids = config.ADMIN_IDS if admin_ids is None else admin_ids
+        self.cover_image_path = media_dir / "cover_image.jpg" if media_dir else config.COVER_IMAGE_PATH
+        self.lecturer_image_path = media_dir / "lecturer_image.jpg" if media_dir else config.LECTURER_IMAGE_PATH
+        self.media = MediaRegistry(payment_handler.db)
+        self.reviews = ReviewsAlbum(media_dir / "reviews" if media_dir else config.REVIEWS_PATH, self.media)
+        self.navigator = Navigator(self.media)
+        # Title and price as on this bot's invoices
+        self.texts = templates.CourseTexts(payment_handler.course_title, payment_handler.amount)
+        self.screens = {
+            'about_course': Screen(COURSE_DESCRIPTION, self.get_back_button()),
+            'about_lecturer': Screen(LECTURER_INFO, self.get_back_button(), photo=self.lecturer_image_path),
+            'contact': Screen(CONTACT_MESSAGE, self.get_contact_buttons(), parse_mode=None),
+            'no_reviews': Screen(NO_REVIEWS_MESSAGE, self.get_back_button()),
+        }
+        self.broadcasts = BroadcastEngine(payment_handler.db, send=primary)
+        self.outbox = Outbox(payment_handler.db)
+        self.outbox.register(DELIVER_ACCESS, self.deliver_access)
+        self.analytics = AnalyticsLog(payment_handler.db)
+        self.metrics_server = metrics.MetricsServer() if serve_metrics and config.METRICS_PORT else None
+        self._post_init_done = 0.0
+        self.health = HealthMonitor(payment_handler.db, health_file=health_file)
+        if self.metrics_server:
+            self.metrics_server.http.route('GET', '/health', self.health.handle_health)
+
+    async def post_init(self, application: Application) -> None:
+        """Warm caches before the first update is processed"""
+        with startup.timer.phase('cache warmup'):
+            await asyncio.gather(
+                self.payment_handler.db.warm_access_cache(),
+                self.payment_handler.invite_pool.load(),
+                self.payment_handler.invoices.load(),
+                self.media.warm(),
+                self.warm_reviews()
+            )
+        if self.primary:
+            await self.broadcasts.resume(application.bot)
+            await self.outbox.start(application.bot)
+        await self.analytics.start()
+        await self.health.start(application)
+        if self.metrics_server:
+            await self.metrics_server.start()
+
+        self._post_init_done = time.perf_counter()
+
+    async def warm_reviews(self) -> None:
+        """Scan the reviews directory off the loop and build every pager keyboard"""
+        await asyncio.to_thread(self.reviews.scan)
+        for page in range(self.reviews.page_count):
+            markups.reviews_keyboard(page + 1 if page + 1 < self.reviews.page_count else None)
+
+    def serving(self) -> None:
+        """Log startup timings; called once polling or the webhook has started and the application runs"""
+        if startup.timer.logged:
+            # Another bot in this process got there first
+            return
+        startup.timer.mark('start receiving', time.perf_counter() - self._post_init_done)
+        if self.payment_handler.db.schema_seconds is not None:
+            startup.timer.mark('db schema (background)', self.payment_handler.db.schema_seconds)
+        startup.timer.log()
+
+    async def post_stop(self, application: Application) -> None:
+        """Checkpoint background work before the bot goes down"""
+        await self.broadcasts.shutdown()
+        await self.outbox.stop()
+        await self.analytics.stop()
+        await self.health.stop()
+        if self.metrics_server:
+            await self.metrics_server.stop()
 
     async def handle_access_check(self, user_id: int, context: ContextTypes.DEFAULT_TYPE) -> Tuple[bool, Optional[str]]:
         """Centralized access checking logic"""
@@ -63,15 +186,10 @@ class BotHandlers:
     async def generate_access_response(self, has_paid: bool, invite_link: Optional[str] = None) -> Tuple[str, InlineKeyboardMarkup]:
         """Centralized response generation for access checks"""
         if has_paid:
-            escaped_link = escape_markdown(invite_link) if invite_link else None
-            text = (ACCESS_SUCCESS.format(invite_link=escaped_link) 
-                   if escaped_link else ACCESS_SUCCESS_NO_LINK)
+            text = (self.texts.access_success(invite_link)
+                   if invite_link else self.texts.access_success_no_link)
         else:
-            price_str = escape_markdown(f"{config.COURSE_PRICE / 100:,.0f}".replace(',', ' '))
-            text = ACCESS_NOT_PURCHASED.format(
-                course_title=text_constants.COURSE_TITLE_ESCAPED,
-                course_price=price_str
-            )
+            text = self.texts.access_not_purchased
         keyboard = await self.get_start_keyboard(has_paid)
         return text, keyboard
 
@@ -84,78 +202,41 @@ class BotHandlers:
 
     @staticmethod
     def get_phone_keyboard() -> ReplyKeyboardMarkup:
-        """Creates a reply keyboard with phone number request button"""
-        return ReplyKeyboardMarkup([
-            [KeyboardButton(PHONE_BUTTON_TEXT, request_contact=True)],
-            [KeyboardButton("📝 Ввести номер вручную")],
-            [KeyboardButton(CANCEL_BUTTON)]
-        ], resize_keyboard=True)
+        """Returns the reply keyboard with phone number request button"""
+        return markups.phone_keyboard
 
     @staticmethod
     def get_cancel_keyboard() -> InlineKeyboardMarkup:
-        """Creates an inline keyboard with cancel button"""
-        return InlineKeyboardMarkup([[
-            InlineKeyboardButton(CANCEL_BUTTON, callback_data="cancel_payment")
-        ]])
+        """Returns the inline keyboard with cancel button"""
+        return markups.cancel_keyboard
 
     @staticmethod
     def get_back_button() -> InlineKeyboardMarkup:
-        """Creates an inline keyboard with back button"""
-        return InlineKeyboardMarkup([[
-            InlineKeyboardButton(BACK_BUTTON, callback_data="start")
-        ]])
+        """Returns the inline keyboard with back button"""
+        return markups.back_button
 
     @staticmethod
     def get_contact_buttons() -> InlineKeyboardMarkup:
-        """Creates contact buttons"""
-        return InlineKeyboardMarkup([
-            [InlineKeyboardButton(WRITE_BUTTON, url="https://t.me/Kalypina")],
-            [InlineKeyboardButton(BACK_BUTTON, callback_data="start")]
-        ])
+        """Returns contact buttons"""
+        return markups.contact_buttons
+
+    @staticmethod
+    def get_reviews_keyboard(next_page: Optional[int] = None) -> InlineKeyboardMarkup:
+        """Returns reviews keyboard with optional pager button"""
+        return markups.reviews_keyboard(next_page)
 
     async def get_start_keyboard(self, has_paid: bool) -> InlineKeyboardMarkup:
-        """Creates the main menu keyboard based on user's access status"""
-        keyboard = [
-            [InlineKeyboardButton(MENU_ABOUT_COURSE, callback_data="about_course")],
-            [InlineKeyboardButton(MENU_ABOUT_LECTURER, callback_data="about_lecturer")],
-            [InlineKeyboardButton(
-                MENU_ACCESS if has_paid else MENU_PURCHASE, 
-                callback_data="access" if has_paid else "purchase"
-            )],
-            [InlineKeyboardButton(MENU_REVIEWS, callback_data="reviews")],
-            [InlineKeyboardButton(MENU_CONTACT, callback_data="contact")]
-        ]
-        return InlineKeyboardMarkup(keyboard)
-
-    async def send_photo_message(
-        self,
-        chat_id: int, 
-        photo_path: Path, 
-        caption: str, 
-        keyboard: InlineKeyboardMarkup,
-        context: ContextTypes.DEFAULT_TYPE
-    ) -> None:
-        """Helper function to send photo messages"""
-        try:
-            with open(photo_path, 'rb') as photo:
-                await context.bot.send_photo(
-                    chat_id=chat_id,
-                    photo=photo,
-                    caption=caption,
-                    parse_mode='MarkdownV2',
-                    reply_markup=keyboard
-                )
-        except FileNotFoundError:
-            logger.error(f"Photo not found: {photo_path}")
-            await context.bot.send_message(
-                chat_id=chat_id,
-                text=caption,
-                parse_mode='MarkdownV2',
-                reply_markup=keyboard
-            )
-        except Exception as e:
-            logger.error(f"Error sending photo message: {e}")
-            raise
+        """Returns the main menu keyboard based on user's access status"""
+        return markups.start_keyboard(has_paid)
+
+    async def show_screen(self, update: Update, context: ContextTypes.DEFAULT_TYPE, screen: Screen,
+                          edit: bool = True) -> None:
+        """Edit the tapped menu message into screen, or send screen as a new message"""
+        query = update.callback_query
+        if edit and query and query.message:
+            await self.navigator.show(context.bot, query.message, screen)
+        else:
+            await self.navigator.send(context.bot, update.effective_chat.id, screen)
 
     async def handle_email(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         """Handler for processing email input"""
@@ -173,23 +254,16 @@ class BotHandlers:
         
         # Store email in user data
         context.user_data['email'] = email
+        self.analytics.record('email', update.effective_user.id)
         
         # Get user's full name from Telegram
         user = update.effective_user
         full_name = f"{user.first_name} {user.last_name if user.last_name else ''}"
         
-        # Create keyboard with options
-        keyboard = [
-            [KeyboardButton(f"✅ Использовать имя из профиля: {full_name}")],
-            [KeyboardButton("📝 Ввести другое имя")],
-            [KeyboardButton(CANCEL_BUTTON)]
-        ]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        
         await update.message.reply_text(
-            text=USE_PROFILE_NAME_REQUEST.format(full_name=full_name),
+            text=templates.USE_PROFILE_NAME_REQUEST.render(full_name=full_name),
             parse_mode='MarkdownV2',
-            reply_markup=reply_markup
+            reply_markup=markups.profile_name_keyboard(full_name)
         )
         
         return AWAITING_NAME
@@ -199,14 +273,14 @@ class BotHandlers:
         message_text = update.message.text.strip()
         
         # If user chose to use profile name
-        if message_text.startswith("✅ Использовать имя из профиля:"):
+        if message_text.startswith(PROFILE_NAME_BUTTON_PREFIX):
             user = update.effective_user
             full_name = f"{user.first_name} {user.last_name if user.last_name else ''}"
             context.user_data['full_name'] = full_name
             return await self.request_phone(update, context)
         
         # If user wants to enter different name
-        if message_text == "📝 Ввести другое имя":
+        if message_text == CUSTOM_NAME_BUTTON_TEXT:
             await update.message.reply_text(
                 text=PAYMENT_NAME_REQUEST,
                 parse_mode='MarkdownV2',
@@ -225,17 +299,11 @@ class BotHandlers:
 
     async def request_phone(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         """Request phone number with options"""
-        keyboard = [
-            [KeyboardButton(PHONE_BUTTON_TEXT, request_contact=True)],
-            [KeyboardButton("📝 Ввести номер вручную")],
-            [KeyboardButton(CANCEL_BUTTON)]
-        ]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        
+        self.analytics.record('name', update.effective_user.id)
         await update.message.reply_text(
             text=PAYMENT_PHONE_REQUEST,
             parse_mode='MarkdownV2',
-            reply_markup=reply_markup
+            reply_markup=self.get_phone_keyboard()
         )
         
         return AWAITING_PHONE
@@ -244,7 +312,7 @@ class BotHandlers:
         """Handler for processing phone number input"""
         message_text = update.message.text.strip() if update.message.text else None
         
-        if message_text == "📝 Ввести номер вручную":
+        if message_text == MANUAL_PHONE_BUTTON_TEXT:
             await update.message.reply_text(
                 text=PAYMENT_PHONE_MANUAL_REQUEST,
                 parse_mode='MarkdownV2',
@@ -277,7 +345,7 @@ class BotHandlers:
         await update.message.reply_text(
             text=PAYMENT_INFO_THANKS,
             parse_mode='MarkdownV2',
-            reply_markup=ReplyKeyboardRemove()
+            reply_markup=markups.remove_keyboard
         )
         
         # Create customer info object
@@ -290,37 +358,31 @@ class BotHandlers:
         # Send invoice
         try:
             await self.payment_handler.send_invoice(update, context, customer_info)
+            self.analytics.record('invoice', update.effective_user.id)
         except Exception as e:
             logger.error(f"Error sending invoice: {e}")
             await update.message.reply_text(
-                text=PAYMENT_ERROR,
+                text=self.texts.payment_error,
                 parse_mode='MarkdownV2'
             )
         
         return ConversationHandler.END
 
-    async def handle_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    async def handle_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE, edit: bool = True) -> None:
         """Handler for /start command and start callback"""
         user_id = update.effective_user.id
+        if update.message:
+            # Menu buttons leading here are recorded by handle_button
+            self.analytics.record('start', user_id)
         has_paid, _ = await self.payment_handler.get_access_status(user_id)
         keyboard = await self.get_start_keyboard(has_paid)
         
         try:
-            if config.COVER_IMAGE_PATH.exists():
-                await self.send_photo_message(
-                    chat_id=update.effective_chat.id,
-                    photo_path=config.COVER_IMAGE_PATH,
-                    caption=WELCOME_BACK if context.user_data.get('seen_start') else WELCOME_NEW,
-                    keyboard=keyboard,
-                    context=context
-                )
-            else:
-                await context.bot.send_message(
-                    chat_id=update.effective_chat.id,
-                    text=WELCOME_BACK if context.user_data.get('seen_start') else WELCOME_NEW,
-                    parse_mode='MarkdownV2',
-                    reply_markup=keyboard
-                )
+            await self.show_screen(update, context, Screen(
+                self.texts.welcome_back if context.user_data.get('seen_start') else self.texts.welcome_new,
+                keyboard,
+                photo=self.cover_image_path
+            ), edit=edit)
             context.user_data['seen_start'] = True
             
         except Exception as e:
@@ -335,6 +397,8 @@ class BotHandlers:
         """Unified handler for button callbacks"""
         query = update.callback_query
         user_id = query.from_user.id
+        # Reviews pages are one event, not one per page
+        self.analytics.record(query.data.split(":", 1)[0], user_id)
         try:
             await query.answer()
 
@@ -346,16 +410,19 @@ class BotHandlers:
                     await query.message.delete()
                     await context.bot.send_message(
                         chat_id=query.message.chat_id,
-                        text=PAYMENT_CANCELLED,
+                        text=self.texts.payment_cancelled,
                         parse_mode='MarkdownV2',
-                        reply_markup=ReplyKeyboardRemove()
+                        reply_markup=markups.remove_keyboard
                     )
-                    await self.handle_start(update, context)
+                    # Below the cancellation notice, not in place of the deleted message
+                    await self.handle_start(update, context, edit=False)
                     return ConversationHandler.END
                 case "about_course" | "about_lecturer" | "contact" | "reviews":
                     await self.handle_info_request(update, context, query.data)
                 case "access":
                     await self.handle_access_request(update, context)
+                case str(data) if data.startswith("reviews:"):
+                    await self.handle_reviews(update, context, int(data.split(":", 1)[1]))
                 case "purchase":
                     self.cleanup_user_data(context)
                     await query.message.reply_text(
@@ -366,9 +433,7 @@ class BotHandlers:
                     await query.message.delete()
                     return AWAITING_EMAIL
                 case _:
-                    pass
-
-            await query.message.delete()
+                    await query.message.delete()
         except Exception as e:
             logger.error(f"Error in button handler for user {user_id}: {e}")
             keyboard = await self.get_start_keyboard(False)
@@ -380,177 +445,335 @@ class BotHandlers:
 
     async def handle_info_request(self, update: Update, context: ContextTypes.DEFAULT_TYPE, info_type: str) -> None:
         """Handler for information requests (about course, lecturer, contact)"""
-        chat_id = update.effective_chat.id
-        
         match info_type:
-            case "about_course":
-                await context.bot.send_message(
-                    chat_id=chat_id,
-                    text=COURSE_DESCRIPTION,
-                    parse_mode='MarkdownV2',
-                    reply_markup=self.get_back_button()
-                )
-            
-            case "about_lecturer":
-                if config.LECTURER_IMAGE_PATH.exists():
-                    await self.send_photo_message(
-                        chat_id=chat_id,
-                        photo_path=config.LECTURER_IMAGE_PATH,
-                        caption=LECTURER_INFO,
-                        keyboard=self.get_back_button(),
-                        context=context
-                    )
-                else:
-                    await context.bot.send_message(
-                        chat_id=chat_id,
-                        text=LECTURER_INFO,
-                        parse_mode='MarkdownV2',
-                        reply_markup=self.get_back_button()
-                    )
-            
-            case "contact":
-                await context.bot.send_message(
-                    chat_id=chat_id,
-                    text=CONTACT_MESSAGE,
-                    reply_markup=self.get_contact_buttons()
-                )
+            case "about_course" | "about_lecturer" | "contact":
+                await self.show_screen(update, context, self.screens[info_type])
             case "reviews":
-                media_group = []
-                try:
-                    reviews_path = config.REVIEWS_PATH
-                    for review_file in reviews_path.glob('*.jpg'):
-                            with open(review_file, 'rb') as photo:
-                                media_group.append(InputMediaPhoto(media=photo))
-                    if media_group:
-                            await context.bot.send_media_group(
-                                chat_id=chat_id,
-                                media=media_group
-                            )
-                            await context.bot.send_message(
-                                chat_id=chat_id,
-                                text=REVIEWS_MESSAGE,
-                                parse_mode='MarkdownV2',
-                                reply_markup=self.get_back_button()
-                            )
-                    else:
-                        await context.bot.send_message(
-                                chat_id=chat_id,
-                                text=NO_REVIEWS_MESSAGE,
-                                parse_mode='MarkdownV2',
-                                reply_markup=self.get_back_button()
-                            )
-                except Exception as e:
-                        logger.error(f"Error sending reviews: {e}")
-                        await context.bot.send_message(
-                            chat_id=chat_id,
-                            text=GENERAL_ERROR,
-                            reply_markup=self.get_back_button()
-                        )
+                await self.handle_reviews(update, context, 0)
             case _:
                 await self.handle_start(update, context)
 
+    async def handle_reviews(self, update: Update, context: ContextTypes.DEFAULT_TYPE, page: int) -> None:
+        """Sends one album of reviews followed by the pager message"""
+        chat_id = update.effective_chat.id
+        try:
+            if not await self.reviews.send_page(context.bot, chat_id, page):
+                await self.show_screen(update, context, self.screens['no_reviews'])
+                return
+            next_page = page + 1 if page + 1 < self.reviews.page_count else None
+            await context.bot.send_message(
+                chat_id=chat_id,
+                text=REVIEWS_MESSAGE,
+                parse_mode='MarkdownV2',
+                reply_markup=self.get_reviews_keyboard(next_page)
+            )
+        except Exception as e:
+            logger.error(f"Error sending reviews: {e}")
+            await context.bot.send_message(
+                chat_id=chat_id,
+                text=GENERAL_ERROR,
+                reply_markup=self.get_back_button()
+            )
+        # The album can't be edited into the menu message, so the pager replaces it below
+        await update.callback_query.message.delete()
+
     async def handle_access_request(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Only handles access checks, payment is handled by conversation"""
         user_id = update.effective_user.id
-        chat_id = update.effective_chat.id
         
         has_paid, invite_link = await self.handle_access_check(user_id, context)
         text, keyboard = await self.generate_access_response(has_paid, invite_link)
-        
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=text,
-            parse_mode='MarkdownV2',
-            reply_markup=keyboard
-        )
+        await self.show_screen(update, context, Screen(text, keyboard))
+
+    async def handle_broadcast(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Admin command: /broadcast <text>, or reply /broadcast to a message to copy it"""
+        user_id = update.effective_user.id
+        if user_id not in self.admin_ids:
+            return
+
+        replied = update.message.reply_to_message
+        text = " ".join(context.args) if context.args else None
+        if replied:
+            broadcast_id = await self.broadcasts.start(
+                context.bot,
+                created_by=user_id,
+                source_chat_id=replied.chat_id,
+                source_message_id=replied.message_id
+            )
+        elif text:
+            broadcast_id = await self.broadcasts.start(context.bot, created_by=user_id, text=text)
+        else:
+            await update.message.reply_text(BROADCAST_USAGE)
+            return
+        await update.message.reply_text(BROADCAST_STARTED.format(broadcast_id=broadcast_id))
+
+    async def handle_funnel(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Admin command: /funnel [days], users reaching each funnel step and conversion between steps"""
+        try:
+            days = float(context.args[0]) if context.args else None
+        except ValueError:
+            await update.message.reply_text(FUNNEL_USAGE)
+            return
+        # Include what is still buffered
+        await self.analytics.flush()
+        steps = await self.analytics.funnel(time.time() - days * 86400 if days else 0.0)
+
+        first = steps[0][1]
+        previous = first
+        lines = [FUNNEL_HEADER.format(period=FUNNEL_PERIOD_DAYS.format(days=f"{days:g}") if days else FUNNEL_PERIOD_ALL)]
+        for step, users in steps:
+            lines.append(FUNNEL_STEP.format(
+                step=step,
+                users=users,
+                from_previous=100 * users / previous if previous else 0.0,
+                from_first=100 * users / first if first else 0.0
+            ))
+            previous = users
+        await update.message.reply_text("\n".join(lines))
 
     async def handle_successful_payment(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        """Handler for successful payments"""
+        """Handler for successful payments.
+
+        Records the payment and queues access delivery in one transaction,
+        then acknowledges right away; the invite link is sent by the outbox
+        worker, which retries until it gets through.
+        """
         user = update.effective_user
         payment_info = update.message.successful_payment
+        transaction_id = payment_info.provider_payment_charge_id
+        # Customer details as invoiced; user_data only for invoices from before the registry
+        invoice = self.payment_handler.invoices.get(payment_info.invoice_payload)
 
         try:
-            self.payment_handler.db.record_payment(
+            recorded = await self.payment_handler.db.record_payment_event(
                 user_id=user.id,
                 username=user.username,
-                customer_info=context.user_data,
-                transaction_id=payment_info.provider_payment_charge_id,
+                customer_info=invoice.customer_info if invoice else context.user_data,
+                transaction_id=transaction_id,
+                telegram_charge_id=payment_info.telegram_payment_charge_id,
                 amount=payment_info.total_amount / 100,
-                currency=payment_info.currency
-            )
-            
-            invite_link = await self.payment_handler.create_invite_link(user.id, context)
-            text, keyboard = await self.generate_access_response(True, invite_link)
-            
-            await update.message.reply_text(
-                text=text,
-                parse_mode='MarkdownV2',
-                reply_markup=keyboard
+                currency=payment_info.currency,
+                chat_id=update.effective_chat.id,
+                outbox_kind=DELIVER_ACCESS,
+                outbox_payload=json.dumps({'transaction_id': transaction_id})
             )
-            
-            self.cleanup_user_data(context)
-            
         except Exception as e:
-            logger.error(f"Error in payment handler for user {user.id}: {e}")
-            await update.message.reply_text(GENERAL_ERROR)
-
-def main():
-    """Main function to start the bot"""
-    try:
-        # Initialize bot handlers
-        payment_handler = PaymentHandler(
-            provider_token=config.PROVIDER_TOKEN,
-            currency=config.CURRENCY,
-            students_chat_id=config.STUDENTS_CHAT_ID
+            logger.error(f"Error recording payment {transaction_id} for user {user.id}: {e}")
+            await update.message.reply_text(GENERAL_ERROR, parse_mode='MarkdownV2')
+            return
+
+        if not recorded:
+            logger.info(f"Payment {transaction_id} for user {user.id} already recorded, ignoring duplicate")
+            return
+        self.outbox.notify()
+        self.analytics.record('payment', user.id)
+        self.cleanup_user_data(context)
+        await self.payment_handler.invoices.consume(payment_info.invoice_payload)
+        await update.message.reply_text(
+            templates.PAYMENT_RECEIVED.render(transaction_id=transaction_id),
+            parse_mode='MarkdownV2'
         )
-        handlers = BotHandlers(payment_handler)
-        
-        # Build application
-        application = Application.builder().token(config.TOKEN).build()
 
-        # Add handlers
-
-        application.add_handler(CommandHandler("start", handlers.handle_start))
-        application.add_handler(CommandHandler("help", lambda u, c: u.message.reply_text(
-            HELP_TEXT, parse_mode='MarkdownV2'
-        )))
-        
-        # Add payment conversation handler
-        payment_conv_handler = ConversationHandler(
-            entry_points=[
-                CallbackQueryHandler(handlers.handle_button, pattern="^purchase$")
+    async def deliver_access(self, bot: Bot, entry: OutboxEntry) -> None:
+        """Outbox handler: send a paid user their invite link"""
+        invite_link = await self.payment_handler.obtain_invite_link(entry.user_id, bot)
+        try:
+            await bot.send_message(
+                chat_id=entry.chat_id,
+                text=templates.ACCESS_PAYMENT_SUCCESS.render(
+                    transaction_id=entry.payload['transaction_id'],
+                    invite_link=invite_link
+                ),
+                parse_mode='MarkdownV2',
+                reply_markup=await self.get_start_keyboard(True)
+            )
+        except Forbidden as e:
+            raise Undeliverable(f"User blocked the bot: {e.message}") from e
+
+def build_application(
+    handlers: BotHandlers,
+    token: Optional[str] = None,
+    base_url: Optional[str] = None,
+    request: Optional[BaseRequest] = None,
+    get_updates_request: Optional[BaseRequest] = None,
+    backup_job: Optional[BackupJob] = None,
+    polling: bool = True,
+    update_queue_size: Optional[int] = None,
+    max_pending_updates: Optional[int] = None
+) -> Application:
+    """Builds the application and registers all handlers and jobs.
+
+    base_url points the bot at another Bot API server, e.g. the fake one
+    used by benchmarks/bot_load.py. request and get_updates_request let
+    several bots share connection pools (see tenants.py). With polling
+    off, updates are put on application.update_queue by the caller.
+    update_queue_size and max_pending_updates override the configured
+    limits on updates buffered and in the processor (see sharding.py).
+    """
+    webhook = config.BOT_MODE == "webhook" or not polling
+    processor = UserOrderedUpdateProcessor(max_pending=max_pending_updates or config.UPDATE_MAX_PENDING)
+    if update_queue_size is None:
+        update_queue_size = config.WEBHOOK_QUEUE_SIZE if webhook else config.POLLING_QUEUE_SIZE
+    update_queue = AdmissionQueue(processor, maxsize=update_queue_size)
+    builder = (
+        Application.builder()
+        .token(token or config.TOKEN)
+        .post_init(handlers.post_init)
+        .post_stop(handlers.post_stop)
+        .concurrent_updates(processor)
+        .update_queue(update_queue)
+        .persistence(SQLitePersistence(handlers.payment_handler.db))
+        .request(request or metrics.InstrumentedRequest(connection_pool_size=256))
+    )
+    if get_updates_request:
+        builder = builder.get_updates_request(get_updates_request)
+    if base_url:
+        builder = builder.base_url(f"{base_url}/bot").base_file_url(f"{base_url}/file/bot")
+    if webhook:
+        builder = builder.updater(None)
+    application = builder.build()
+
+    # Add handlers
+
+    application.add_handler(CommandHandler("start", handlers.handle_start))
+    application.add_handler(CommandHandler(
+        "broadcast",
+        handlers.handle_broadcast,
+        filters=filters.User(user_id=handlers.admin_ids, allow_empty=False)
+    ))
+    application.add_handler(CommandHandler(
+        "funnel",
+        handlers.handle_funnel,
+        filters=filters.User(user_id=handlers.admin_ids, allow_empty=False)
+    ))
+    application.add_handler(CommandHandler("help", lambda u, c: u.message.reply_text(
+        handlers.texts.help, parse_mode='MarkdownV2'
+    )))
+    
+    # Add payment conversation handler
+    payment_conv_handler = ConversationHandler(
+        entry_points=[
+            CallbackQueryHandler(handlers.handle_button, pattern="^purchase$")
+        ],
+        states={
+            AWAITING_EMAIL: [
+                CallbackQueryHandler(handlers.handle_button, pattern="^cancel_payment$"),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.handle_email)
             ],
-            states={
-                AWAITING_EMAIL: [
-                    CallbackQueryHandler(handlers.handle_button, pattern="^cancel_payment$"),
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.handle_email)
-                ],
-                AWAITING_NAME: [
-                    CallbackQueryHandler(handlers.handle_button, pattern="^cancel_payment$"),
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.handle_name)
-                ],
-                AWAITING_PHONE: [
-                    CallbackQueryHandler(handlers.handle_button, pattern="^cancel_payment$"),
-                    MessageHandler(
-                        filters.CONTACT | (filters.TEXT & ~filters.COMMAND),
-                        handlers.handle_phone
-                    )
-                ],
-            },
-            fallbacks=[CommandHandler('cancel', lambda u, c: handlers.cleanup_user_data(c))]
+            AWAITING_NAME: [
+                CallbackQueryHandler(handlers.handle_button, pattern="^cancel_payment$"),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.handle_name)
+            ],
+            AWAITING_PHONE: [
+                CallbackQueryHandler(handlers.handle_button, pattern="^cancel_payment$"),
+                MessageHandler(
+                    filters.CONTACT | (filters.TEXT & ~filters.COMMAND),
+                    handlers.handle_phone
+                )
+            ],
+        },
+        fallbacks=[CommandHandler('cancel', lambda u, c: handlers.cleanup_user_data(c))],
+        name="purchase",
+        persistent=True
+    )
+
+    # Add payment handlers
+    application.add_handler(payment_conv_handler)
+    application.add_handler(CallbackQueryHandler(handlers.handle_button))
+    application.add_handler(PreCheckoutQueryHandler(handlers.payment_handler.handle_pre_checkout_query))
+    application.add_handler(MessageHandler(
+        filters.SUCCESSFUL_PAYMENT,
+        handlers.handle_successful_payment
+    ))
+
+    # Background jobs
+    if handlers.primary:
+        application.job_queue.run_repeating(
+            handlers.payment_handler.invite_pool.refill_job,
+            interval=config.INVITE_POOL_REFILL_INTERVAL,
+            first=1
+        )
+    application.job_queue.run_repeating(
+        handlers.payment_handler.invoices.purge_job,
+        interval=config.INVOICE_PURGE_INTERVAL,
+        first=config.INVOICE_PURGE_INTERVAL
+    )
+    if config.BACKUP_INTERVAL and handlers.primary:
+        application.job_queue.run_repeating(
+            (backup_job or BackupJob()).run,
+            interval=config.BACKUP_INTERVAL,
+            first=config.BACKUP_FIRST_DELAY,
+            name="backup"
         )
 
-        # Add payment handlers
-        application.add_handler(payment_conv_handler)
-        application.add_handler(CallbackQueryHandler(handlers.handle_button))
-        application.add_handler(PreCheckoutQueryHandler(payment_handler.handle_pre_checkout_query))
-        application.add_handler(MessageHandler(
-            filters.SUCCESSFUL_PAYMENT,
-            handlers.handle_successful_payment
-        ))
-
-        logger.info("Bot is starting up...")
-        application.run_polling()
+    # Instrumentation
+    metrics.instrument_handlers(application)
+    metrics.instrument_database(handlers.payment_handler.db.db)
+    metrics.registry.register_stats('bot_access_cache', handlers.payment_handler.db.access_cache.stats)
+    metrics.registry.register_stats('bot_update_processor', application.update_processor.stats)
+    metrics.registry.register_stats('bot_invite_pool', lambda: {
+        'available': len(handlers.payment_handler.invite_pool)
+    })
+    return application
+
+async def run_polling(application: Application, handlers: BotHandlers) -> None:
+    """Run application with long polling until SIGINT/SIGTERM"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    async with application:
+        await application.post_init(application)
+        await application.updater.start_polling()
+        await application.start()
+        handlers.serving()
+
+        await stop_event.wait()
+
+        logger.info("Stopping polling...")
+        await application.updater.stop()
+        await application.stop()
+        await application.post_stop(application)
+
+def main():
+    """Main function to start the bot"""
+    startup.timer.mark('imports', startup.timer.elapsed())
+    try:
+        with startup.timer.phase('config'):
+            config.ensure_dirs()
+
+        if config.TENANTS_FILE:
+            # Several bots on one event loop; polling only
+            from tenants import run_tenants
+            logger.info(f"Starting the bots listed in {config.TENANTS_FILE}...")
+            asyncio.run(run_tenants(config.TENANTS_FILE))
+            return
+
+        if config.SHARD_WORKERS:
+            from sharding import run_sharded
+            logger.info(f"Bot is starting up in {config.BOT_MODE} mode with {config.SHARD_WORKERS} worker processes...")
+            asyncio.run(run_sharded())
+            return
+
+        # The database schema is created on the DB writer thread meanwhile
+        with startup.timer.phase('build application'):
+            payment_handler = PaymentHandler(
+                provider_token=config.PROVIDER_TOKEN,
+                currency=config.CURRENCY,
+                students_chat_id=config.STUDENTS_CHAT_ID
+            )
+            handlers = BotHandlers(payment_handler)
+            application = build_application(handlers)
+
+        logger.info(f"Bot is starting up in {config.BOT_MODE} mode...")
+        if config.BOT_MODE == "webhook":
+            # Only needed in webhook mode
+            from webhook import run_webhook
+            asyncio.run(run_webhook(application, on_serving=handlers.serving))
+        else:
+            asyncio.run(run_polling(application, handlers))
+        payment_handler.db.close()
         
     except Exception as e:
         logger.error(f"Failed to start bot: {e}")
@@ -0,0 +1,190 @@
+"""
+Rate-limited, resumable broadcasts to paid students
+"""
+
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, List, Optional, Set
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+import config
+from async_database import AsyncDatabase
+from text_constants import BROADCAST_FINISHED
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, bursts up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        """Stop handing out tokens, e.g. after Telegram answered with RetryAfter"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class PerChatLimiter:
+    """Enforces a minimum interval between messages to the same chat"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._last_sent: Dict[int, float] = {}
+
+    async def wait(self, chat_id: int) -> None:
+        now = time.monotonic()
+        last = self._last_sent.get(chat_id)
+        if last is not None and now - last < self.interval:
+            await asyncio.sleep(self.interval - (now - last))
+        self._last_sent[chat_id] = time.monotonic()
+        if len(self._last_sent) > 10000:
+            cutoff = time.monotonic() - self.interval
+            self._last_sent = {chat: ts for chat, ts in self._last_sent.items() if ts > cutoff}
+
+class BroadcastEngine:
+    """Sends a message to every paid user, surviving restarts.
+
+    Recipients are read from payments in user_id order, one batch at a
+    time, and the last processed user_id is checkpointed regularly. A
+    broadcast interrupted by a restart resumes after the checkpoint, so at
+    most BROADCAST_PROGRESS_EVERY users may receive the message twice.
+
+    With send=False broadcasts are only recorded and listeners are told,
+    so that the one process sending (see sharding.py) picks them up and
+    the rate limit holds for the whole bot.
+    """
+
+    def __init__(self, db: AsyncDatabase, send: bool = True):
+        self.db = db
+        self.send = send
+        self.bucket = TokenBucket(config.BROADCAST_RATE)
+        self.per_chat = PerChatLimiter(config.BROADCAST_PER_CHAT_INTERVAL)
+        # Called after recording a broadcast this process doesn't send
+        self.listeners: List[Callable[[int], None]] = []
+        self._tasks: Set[asyncio.Task] = set()
+        self._running: Set[int] = set()
+
+    async def start(self, bot: Bot, created_by: int, text: Optional[str] = None,
+                    source_chat_id: Optional[int] = None, source_message_id: Optional[int] = None) -> int:
+        """Create a broadcast and send it in the background"""
+        broadcast_id = await self.db.create_broadcast(created_by, text, source_chat_id, source_message_id)
+        if self.send:
+            self._spawn(bot, broadcast_id, created_by, text, source_chat_id, source_message_id, 0, 0, 0)
+        else:
+            for listener in self.listeners:
+                listener(broadcast_id)
+        return broadcast_id
+
+    async def resume(self, bot: Bot) -> None:
+        """Continue broadcasts interrupted by a restart or recorded by another process"""
+        for row in await self.db.get_running_broadcasts():
+            if row[0] in self._running:
+                continue
+            logger.info(f"Resuming broadcast #{row[0]} after user {row[5]}")
+            self._spawn(bot, *row)
+
+    def _spawn(self, bot: Bot, broadcast_id: int, *args) -> None:
+        self._running.add(broadcast_id)
+        task = asyncio.get_running_loop().create_task(self._run(bot, broadcast_id, *args))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        task.add_done_callback(lambda _: self._running.discard(broadcast_id))
+
+    async def _send(self, bot: Bot, chat_id: int, text: Optional[str],
+                    source_chat_id: Optional[int], source_message_id: Optional[int]) -> bool:
+        """Send to one chat, retrying on flood control. Returns False if undeliverable"""
+        while True:
+            await self.bucket.acquire()
+            await self.per_chat.wait(chat_id)
+            try:
+                if source_message_id:
+                    await bot.copy_message(
+                        chat_id=chat_id,
+                        from_chat_id=source_chat_id,
+                        message_id=source_message_id
+                    )
+                else:
+                    await bot.send_message(chat_id=chat_id, text=text)
+                return True
+            except RetryAfter as e:
+                logger.warning(f"Flood control hit, pausing broadcast for {e.retry_after}s")
+                self.bucket.pause(e.retry_after)
+            except (Forbidden, BadRequest) as e:
+                logger.info(f"Cannot deliver broadcast to {chat_id}: {e.message}")
+                return False
+
+    async def _run(self, bot: Bot, broadcast_id: int, created_by: int, text: Optional[str],
+                   source_chat_id: Optional[int], source_message_id: Optional[int],
+                   last_user_id: int, sent: int, failed: int) -> None:
+        started = time.monotonic()
+        sent_this_run = 0
+        status = 'done'
+        try:
+            while True:
+                user_ids = await self.db.get_paid_user_ids_after(last_user_id, config.BROADCAST_BATCH_SIZE)
+                if not user_ids:
+                    break
+                for user_id in user_ids:
+                    try:
+                        delivered = await self._send(bot, user_id, text, source_chat_id, source_message_id)
+                    except TelegramError as e:
+                        logger.error(f"Error broadcasting to {user_id}: {e}")
+                        delivered = False
+                    if delivered:
+                        sent += 1
+                        sent_this_run += 1
+                    else:
+                        failed += 1
+                    last_user_id = user_id
+                    if (sent + failed) % config.BROADCAST_PROGRESS_EVERY == 0:
+                        await self.db.update_broadcast_progress(broadcast_id, last_user_id, sent, failed)
+                        rate = sent_this_run / max(time.monotonic() - started, 1e-9)
+                        logger.info(f"Broadcast #{broadcast_id}: {sent} sent, {failed} failed, {rate:.1f} msg/s")
+        except asyncio.CancelledError:
+            # Shutdown: leave it 'running' so it resumes after restart
+            await self.db.update_broadcast_progress(broadcast_id, last_user_id, sent, failed)
+            raise
+        except Exception as e:
+            logger.error(f"Broadcast #{broadcast_id} failed: {e}")
+            status = 'failed'
+
+        await self.db.update_broadcast_progress(broadcast_id, last_user_id, sent, failed)
+        await self.db.finish_broadcast(broadcast_id, status)
+        elapsed = time.monotonic() - started
+        rate = sent_this_run / elapsed if elapsed else 0.0
+        logger.info(f"Broadcast #{broadcast_id} {status}: {sent} sent, {failed} failed, {rate:.1f} msg/s")
+        try:
+            await bot.send_message(
+                chat_id=created_by,
+                text=BROADCAST_FINISHED.format(
+                    broadcast_id=broadcast_id, sent=sent, failed=failed, rate=rate
+                )
+            )
+        except TelegramError as e:
+            logger.error(f"Could not report broadcast #{broadcast_id} to admin: {e}")
+
+    async def shutdown(self) -> None:
+        """Cancel running broadcasts after checkpointing their progress"""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -10,6 +10,83 @@ from pathlib import Path
 TOKEN = os.getenv("BOT_TOKEN")
 PROVIDER_TOKEN = os.getenv("YOOMONEY_PROVIDER_TOKEN")
 STUDENTS_CHAT_ID = os.getenv("STUDENTS_CHAT_ID")
+# Comma-separated Telegram user ids allowed to use admin commands
+ADMIN_IDS = {int(user_id) for user_id in os.getenv("ADMIN_IDS", "").split(",") if user_id.strip()}
+
+# Update delivery: "polling" or "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # Public HTTPS URL Telegram posts updates to
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # Random per start if unset
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_QUEUE_TIMEOUT = 1.0  # Seconds a request waits for queue space before 503
+WEBHOOK_MAX_CONNECTIONS = 40
+POLLING_QUEUE_SIZE = 100  # Polled updates buffered; polling pauses while it's full
+
+# Concurrent update processing
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "8"))  # Updates handled in parallel
+UPDATE_MAX_PENDING = 1024  # Updates taken off the update queue: waiting for their user's turn or a worker, or running
+
+# Prometheus metrics endpoint (GET /metrics); port 0 disables it
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# Health checks: GET /health on the metrics port, and a heartbeat file for docker
+HEALTH_FILE = Path(os.getenv("HEALTH_FILE", "/tmp/bot_health.json"))
+HEALTH_INTERVAL = 1.0  # Seconds between event loop lag samples and heartbeat writes
+HEALTH_DB_PING_INTERVAL = 5.0  # Seconds between database pings
+HEALTH_DB_TIMEOUT = 2.0  # A ping slower than this counts as a failure
+HEALTH_MAX_LOOP_LAG = 1.0  # Seconds of event loop lag above which the bot is unhealthy
+
+# Several course bots in one process (see tenants.py); unset runs the single bot above
+TENANTS_FILE = Path(os.environ["TENANTS_FILE"]) if os.getenv("TENANTS_FILE") else None
+TENANT_HTTP_POOL_SIZE = 64  # Bot API connections shared by all hosted bots
+TENANT_DB_CACHE_SIZE_KB = 2048  # Page cache per connection for each hosted bot's database
+
+# Multi-process mode (see sharding.py): one process receives updates, worker processes handle them
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "0"))  # Worker processes, 0 runs the bot in a single process
+SHARD_SOCKET = Path(os.getenv("SHARD_SOCKET", "/tmp/course_bot_shards.sock"))  # Unix socket to the workers
+SHARD_QUEUE_SIZE = 1024  # Updates buffered per worker, e.g. while it restarts
+SHARD_WORKER_QUEUE_SIZE = 64  # Updates a worker buffers before it stops reading from the dispatcher
+SHARD_WORKER_MAX_PENDING = 64  # Updates a worker has taken in but not finished, lost if it crashes
+SHARD_START_TIMEOUT = 60.0  # Seconds to wait for every worker to come up
+SHARD_STOP_TIMEOUT = 30.0  # Seconds to wait for workers to finish their updates on shutdown
+SHARD_RESTART_DELAY = 1.0  # Seconds between checks for crashed workers, which are started again
+
+# Broadcasts to paid students
+BROADCAST_RATE = 25  # Messages per second across all chats (Telegram allows ~30)
+BROADCAST_PER_CHAT_INTERVAL = 1.0  # Minimum seconds between messages to one chat
+BROADCAST_BATCH_SIZE = 500  # Recipients fetched from SQLite at a time
+BROADCAST_PROGRESS_EVERY = 50  # Sends between progress checkpoints
+
+# user_data and conversation state persistence
+PERSISTENCE_FLUSH_INTERVAL = 5  # Seconds between batched writes of changed state
+
+# Pre-generated single-use invite links for STUDENTS_CHAT_ID
+INVITE_POOL_SIZE = 20  # Links kept ready after a refill
+INVITE_POOL_LOW_WATER = 5  # Refill when fewer links than this are left
+INVITE_POOL_REFILL_INTERVAL = 60  # Seconds between pool checks
+INVITE_POOL_CREATE_DELAY = 0.5  # Seconds between createChatInviteLink calls while refilling
+
+# Post-payment outbox: invite creation and delivery retried in the background
+OUTBOX_BATCH_SIZE = 20  # Entries handled concurrently per pass
+OUTBOX_POLL_INTERVAL = 5.0  # Seconds between checks for due entries when idle
+OUTBOX_MAX_ATTEMPTS = 15  # Attempts before an entry is marked failed
+OUTBOX_RETRY_BASE = 2.0  # Seconds before the first retry, doubled on each attempt
+OUTBOX_RETRY_MAX = 600.0  # Longest delay between attempts
+
+# Issued invoices, checked on pre-checkout
+INVOICE_TTL = 24 * 60 * 60  # Seconds an invoice can be paid after it was sent
+INVOICE_CHECKOUT_HOLD = 120  # Seconds other invoices of a user are refused after one is approved
+INVOICE_PURGE_INTERVAL = 60 * 60  # Seconds between removals of expired invoices from SQLite
+
+# Funnel analytics, written to SQLite in batches
+ANALYTICS_BATCH_SIZE = 500  # Events per executemany
+ANALYTICS_FLUSH_INTERVAL = 2.0  # Seconds between flushes of a partial batch
+ANALYTICS_SAMPLE_ABOVE = 2000  # Buffered events above which users are sampled
+ANALYTICS_MAX_BUFFER = 10000  # Buffered events above which new ones are dropped
 
 # Course information
 COURSE_TITLE = "Курс по бытовой дрессировке для инструкторов"
@@ -29,7 +106,25 @@ REVIEWS_PATH = Path("/app/media/reviews")
 # Database configuration
 DB_DIR = Path("/app/data")
 DB_FILE = DB_DIR / "course_bot.db"
+DB_BUSY_TIMEOUT = 5.0  # Seconds to wait for a lock held by another connection
+DB_CACHE_SIZE_KB = 8192  # Page cache per connection
+DB_MMAP_SIZE = 64 * 1024 * 1024  # Bytes of the database file mapped into memory
+DB_CACHED_STATEMENTS = 128  # Prepared statements kept per connection
+DB_READER_THREADS = 4  # Threads serving read queries for async handlers
+ACCESS_CACHE_MAX_UNPAID = 10000  # Users without a purchase remembered by the access cache
+
+# Backups
+BACKUP_DIR = Path(os.getenv("BACKUP_DIR", "/app/backups"))
+BACKUP_INTERVAL = int(os.getenv("BACKUP_INTERVAL", str(6 * 60 * 60)))  # Seconds between in-process backups, 0 disables
+BACKUP_FIRST_DELAY = 300  # Seconds after startup before the first scheduled backup
+BACKUP_IO_RATE = 20 * 1024 * 1024  # Bytes per second read or written by backup copy loops, 0 for unlimited
+BACKUP_KEEP_LAST = 5  # Backups of each kind kept by cleanup_old_backups
+BACKUP_PAGES_PER_STEP = 256  # SQLite pages copied per backup step
+BACKUP_STEP_SLEEP = 0.01  # Seconds between backup steps, lets the bot's writes through
+BACKUP_COMPRESS_LEVEL = 6  # gzip level for database backups
+BACKUP_HASH_WORKERS = 4  # Threads hashing media files for incremental snapshots
 
-# Ensure directories exist
-MEDIA_DIR.mkdir(parents=True, exist_ok=True)
-DB_DIR.mkdir(parents=True, exist_ok=True)
+def ensure_dirs():
+    """Create the media, data and backup directories; run at startup, not on import"""
+    for directory in (MEDIA_DIR, DB_DIR, BACKUP_DIR):
+        directory.mkdir(parents=True, exist_ok=True)
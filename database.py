@@ -1,4 +1,6 @@
 import sqlite3
+import threading
+import time
 from datetime import datetime
 import logging
 from contextlib import contextmanager
@@ -7,18 +9,90 @@ import config
 
 logger = logging.getLogger(__name__)
 
+class ConnectionManager:
+    """Keeps one long-lived, tuned SQLite connection per thread"""
+
+    def __init__(self, db_file, cached_statements: int = config.DB_CACHED_STATEMENTS,
+                 cache_size_kb: int = config.DB_CACHE_SIZE_KB):
+        self.db_file = db_file
+        self.cached_statements = cached_statements
+        self.cache_size_kb = cache_size_kb
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._journal_mode_set = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_file,
+            timeout=config.DB_BUSY_TIMEOUT,
+            cached_statements=self.cached_statements,
+            # Each connection is only used by its own thread; this just lets close_all() run anywhere
+            check_same_thread=False
+        )
+        with self._lock:
+            # journal_mode is stored in the database file, so it only has to be set once
+            if not self._journal_mode_set:
+                conn.execute("PRAGMA journal_mode=WAL")
+                self._journal_mode_set = True
+            self._connections.append(conn)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kb)}")
+        conn.execute(f"PRAGMA mmap_size={int(config.DB_MMAP_SIZE)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def get(self) -> sqlite3.Connection:
+        """Return connection owned by the calling thread, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def close_all(self):
+        """Close every connection opened by this manager"""
+        with self._lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except sqlite3.Error as e:
+                    logger.error(f"Error closing database connection: {e}")
+            self._connections.clear()
+        self._local = threading.local()
+
 class Database:
-    def __init__(self, db_file=config.DB_FILE):
+    def __init__(self, db_file=config.DB_FILE, init_schema: bool = True,
+                 cache_size_kb: int = config.DB_CACHE_SIZE_KB):
         self.db_file = db_file
-        self.init_db()
+        self.connections = ConnectionManager(db_file, cache_size_kb=cache_size_kb)
+        if init_schema:
+            self.init_db()
 
     @contextmanager
     def get_connection(self):
-        conn = sqlite3.connect(self.db_file)
+        conn = self.connections.get()
         try:
             yield conn
-        finally:
-            conn.close()
+        except Exception:
+            # Connection outlives this block, so don't leave a transaction open on it
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+
+    def close(self):
+        """Close all pooled connections"""
+        self.connections.close_all()
+
+    def ping(self) -> bool:
+        """Check that the database can be queried"""
+        try:
+            with self.get_connection() as conn:
+                conn.execute("SELECT 1 FROM payments LIMIT 1").fetchall()
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Database ping failed: {e}")
+            return False
 
     def init_db(self):
         """Initialize database with required tables"""
@@ -41,6 +115,95 @@ class Database:
             created_at TIMESTAMP,
             FOREIGN KEY (user_id) REFERENCES payments (user_id)
         );
+
+        CREATE TABLE IF NOT EXISTS media_files (
+            path TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            updated_at TIMESTAMP
+        );
+
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_by INTEGER,
+            text TEXT,
+            source_chat_id INTEGER,
+            source_message_id INTEGER,
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'running',
+            created_at TIMESTAMP,
+            finished_at TIMESTAMP
+        );
+
+        CREATE TABLE IF NOT EXISTS user_data (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at TIMESTAMP
+        );
+
+        CREATE TABLE IF NOT EXISTS conversations (
+            name TEXT NOT NULL,
+            key TEXT NOT NULL,
+            state TEXT NOT NULL,
+            PRIMARY KEY (name, key)
+        );
+
+        CREATE TABLE IF NOT EXISTS invite_pool (
+            invite_link TEXT PRIMARY KEY,
+            created_at TIMESTAMP,
+            claimed_by INTEGER,
+            claimed_at TIMESTAMP
+        );
+
+        CREATE TABLE IF NOT EXISTS payment_ledger (
+            transaction_id TEXT PRIMARY KEY,
+            telegram_charge_id TEXT,
+            user_id INTEGER NOT NULL,
+            amount REAL,
+            currency TEXT,
+            created_at TIMESTAMP
+        );
+
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at TIMESTAMP,
+            finished_at TIMESTAMP
+        );
+
+        CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+
+        CREATE TABLE IF NOT EXISTS pending_invoices (
+            nonce TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            currency TEXT NOT NULL,
+            customer_info TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        );
+
+        CREATE INDEX IF NOT EXISTS pending_invoices_expiry ON pending_invoices (expires_at);
+
+        CREATE TABLE IF NOT EXISTS analytics_funnel (
+            event TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            first_ts REAL NOT NULL,
+            weight REAL NOT NULL DEFAULT 1,
+            PRIMARY KEY (event, user_id)
+        );
+
+        -- Cover the funnel report: the cohort by entry time, then each member's steps
+        CREATE INDEX IF NOT EXISTS analytics_funnel_report ON analytics_funnel (event, first_ts, weight);
+        CREATE INDEX IF NOT EXISTS analytics_funnel_user ON analytics_funnel (user_id, event, weight);
         """
         
         try:
@@ -77,6 +240,201 @@ class Database:
             logger.error(f"Error recording payment: {e}")
             raise
 
+    def record_payment_event(self, user_id: int, username: str, customer_info: dict,
+                             transaction_id: str, telegram_charge_id: str, amount: float,
+                             currency: str, chat_id: int, outbox_kind: str, outbox_payload: str) -> bool:
+        """Record a payment and queue its fulfilment in one transaction.
+
+        The ledger is keyed by transaction_id, so a payment delivered twice
+        is recorded and queued once. Returns False for such a duplicate.
+        """
+        now = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.execute(
+                    """
+                    INSERT OR IGNORE INTO payment_ledger
+                    (transaction_id, telegram_charge_id, user_id, amount, currency, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    (transaction_id, telegram_charge_id, user_id, amount, currency, now)
+                )
+                if cursor.rowcount == 0:
+                    conn.rollback()
+                    return False
+                # A user who pays again keeps their first payments row
+                conn.execute(
+                    """
+                    INSERT INTO payments
+                    (user_id, username, full_name, email, phone, payment_date, transaction_id, amount, currency)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (user_id) DO NOTHING
+                    """,
+                    (
+                        user_id,
+                        username,
+                        customer_info.get('full_name'),
+                        customer_info.get('email'),
+                        customer_info.get('phone'),
+                        now,
+                        transaction_id,
+                        amount,
+                        currency
+                    )
+                )
+                conn.execute(
+                    """
+                    INSERT INTO outbox (kind, user_id, chat_id, payload, next_attempt_at, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    (outbox_kind, user_id, chat_id, outbox_payload, time.time(), now)
+                )
+                conn.commit()
+                return True
+        except sqlite3.Error as e:
+            logger.error(f"Error recording payment event: {e}")
+            raise
+
+    def get_due_outbox(self, now: float, limit: int) -> list:
+        """Get pending outbox entries whose next attempt is due, oldest first"""
+        sql = """
+        SELECT id, kind, user_id, chat_id, payload, attempts
+        FROM outbox
+        WHERE status = 'pending' AND next_attempt_at <= ?
+        ORDER BY next_attempt_at
+        LIMIT ?
+        """
+        try:
+            with self.get_connection() as conn:
+                return conn.execute(sql, (now, limit)).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Error getting due outbox entries: {e}")
+            return []
+
+    def get_next_outbox_attempt(self) -> float:
+        """Time of the earliest pending outbox attempt, or None if nothing is pending"""
+        sql = "SELECT min(next_attempt_at) FROM outbox WHERE status = 'pending'"
+        try:
+            with self.get_connection() as conn:
+                return conn.execute(sql).fetchone()[0]
+        except sqlite3.Error as e:
+            logger.error(f"Error getting next outbox attempt: {e}")
+            return None
+
+    def retry_outbox(self, entry_id: int, attempts: int, next_attempt_at: float, error: str):
+        """Reschedule a failed outbox entry"""
+        sql = "UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?"
+        try:
+            with self.get_connection() as conn:
+                conn.execute(sql, (attempts, next_attempt_at, error, entry_id))
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error rescheduling outbox entry: {e}")
+            raise
+
+    def finish_outbox(self, entry_id: int, status: str, attempts: int, error: str = None):
+        """Mark an outbox entry as 'done' or permanently 'failed'"""
+        sql = "UPDATE outbox SET status = ?, attempts = ?, last_error = ?, finished_at = ? WHERE id = ?"
+        try:
+            with self.get_connection() as conn:
+                conn.execute(sql, (
+                    status,
+                    attempts,
+                    error,
+                    datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+                    entry_id
+                ))
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error finishing outbox entry: {e}")
+            raise
+
+    def add_pending_invoice(self, nonce: str, user_id: int, amount: int, currency: str,
+                            customer_info: str, expires_at: float):
+        """Store an issued invoice"""
+        sql = """
+        INSERT INTO pending_invoices (nonce, user_id, amount, currency, customer_info, expires_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """
+        try:
+            with self.get_connection() as conn:
+                conn.execute(sql, (nonce, user_id, amount, currency, customer_info, expires_at))
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error adding pending invoice: {e}")
+            raise
+
+    def get_pending_invoices(self, now: float) -> list:
+        """Get unexpired invoices, soonest to expire first"""
+        sql = """
+        SELECT nonce, user_id, amount, currency, customer_info, expires_at
+        FROM pending_invoices
+        WHERE expires_at > ?
+        ORDER BY expires_at
+        """
+        try:
+            with self.get_connection() as conn:
+                return conn.execute(sql, (now,)).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Error getting pending invoices: {e}")
+            return []
+
+    def delete_pending_invoice(self, nonce: str):
+        """Remove a paid invoice"""
+        try:
+            with self.get_connection() as conn:
+                conn.execute("DELETE FROM pending_invoices WHERE nonce = ?", (nonce,))
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error deleting pending invoice: {e}")
+
+    def delete_expired_invoices(self, now: float) -> int:
+        """Remove expired invoices and return how many there were"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.execute("DELETE FROM pending_invoices WHERE expires_at <= ?", (now,))
+                conn.commit()
+                return cursor.rowcount
+        except sqlite3.Error as e:
+            logger.error(f"Error deleting expired invoices: {e}")
+            return 0
+
+    def add_analytics_events(self, events: list):
+        """Note each user's first time at each step from (ts, user_id, event, weight) rows"""
+        try:
+            with self.get_connection() as conn:
+                conn.executemany(
+                    """
+                    INSERT INTO analytics_funnel (first_ts, user_id, event, weight) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (event, user_id) DO NOTHING
+                    """,
+                    events
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error adding analytics events: {e}")
+            raise
+
+    def get_funnel_counts(self, entry_event: str, since: float) -> list:
+        """Get (event, estimated users) for the users who first reached entry_event since a unix time.
+
+        Later steps are counted for that cohort whenever they happened, so
+        a step never has more users than the entry.
+        """
+        sql = """
+        SELECT step.event, sum(step.weight)
+        FROM analytics_funnel AS entry
+        JOIN analytics_funnel AS step ON step.user_id = entry.user_id
+        WHERE entry.event = ? AND entry.first_ts >= ?
+        GROUP BY step.event
+        """
+        try:
+            with self.get_connection() as conn:
+                return conn.execute(sql, (entry_event, since)).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Error getting funnel counts: {e}")
+            return []
+
     def record_chat_invite(self, user_id: int, invite_link: str):
         """Record chat invite link for user"""
         sql = """
@@ -117,6 +475,36 @@ class Database:
             logger.error(f"Error getting chat invite: {e}")
             return None
 
+    def get_access_status(self, user_id: int) -> tuple:
+        """Get payment status and invite link in a single query"""
+        sql = """
+        SELECT ci.invite_link
+        FROM payments p
+        LEFT JOIN chat_invites ci ON p.user_id = ci.user_id
+        WHERE p.user_id = ?
+        """
+        try:
+            with self.get_connection() as conn:
+                result = conn.execute(sql, (user_id,)).fetchone()
+                return (True, result[0]) if result else (False, None)
+        except sqlite3.Error as e:
+            logger.error(f"Error getting access status: {e}")
+            return False, None
+
+    def get_paid_users(self) -> list:
+        """Get (user_id, invite_link) for every paid user"""
+        sql = """
+        SELECT p.user_id, ci.invite_link
+        FROM payments p
+        LEFT JOIN chat_invites ci ON p.user_id = ci.user_id
+        """
+        try:
+            with self.get_connection() as conn:
+                return conn.execute(sql).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Error getting paid users: {e}")
+            return []
+
     def get_user_info(self, user_id: int) -> dict:
         """Get user's payment and access information"""
         sql = """
@@ -144,4 +532,224 @@ class Database:
                 return None
         except sqlite3.Error as e:
             logger.error(f"Error getting user info: {e}")
-            return None
\ No newline at end of file
+            return None
+
+    def get_media_file(self, path: str) -> tuple:
+        """Get cached Telegram file_id and file fingerprint for a media path"""
+        sql = "SELECT fingerprint, file_id FROM media_files WHERE path = ?"
+        try:
+            with self.get_connection() as conn:
+                return conn.execute(sql, (path,)).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Error getting media file: {e}")
+            return None
+
+    def get_media_files(self) -> list:
+        """Get (path, fingerprint, file_id) for every cached media file"""
+        sql = "SELECT path, fingerprint, file_id FROM media_files"
+        try:
+            with self.get_connection() as conn:
+                return conn.execute(sql).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Error getting media files: {e}")
+            return []
+
+    def record_media_file(self, path: str, fingerprint: str, file_id: str):
+        """Record Telegram file_id for an uploaded media file"""
+        sql = """
+        INSERT OR REPLACE INTO media_files (path, fingerprint, file_id, updated_at)
+        VALUES (?, ?, ?, ?)
+        """
+        try:
+            with self.get_connection() as conn:
+                conn.execute(sql, (
+                    path,
+                    fingerprint,
+                    file_id,
+                    datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+                ))
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error recording media file: {e}")
+
+    def delete_media_file(self, path: str):
+        """Forget cached Telegram file_id for a media path"""
+        sql = "DELETE FROM media_files WHERE path = ?"
+        try:
+            with self.get_connection() as conn:
+                conn.execute(sql, (path,))
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error deleting media file: {e}")
+
+    def create_broadcast(self, created_by: int, text: str = None,
+                         source_chat_id: int = None, source_message_id: int = None) -> int:
+        """Create a broadcast and return its id"""
+        sql = """
+        INSERT INTO broadcasts (created_by, text, source_chat_id, source_message_id, created_at)
+        VALUES (?, ?, ?, ?, ?)
+        """
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.execute(sql, (
+                    created_by,
+                    text,
+                    source_chat_id,
+                    source_message_id,
+                    datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+                ))
+                conn.commit()
+                return cursor.lastrowid
+        except sqlite3.Error as e:
+            logger.error(f"Error creating broadcast: {e}")
+            raise
+
+    def update_broadcast_progress(self, broadcast_id: int, last_user_id: int, sent: int, failed: int):
+        """Persist how far a broadcast got so it can be resumed"""
+        sql = "UPDATE broadcasts SET last_user_id = ?, sent = ?, failed = ? WHERE id = ?"
+        try:
+            with self.get_connection() as conn:
+                conn.execute(sql, (last_user_id, sent, failed, broadcast_id))
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error updating broadcast progress: {e}")
+
+    def finish_broadcast(self, broadcast_id: int, status: str = 'done'):
+        """Mark broadcast as finished"""
+        sql = "UPDATE broadcasts SET status = ?, finished_at = ? WHERE id = ?"
+        try:
+            with self.get_connection() as conn:
+                conn.execute(sql, (
+                    status,
+                    datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+                    broadcast_id
+                ))
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error finishing broadcast: {e}")
+
+    def get_running_broadcasts(self) -> list:
+        """Get broadcasts that were interrupted before finishing"""
+        sql = """
+        SELECT id, created_by, text, source_chat_id, source_message_id, last_user_id, sent, failed
+        FROM broadcasts
+        WHERE status = 'running'
+        ORDER BY id
+        """
+        try:
+            with self.get_connection() as conn:
+                return conn.execute(sql).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Error getting running broadcasts: {e}")
+            return []
+
+    def get_paid_user_ids_after(self, after_user_id: int, limit: int) -> list:
+        """Get next batch of paid user ids in ascending order (keyset pagination)"""
+        sql = "SELECT user_id FROM payments WHERE user_id > ? ORDER BY user_id LIMIT ?"
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.execute(sql, (after_user_id, limit))
+                return [row[0] for row in cursor.fetchmany(limit)]
+        except sqlite3.Error as e:
+            logger.error(f"Error getting paid users: {e}")
+            raise
+
+    def load_user_data(self, user_id: int) -> str:
+        """Get serialized user_data for a user"""
+        sql = "SELECT data FROM user_data WHERE user_id = ?"
+        try:
+            with self.get_connection() as conn:
+                result = conn.execute(sql, (user_id,)).fetchone()
+                return result[0] if result else None
+        except sqlite3.Error as e:
+            logger.error(f"Error loading user data: {e}")
+            return None
+
+    def load_conversations(self, name: str) -> list:
+        """Get (key, state) rows of a persistent conversation handler"""
+        sql = "SELECT key, state FROM conversations WHERE name = ?"
+        try:
+            with self.get_connection() as conn:
+                return conn.execute(sql, (name,)).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Error loading conversations: {e}")
+            return []
+
+    def save_persistence_batch(self, user_data: list, conversations: list):
+        """Write buffered user_data and conversation states in one transaction.
+
+        user_data holds (user_id, data) pairs and conversations holds
+        (name, key, state) triples; a None data/state deletes the row.
+        """
+        now = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            with self.get_connection() as conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO user_data (user_id, data, updated_at) VALUES (?, ?, ?)",
+                    [(user_id, data, now) for user_id, data in user_data if data is not None]
+                )
+                conn.executemany(
+                    "DELETE FROM user_data WHERE user_id = ?",
+                    [(user_id,) for user_id, data in user_data if data is None]
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                    [row for row in conversations if row[2] is not None]
+                )
+                conn.executemany(
+                    "DELETE FROM conversations WHERE name = ? AND key = ?",
+                    [(name, key) for name, key, state in conversations if state is None]
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error saving persistence batch: {e}")
+            raise
+
+    def add_pooled_invites(self, invite_links: list):
+        """Store pre-generated invite links"""
+        now = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            with self.get_connection() as conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO invite_pool (invite_link, created_at) VALUES (?, ?)",
+                    [(invite_link, now) for invite_link in invite_links]
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error adding pooled invites: {e}")
+            raise
+
+    def get_pooled_invites(self) -> list:
+        """Get unclaimed pre-generated invite links, oldest first"""
+        sql = "SELECT invite_link FROM invite_pool WHERE claimed_by IS NULL ORDER BY created_at"
+        try:
+            with self.get_connection() as conn:
+                return [row[0] for row in conn.execute(sql).fetchall()]
+        except sqlite3.Error as e:
+            logger.error(f"Error getting pooled invites: {e}")
+            return []
+
+    def claim_pooled_invite(self, invite_link: str, user_id: int) -> bool:
+        """Assign a pooled invite link to a user and record it as their chat invite.
+
+        Returns False if the link was already claimed, e.g. by another process.
+        """
+        now = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            with self.get_connection() as conn:
+                claimed = conn.execute(
+                    "UPDATE invite_pool SET claimed_by = ?, claimed_at = ? WHERE invite_link = ? AND claimed_by IS NULL",
+                    (user_id, now, invite_link)
+                ).rowcount
+                if not claimed:
+                    conn.rollback()
+                    return False
+                conn.execute(
+                    "INSERT OR REPLACE INTO chat_invites (user_id, invite_link, created_at) VALUES (?, ?, ?)",
+                    (user_id, invite_link, now)
+                )
+                conn.commit()
+                return True
+        except sqlite3.Error as e:
+            logger.error(f"Error claiming pooled invite: {e}")
+            raise
@@ -0,0 +1,145 @@
+"""
+Liveness and readiness reporting for the running bot
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from pathlib import Path
+from typing import Optional
+from telegram.ext import Application
+import config
+import metrics
+from async_database import AsyncDatabase
+from http_server import Request, Response
+
+logger = logging.getLogger(__name__)
+
+def write_heartbeat(health_file: Path, status: dict) -> None:
+    """Replace health_file atomically, so readers never see a partial write"""
+    tmp = health_file.with_name(f'.{health_file.name}.tmp')
+    try:
+        tmp.write_text(json.dumps(status))
+        os.replace(tmp, health_file)
+    except OSError as e:
+        logger.error(f"Failed to write heartbeat file {health_file}: {e}")
+
+class HealthMonitor:
+    """Samples event loop lag and database reachability in the background.
+
+    A task wakes up every `interval` seconds; how late it wakes is the loop
+    lag, and the worst of the last ten samples is reported alongside it so
+    short stalls stay visible for a while. The database is pinged through the reader pool every
+    `db_ping_interval` seconds. Each tick the current status is written to
+    a heartbeat file, so a stalled loop shows up as a stale file even when
+    the HTTP endpoint can't answer. status() and GET /health only read
+    these samples, so polling them costs next to nothing.
+    """
+
+    def __init__(
+        self,
+        db: AsyncDatabase,
+        health_file: Optional[Path] = config.HEALTH_FILE,
+        interval: float = config.HEALTH_INTERVAL,
+        db_ping_interval: float = config.HEALTH_DB_PING_INTERVAL,
+        max_loop_lag: float = config.HEALTH_MAX_LOOP_LAG
+    ):
+        self.db = db
+        self.health_file = health_file
+        self.interval = interval
+        self.db_ping_interval = db_ping_interval
+        self.max_loop_lag = max_loop_lag
+        self.application: Optional[Application] = None
+        self.started = time.monotonic()
+        self.loop_lag = 0.0
+        self._recent_lags = deque(maxlen=10)
+        self.db_ok = False
+        self.db_latency: Optional[float] = None
+        self.db_checked: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self._ping_task: Optional[asyncio.Task] = None
+        metrics.registry.register_stats('bot_health', self.metric_values)
+
+    async def start(self, application: Application) -> None:
+        self.application = application
+        self.started = time.monotonic()
+        await self._ping()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        for task in (self._task, self._ping_task):
+            if task:
+                task.cancel()
+        await asyncio.gather(*(t for t in (self._task, self._ping_task) if t), return_exceptions=True)
+        if self.health_file:
+            self.health_file.unlink(missing_ok=True)
+
+    async def _run(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.loop_lag = max(0.0, now - expected)
+            self._recent_lags.append(self.loop_lag)
+            if self.loop_lag > self.max_loop_lag:
+                logger.warning(f"Event loop lagging by {self.loop_lag:.2f}s")
+
+            # Pinged in its own task so a slow database doesn't show up as loop lag
+            if (now - (self.db_checked or 0) >= self.db_ping_interval
+                    and (self._ping_task is None or self._ping_task.done())):
+                self._ping_task = asyncio.get_running_loop().create_task(self._ping())
+            if self.health_file:
+                write_heartbeat(self.health_file, self.status())
+
+    async def _ping(self) -> None:
+        started = time.monotonic()
+        try:
+            self.db_ok = await asyncio.wait_for(self.db.ping(), config.HEALTH_DB_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Database ping took longer than {config.HEALTH_DB_TIMEOUT}s")
+            self.db_ok = False
+        except Exception as e:
+            logger.error(f"Database ping failed: {e}")
+            self.db_ok = False
+        self.db_checked = time.monotonic()
+        self.db_latency = self.db_checked - started
+
+    def status(self) -> dict:
+        now = time.monotonic()
+        processor = self.application.update_processor if self.application else None
+        last_update = getattr(processor, 'last_processed', None)
+        processor_stats = processor.stats() if hasattr(processor, 'stats') else {}
+        db_fresh = self.db_checked is not None and now - self.db_checked < 3 * self.db_ping_interval
+        return {
+            'ok': self.db_ok and db_fresh and self.loop_lag <= self.max_loop_lag,
+            'uptime': round(now - self.started, 3),
+            'loop_lag': round(self.loop_lag, 4),
+            'loop_lag_max': round(max(self._recent_lags, default=0.0), 4),
+            'db_ok': self.db_ok,
+            'db_latency': round(self.db_latency, 4) if self.db_latency is not None else None,
+            'db_checked_ago': round(now - self.db_checked, 3) if self.db_checked is not None else None,
+            'last_update_ago': round(now - last_update, 3) if last_update is not None else None,
+            'update_queue': self.application.update_queue.qsize() if self.application else 0,
+            'processor_waiting': processor_stats.get('queue_depth', 0),
+            'processor_running': processor_stats.get('running', 0),
+        }
+
+    def metric_values(self) -> dict:
+        status = self.status()
+        return {
+            'ok': int(status['ok']),
+            'loop_lag_seconds': status['loop_lag'],
+            'db_ok': int(status['db_ok']),
+            'db_latency_seconds': status['db_latency'] or 0.0,
+        }
+
+    async def handle_health(self, request: Request) -> Response:
+        status = self.status()
+        return Response(
+            200 if status['ok'] else 503,
+            json.dumps(status).encode(),
+            content_type='application/json'
+        )
@@ -0,0 +1,143 @@
+"""
+Minimal asyncio HTTP/1.1 server for the bot's internal endpoints
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAX_HEADER_LINES = 100
+
+@dataclass
+class Request:
+    method: str
+    path: str
+    headers: Dict[str, str]
+    body: bytes = b''
+
+@dataclass
+class Response:
+    status: int = 200
+    body: bytes = b''
+    content_type: str = 'text/plain; charset=utf-8'
+    headers: Dict[str, str] = field(default_factory=dict)
+
+Handler = Callable[[Request], Awaitable[Response]]
+
+class HTTPServer:
+    """Tiny keep-alive HTTP server dispatching on method and path.
+
+    Only what Telegram webhooks and scrapers need: Content-Length bodies,
+    no chunked encoding, no TLS (terminate it in a reverse proxy).
+    """
+
+    def __init__(self, host: str, port: int, max_body_size: int = 1024 * 1024):
+        self.host = host
+        self.port = port
+        self.max_body_size = max_body_size
+        self._routes: Dict[Tuple[str, str], Handler] = {}
+        self._prefix_routes: List[Tuple[str, str, Handler]] = []
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def route(self, method: str, path: str, handler: Handler) -> None:
+        self._routes[(method, path)] = handler
+
+    def prefix_route(self, method: str, prefix: str, handler: Handler) -> None:
+        self._prefix_routes.append((method, prefix, handler))
+
+    @property
+    def bound_port(self) -> int:
+        """Actual port, useful when started with port 0"""
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logger.info(f"HTTP server listening on {self.host}:{self.bound_port}")
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def _find_handler(self, method: str, path: str) -> Optional[Handler]:
+        handler = self._routes.get((method, path))
+        if handler:
+            return handler
+        for route_method, prefix, handler in self._prefix_routes:
+            if route_method == method and path.startswith(prefix):
+                return handler
+        return None
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Request]:
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        try:
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        except ValueError:
+            raise ValueError("Malformed request line")
+
+        headers = {}
+        for _ in range(MAX_HEADER_LINES):
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        else:
+            raise ValueError("Too many headers")
+
+        length = int(headers.get('content-length', 0))
+        if length > self.max_body_size:
+            raise ValueError("Request body too large")
+        body = await reader.readexactly(length) if length else b''
+        return Request(method=method, path=target.split('?', 1)[0], headers=headers, body=body)
+
+    @staticmethod
+    def _write_response(writer: asyncio.StreamWriter, response: Response, keep_alive: bool) -> None:
+        reason = HTTPStatus(response.status).phrase
+        headers = {
+            'Content-Type': response.content_type,
+            'Content-Length': str(len(response.body)),
+            'Connection': 'keep-alive' if keep_alive else 'close',
+            **response.headers
+        }
+        head = f"HTTP/1.1 {response.status} {reason}\r\n"
+        head += ''.join(f"{name}: {value}\r\n" for name, value in headers.items())
+        writer.write(head.encode('latin-1') + b'\r\n' + response.body)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except (ValueError, asyncio.IncompleteReadError) as e:
+                    self._write_response(writer, Response(400, str(e).encode()), keep_alive=False)
+                    break
+                if request is None:
+                    break
+
+                handler = self._find_handler(request.method, request.path)
+                if handler is None:
+                    response = Response(404, b'Not Found')
+                else:
+                    try:
+                        response = await handler(request)
+                    except Exception as e:
+                        logger.error(f"Error handling {request.method} {request.path}: {e}")
+                        response = Response(500, b'Internal Server Error')
+
+                keep_alive = request.headers.get('connection', '').lower() != 'close'
+                self._write_response(writer, response, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
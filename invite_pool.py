@@ -0,0 +1,97 @@
+"""
+Pool of pre-generated single-use invite links to the students chat
+"""
+
+import asyncio
+import logging
+from collections import deque
+from typing import Callable, Deque, List, Optional
+from telegram import Bot
+from telegram.error import RetryAfter, TelegramError
+from telegram.ext import ContextTypes
+import config
+from async_database import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+class InviteLinkPool:
+    """Keeps unclaimed invite links ready so paying users get one instantly.
+
+    Links are created in the background by refill() and stored in the
+    invite_pool table; the unclaimed ones are mirrored in a deque, so a
+    claim is a popleft plus one write on the DB writer thread. The write
+    only succeeds for a link nobody has claimed yet, so several processes
+    can hand out links from the same table.
+    """
+
+    def __init__(
+        self,
+        db: AsyncDatabase,
+        chat_id: Optional[str],
+        size: int = config.INVITE_POOL_SIZE,
+        low_water: int = config.INVITE_POOL_LOW_WATER
+    ):
+        self.db = db
+        self.chat_id = chat_id
+        self.size = size
+        self.low_water = low_water
+        self._links: Deque[str] = deque()
+        self._refill_lock = asyncio.Lock()
+        # Called after refill() stored new links
+        self.listeners: List[Callable[[], None]] = []
+
+    def __len__(self) -> int:
+        return len(self._links)
+
+    async def load(self) -> None:
+        """Load unclaimed links left from previous runs"""
+        self._links = deque(await self.db.get_pooled_invites())
+        logger.info(f"Invite pool loaded with {len(self._links)} links")
+
+    async def claim(self, user_id: int) -> Optional[str]:
+        """Take a link for user_id, or None if the pool is empty"""
+        while self._links:
+            invite_link = self._links.popleft()
+            try:
+                claimed = await self.db.claim_pooled_invite(invite_link, user_id)
+            except Exception:
+                self._links.appendleft(invite_link)
+                raise
+            if claimed:
+                logger.info(f"Claimed pooled invite link for user {user_id}, {len(self._links)} left")
+                return invite_link
+            # Taken by another process since we loaded it
+        return None
+
+    async def refill(self, bot: Bot) -> int:
+        """Top the pool up to size once it drops below the low-water mark"""
+        if not self.chat_id or len(self._links) >= self.low_water or self._refill_lock.locked():
+            return 0
+
+        created = []
+        async with self._refill_lock:
+            try:
+                while len(self._links) + len(created) < self.size:
+                    chat_invite = await bot.create_chat_invite_link(
+                        chat_id=self.chat_id,
+                        member_limit=1,
+                        expire_date=None
+                    )
+                    created.append(chat_invite.invite_link)
+                    await asyncio.sleep(config.INVITE_POOL_CREATE_DELAY)
+            except RetryAfter as e:
+                logger.warning(f"Flood control while refilling invite pool, retry in {e.retry_after}s")
+            except TelegramError as e:
+                logger.error(f"Failed to create pooled invite link: {e}")
+            finally:
+                if created:
+                    await self.db.add_pooled_invites(created)
+                    self._links.extend(created)
+                    logger.info(f"Added {len(created)} links to invite pool, {len(self._links)} available")
+                    for listener in self.listeners:
+                        listener()
+        return len(created)
+
+    async def refill_job(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """JobQueue callback"""
+        await self.refill(context.bot)
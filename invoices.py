@@ -0,0 +1,130 @@
+"""
+Registry of issued invoices for pre-checkout validation
+"""
+
+import json
+import logging
+import secrets
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Tuple
+from telegram.ext import ContextTypes
+import config
+import metrics
+from async_database import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+PAYLOAD_PREFIX = "course_payment_"
+
+PRE_CHECKOUTS = metrics.registry.counter(
+    'bot_pre_checkout_total', "Pre-checkout queries by result", ('result',))
+
+class PendingInvoice(NamedTuple):
+    nonce: str
+    user_id: int
+    amount: int
+    currency: str
+    customer_info: dict
+    expires_at: float
+
+class InvoiceRegistry:
+    """Invoices sent to users and not paid yet, keyed by a nonce in the payload.
+
+    Entries live in an OrderedDict in issue order, which with one TTL is
+    also expiry order, so dropping expired ones only looks at the front.
+    Lookups are a dict access, which keeps pre-checkout far inside
+    Telegram's 10 second deadline. The pending_invoices table mirrors the
+    dict so invoices issued before a restart can still be paid.
+    """
+
+    def __init__(
+        self,
+        db: AsyncDatabase,
+        ttl: float = config.INVOICE_TTL,
+        checkout_hold: float = config.INVOICE_CHECKOUT_HOLD
+    ):
+        self.db = db
+        self.ttl = ttl
+        self.checkout_hold = checkout_hold
+        self._pending: "OrderedDict[str, PendingInvoice]" = OrderedDict()
+        # user_id -> (nonce, until): an approved checkout not yet paid
+        self._checkouts: Dict[int, Tuple[str, float]] = {}
+        metrics.registry.register_stats('bot_invoices', lambda: {'pending': len(self._pending)})
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    async def load(self) -> None:
+        """Load unexpired invoices left from previous runs"""
+        rows = await self.db.get_pending_invoices(time.time())
+        for nonce, user_id, amount, currency, customer_info, expires_at in rows:
+            self._pending[nonce] = PendingInvoice(
+                nonce, user_id, amount, currency, json.loads(customer_info), expires_at
+            )
+        logger.info(f"Invoice registry loaded with {len(self._pending)} pending invoices")
+
+    def _expire(self, now: float) -> None:
+        while self._pending:
+            nonce, invoice = next(iter(self._pending.items()))
+            if invoice.expires_at > now:
+                break
+            del self._pending[nonce]
+        if len(self._checkouts) > 1000:
+            self._checkouts = {user_id: hold for user_id, hold in self._checkouts.items() if hold[1] > now}
+
+    async def issue(self, user_id: int, amount: int, currency: str, customer_info: dict) -> str:
+        """Register a new invoice and return the payload to send it with"""
+        now = time.time()
+        self._expire(now)
+        invoice = PendingInvoice(secrets.token_urlsafe(12), user_id, amount, currency, customer_info, now + self.ttl)
+        await self.db.add_pending_invoice(
+            invoice.nonce, user_id, amount, currency, json.dumps(customer_info), invoice.expires_at
+        )
+        self._pending[invoice.nonce] = invoice
+        return PAYLOAD_PREFIX + invoice.nonce
+
+    def get(self, payload: str) -> Optional[PendingInvoice]:
+        """The unexpired invoice sent with payload, if any"""
+        if not payload.startswith(PAYLOAD_PREFIX):
+            return None
+        invoice = self._pending.get(payload[len(PAYLOAD_PREFIX):])
+        if invoice is None or invoice.expires_at <= time.time():
+            return None
+        return invoice
+
+    def check(self, user_id: int, payload: str, total_amount: int, currency: str) -> Optional[str]:
+        """Validate a pre-checkout query. Returns the reason to reject it, or None.
+
+        An approved checkout holds the user for checkout_hold seconds, so a
+        second invoice can't be paid while the first payment is in flight.
+        """
+        now = time.time()
+        self._expire(now)
+        invoice = self.get(payload)
+        if invoice is None or invoice.user_id != user_id:
+            return 'unknown'
+        if invoice.amount != total_amount or invoice.currency != currency:
+            return 'mismatch'
+        held_nonce, until = self._checkouts.get(user_id, (None, 0.0))
+        if held_nonce not in (None, invoice.nonce) and until > now:
+            return 'in_progress'
+        self._checkouts[user_id] = (invoice.nonce, now + self.checkout_hold)
+        return None
+
+    async def consume(self, payload: str) -> None:
+        """Forget a paid invoice"""
+        if not payload.startswith(PAYLOAD_PREFIX):
+            return
+        invoice = self._pending.pop(payload[len(PAYLOAD_PREFIX):], None)
+        if invoice is not None:
+            self._checkouts.pop(invoice.user_id, None)
+            await self.db.delete_pending_invoice(invoice.nonce)
+
+    async def purge_job(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """JobQueue callback: drop expired invoices from memory and SQLite"""
+        now = time.time()
+        self._expire(now)
+        removed = await self.db.delete_expired_invoices(now)
+        if removed:
+            logger.info(f"Purged {removed} expired invoices")
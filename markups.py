@@ -0,0 +1,128 @@
+"""
+Prebuilt keyboards shared by all updates
+"""
+
+from functools import lru_cache
+from typing import Any, Dict, Optional
+from telegram import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    KeyboardButton,
+    ReplyKeyboardMarkup,
+    ReplyKeyboardRemove
+)
+from text_constants import (
+    BACK_BUTTON,
+    CANCEL_BUTTON,
+    MENU_ABOUT_COURSE,
+    MENU_ABOUT_LECTURER,
+    MENU_ACCESS,
+    MENU_CONTACT,
+    MENU_PURCHASE,
+    MENU_REVIEWS,
+    MORE_REVIEWS_BUTTON,
+    WRITE_BUTTON
+)
+
+PHONE_BUTTON_TEXT = "📱 Отправить номер телефона"
+PROFILE_NAME_BUTTON_PREFIX = "✅ Использовать имя из профиля:"
+CUSTOM_NAME_BUTTON_TEXT = "📝 Ввести другое имя"
+MANUAL_PHONE_BUTTON_TEXT = "📝 Ввести номер вручную"
+CONTACT_URL = "https://t.me/Kalypina"
+
+class _CachedSerialization:
+    """Serializes a markup once; to_dict() returns the cached result.
+
+    PTB turns reply_markup into request data with to_dict() and then dumps
+    the whole request itself, so the dict is what's worth caching.
+    Telegram objects are already frozen after __init__, so the cached form
+    can't go stale. The returned dict is shared and must not be modified.
+    """
+
+    __slots__ = ()
+
+    def _cache_serialization(self) -> None:
+        data = super().to_dict()
+        with self._unfrozen():
+            self._cached_dict = data
+
+    def to_dict(self, recursive: bool = True) -> Dict[str, Any]:
+        return self._cached_dict
+
+class StaticInlineKeyboardMarkup(_CachedSerialization, InlineKeyboardMarkup):
+    __slots__ = ("_cached_dict",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cache_serialization()
+
+class StaticReplyKeyboardMarkup(_CachedSerialization, ReplyKeyboardMarkup):
+    __slots__ = ("_cached_dict",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cache_serialization()
+
+class StaticReplyKeyboardRemove(_CachedSerialization, ReplyKeyboardRemove):
+    __slots__ = ("_cached_dict",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cache_serialization()
+
+class MarkupRegistry:
+    """Every keyboard that doesn't depend on the user, built once"""
+
+    def __init__(self):
+        self.start_keyboards = {
+            has_paid: StaticInlineKeyboardMarkup([
+                [InlineKeyboardButton(MENU_ABOUT_COURSE, callback_data="about_course")],
+                [InlineKeyboardButton(MENU_ABOUT_LECTURER, callback_data="about_lecturer")],
+                [InlineKeyboardButton(
+                    MENU_ACCESS if has_paid else MENU_PURCHASE,
+                    callback_data="access" if has_paid else "purchase"
+                )],
+                [InlineKeyboardButton(MENU_REVIEWS, callback_data="reviews")],
+                [InlineKeyboardButton(MENU_CONTACT, callback_data="contact")]
+            ])
+            for has_paid in (False, True)
+        }
+        self.phone_keyboard = StaticReplyKeyboardMarkup([
+            [KeyboardButton(PHONE_BUTTON_TEXT, request_contact=True)],
+            [KeyboardButton(MANUAL_PHONE_BUTTON_TEXT)],
+            [KeyboardButton(CANCEL_BUTTON)]
+        ], resize_keyboard=True)
+        self.cancel_keyboard = StaticInlineKeyboardMarkup([[
+            InlineKeyboardButton(CANCEL_BUTTON, callback_data="cancel_payment")
+        ]])
+        self.back_button = StaticInlineKeyboardMarkup([[
+            InlineKeyboardButton(BACK_BUTTON, callback_data="start")
+        ]])
+        self.contact_buttons = StaticInlineKeyboardMarkup([
+            [InlineKeyboardButton(WRITE_BUTTON, url=CONTACT_URL)],
+            [InlineKeyboardButton(BACK_BUTTON, callback_data="start")]
+        ])
+        self.remove_keyboard = StaticReplyKeyboardRemove()
+
+    def start_keyboard(self, has_paid: bool) -> InlineKeyboardMarkup:
+        return self.start_keyboards[bool(has_paid)]
+
+    @lru_cache(maxsize=64)
+    def reviews_keyboard(self, next_page: Optional[int] = None) -> InlineKeyboardMarkup:
+        """Reviews pager; one instance per page number"""
+        keyboard = []
+        if next_page is not None:
+            keyboard.append([InlineKeyboardButton(MORE_REVIEWS_BUTTON, callback_data=f"reviews:{next_page}")])
+        keyboard.append([InlineKeyboardButton(BACK_BUTTON, callback_data="start")])
+        return StaticInlineKeyboardMarkup(keyboard)
+
+    @lru_cache(maxsize=1024)
+    def profile_name_keyboard(self, full_name: str) -> ReplyKeyboardMarkup:
+        """Name choice keyboard; depends only on the Telegram profile name"""
+        return StaticReplyKeyboardMarkup([
+            [KeyboardButton(f"{PROFILE_NAME_BUTTON_PREFIX} {full_name}")],
+            [KeyboardButton(CUSTOM_NAME_BUTTON_TEXT)],
+            [KeyboardButton(CANCEL_BUTTON)]
+        ], resize_keyboard=True)
+
+registry = MarkupRegistry()
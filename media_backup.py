@@ -0,0 +1,197 @@
+"""
+Incremental, content-addressed snapshots of the media directory
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+import config
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+class IOThrottle:
+    """Caps the byte rate of blocking copy loops, shared between threads.
+
+    consume() sleeps when the bytes handed over since creation would exceed
+    `rate` per second; rate 0 means unlimited.
+    """
+
+    def __init__(self, rate: float = config.BACKUP_IO_RATE):
+        self.rate = rate
+        self._started = time.monotonic()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def consume(self, size: int) -> None:
+        if not self.rate:
+            return
+        with self._lock:
+            self._bytes += size
+            ahead = self._bytes / self.rate - (time.monotonic() - self._started)
+        if ahead > 0:
+            time.sleep(ahead)
+
+UNTHROTTLED = IOThrottle(0)
+
+class SnapshotResult(NamedTuple):
+    manifest: Path
+    files: int
+    copied_files: int
+    copied_bytes: int
+
+def hash_file(path: Path, throttle: IOThrottle = UNTHROTTLED) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            throttle.consume(len(chunk))
+    return digest.hexdigest()
+
+class MediaSnapshotStore:
+    """Media backups as manifests of file hashes plus a shared blob store.
+
+    Layout under root:
+        blobs/ab/abcdef...      file contents, named by SHA-256
+        snapshots/media_<timestamp>.json
+                                {relative path: {sha256, size, mtime_ns}}
+
+    A file is copied only if no snapshot has stored its contents before,
+    so an unchanged media directory costs one manifest per backup. Files
+    whose size and mtime match the previous manifest aren't even re-read.
+    """
+
+    def __init__(self, root: Path, hash_workers: int = config.BACKUP_HASH_WORKERS,
+                 throttle: IOThrottle = UNTHROTTLED):
+        self.root = root
+        self.blobs_dir = root / 'blobs'
+        self.snapshots_dir = root / 'snapshots'
+        self.hash_workers = hash_workers
+        self.throttle = throttle
+
+    def blob_path(self, sha256: str) -> Path:
+        return self.blobs_dir / sha256[:2] / sha256
+
+    def snapshots(self) -> List[Path]:
+        """Manifests, oldest first"""
+        return sorted(self.snapshots_dir.glob('media_*.json'))
+
+    @staticmethod
+    def load_manifest(path: Path) -> Dict[str, dict]:
+        with open(path) as f:
+            return json.load(f)['files']
+
+    def _hash_changed(self, media_dir: Path, previous: Dict[str, dict]) -> Dict[str, dict]:
+        entries = {}
+        to_hash: List[Tuple[str, Path, os.stat_result]] = []
+        for path in sorted(media_dir.rglob('*')):
+            if not path.is_file() or path.is_symlink():
+                continue
+            relative = path.relative_to(media_dir).as_posix()
+            stat = path.stat()
+            known = previous.get(relative)
+            if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+                entries[relative] = known
+            else:
+                to_hash.append((relative, path, stat))
+
+        with ThreadPoolExecutor(max_workers=self.hash_workers) as executor:
+            digests = executor.map(lambda path: hash_file(path, self.throttle), [path for _, path, _ in to_hash])
+            for (relative, _, stat), sha256 in zip(to_hash, digests):
+                entries[relative] = {'sha256': sha256, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        return entries
+
+    def _store_blob(self, source: Path, sha256: str) -> Optional[str]:
+        """Copy source into the blob store unless already there. Returns the stored digest"""
+        blob = self.blob_path(sha256)
+        if blob.exists():
+            return sha256
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        tmp = blob.with_name(f'.{sha256}.tmp')
+        digest = hashlib.sha256()
+        with open(source, 'rb') as src, open(tmp, 'wb') as dst:
+            for chunk in iter(lambda: src.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+                dst.write(chunk)
+                self.throttle.consume(len(chunk))
+        actual = digest.hexdigest()
+        if actual != sha256:
+            # Modified between hashing and copying; store what was actually read
+            logger.warning(f"{source} changed during backup, storing its current contents")
+            blob = self.blob_path(actual)
+            blob.parent.mkdir(parents=True, exist_ok=True)
+        tmp.replace(blob)
+        return actual
+
+    def snapshot(self, media_dir: Path, timestamp: Optional[str] = None) -> SnapshotResult:
+        """Record the current state of media_dir, copying only new contents"""
+        timestamp = timestamp or datetime.utcnow().strftime('%Y%m%d_%H%M%S')
+        existing = self.snapshots()
+        previous = self.load_manifest(existing[-1]) if existing else {}
+
+        entries = self._hash_changed(media_dir, previous)
+        copied = copied_bytes = 0
+        for relative, entry in entries.items():
+            if self.blob_path(entry['sha256']).exists():
+                continue
+            stored = self._store_blob(media_dir / relative, entry['sha256'])
+            if stored != entry['sha256']:
+                entry = entries[relative] = {**entry, 'sha256': stored}
+            copied += 1
+            copied_bytes += entry['size']
+
+        self.snapshots_dir.mkdir(parents=True, exist_ok=True)
+        manifest = self.snapshots_dir / f'media_{timestamp}.json'
+        tmp = manifest.with_name(f'.{manifest.name}.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({'created': timestamp, 'files': entries}, f, indent=1, sort_keys=True)
+        tmp.replace(manifest)
+        logger.info(f"Media snapshot {manifest.name}: {len(entries)} files, "
+                    f"{copied} new ({copied_bytes} bytes copied)")
+        return SnapshotResult(manifest, len(entries), copied, copied_bytes)
+
+    def restore(self, manifest: Path, target_dir: Path) -> int:
+        """Recreate the files of a snapshot under target_dir. Returns the number of files"""
+        entries = self.load_manifest(manifest)
+        for relative, entry in entries.items():
+            blob = self.blob_path(entry['sha256'])
+            if not blob.exists():
+                raise FileNotFoundError(f"Blob {entry['sha256']} for {relative} is missing")
+            target = target_dir / relative
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(blob, target)
+            os.utime(target, ns=(entry['mtime_ns'], entry['mtime_ns']))
+        logger.info(f"Restored {len(entries)} files from {manifest.name} to {target_dir}")
+        return len(entries)
+
+    def prune(self, keep_last: int = config.BACKUP_KEEP_LAST) -> Tuple[int, int]:
+        """Drop all but the newest keep_last snapshots, then delete unreferenced blobs"""
+        snapshots = self.snapshots()
+        removed_snapshots = 0
+        for manifest in snapshots[:-keep_last] if keep_last else snapshots:
+            manifest.unlink()
+            removed_snapshots += 1
+            logger.info(f"Removed old media snapshot: {manifest}")
+
+        referenced: Set[str] = set()
+        for manifest in self.snapshots():
+            referenced.update(entry['sha256'] for entry in self.load_manifest(manifest).values())
+
+        removed_blobs = 0
+        if self.blobs_dir.exists():
+            for blob in self.blobs_dir.glob('*/*'):
+                if blob.name not in referenced:
+                    blob.unlink()
+                    removed_blobs += 1
+        if removed_blobs:
+            logger.info(f"Garbage-collected {removed_blobs} unreferenced media blobs")
+        return removed_snapshots, removed_blobs
@@ -0,0 +1,111 @@
+"""
+Telegram file_id registry for bot media
+"""
+
+import asyncio
+import logging
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from telegram import Bot, Message
+from telegram.error import BadRequest
+from async_database import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+# Telegram's errors for a file_id it no longer accepts; any other BadRequest
+# (caption markup, unknown chat...) would fail the same way after an upload
+FILE_ID_ERRORS = (
+    'wrong file identifier',
+    'wrong remote file identifier',
+    'file reference expired',
+    'file_reference_expired',
+)
+
+def is_file_id_error(error: BadRequest) -> bool:
+    """True if Telegram rejected a cached file_id rather than the rest of the request"""
+    message = error.message.lower()
+    return any(text in message for text in FILE_ID_ERRORS)
+
+class MediaRegistry:
+    """Remembers file_ids Telegram assigns to uploaded media.
+
+    Entries are keyed by path and invalidated when the file's mtime or size
+    changes, so an edited image is uploaded again on its next send.
+    """
+
+    def __init__(self, db: AsyncDatabase):
+        self.db = db
+        self._cache: Dict[str, Tuple[str, str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    async def warm(self) -> None:
+        """Load every known file_id in one query"""
+        for path, fingerprint, file_id in await self.db.get_media_files():
+            self._cache[path] = (fingerprint, file_id)
+        logger.info(f"Media registry loaded with {len(self._cache)} file_ids")
+
+    @staticmethod
+    def fingerprint(path: Path) -> str:
+        """Cheap change detector for a file on disk"""
+        stat = path.stat()
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+    @classmethod
+    def read(cls, path: Path) -> Tuple[str, bytes]:
+        """Fingerprint and contents of a file to upload; blocking, run it in a thread"""
+        return cls.fingerprint(path), path.read_bytes()
+
+    async def get_file_id(self, path: Path) -> Optional[str]:
+        """Return cached file_id if the file hasn't changed since upload"""
+        key = str(path)
+        fingerprint = self.fingerprint(path)
+
+        entry = self._cache.get(key)
+        if entry is None:
+            entry = await self.db.get_media_file(key)
+            if entry is None:
+                return None
+            self._cache[key] = entry
+
+        cached_fingerprint, file_id = entry
+        if cached_fingerprint != fingerprint:
+            logger.info(f"Media file changed on disk, invalidating file_id: {path}")
+            await self.forget(path)
+            return None
+        return file_id
+
+    async def remember(self, path: Path, file_id: str, fingerprint: Optional[str] = None) -> None:
+        """Store file_id returned by Telegram after an upload"""
+        key = str(path)
+        fingerprint = fingerprint or self.fingerprint(path)
+        if self._cache.get(key) == (fingerprint, file_id):
+            return
+        self._cache[key] = (fingerprint, file_id)
+        await self.db.record_media_file(key, fingerprint, file_id)
+
+    async def forget(self, path: Path) -> None:
+        """Drop cached file_id for path"""
+        key = str(path)
+        self._cache.pop(key, None)
+        await self.db.delete_media_file(key)
+
+    async def send_photo(self, bot: Bot, chat_id: int, photo_path: Path, **kwargs) -> Message:
+        """Send photo by cached file_id, uploading it only when necessary"""
+        file_id = await self.get_file_id(photo_path)
+        if file_id:
+            try:
+                return await bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+            except BadRequest as e:
+                if not is_file_id_error(e):
+                    raise
+                logger.warning(f"Cached file_id rejected for {photo_path}, re-uploading: {e}")
+                await self.forget(photo_path)
+
+        # PTB would read an open file on the event loop
+        fingerprint, data = await asyncio.to_thread(self.read, photo_path)
+        message = await bot.send_photo(chat_id=chat_id, photo=data, **kwargs)
+        if message.photo:
+            await self.remember(photo_path, message.photo[-1].file_id, fingerprint)
+        return message
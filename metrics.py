@@ -0,0 +1,262 @@
+"""
+In-process metrics with a Prometheus text endpoint
+"""
+
+import functools
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from telegram.ext import Application, BaseHandler, CommandHandler, ConversationHandler
+from telegram.request import HTTPXRequest
+import config
+from http_server import HTTPServer, Request, Response
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Counter:
+    """Monotonic counter, one value per label combination"""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, values)} {value}")
+        return lines
+
+class Histogram:
+    """Fixed-bucket histogram; observe() is a bisect and two additions"""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[LabelValues, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {values: list(series) for values, series in self._values.items()}
+        for values, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                bucket_labels = _format_labels(self.labels, values, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            labels = _format_labels(self.labels, values)
+            lines.append(f"{self.name}_sum{labels} {series[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    """Holds metrics and stats callbacks and renders them in Prometheus text format.
+
+    Stats callbacks return a flat dict of numbers (AccessCache.stats(),
+    UserOrderedUpdateProcessor.stats(), ...); each key becomes a gauge
+    named <prefix>_<key>, read at scrape time.
+    """
+
+    def __init__(self):
+        self._metrics: List[Any] = []
+        self._stats: List[Tuple[str, str, Callable[[], Dict[str, float]]]] = []
+        self._labels: Dict[str, str] = {}
+
+    @contextmanager
+    def labels(self, **labels: str) -> Iterator[None]:
+        """Label the stats registered inside the block, e.g. tenant=<name> for one of several bots"""
+        previous = self._labels
+        self._labels = {**previous, **labels}
+        try:
+            yield
+        finally:
+            self._labels = previous
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Histogram:
+        metric = Histogram(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def register_stats(self, prefix: str, callback: Callable[[], Dict[str, float]]) -> None:
+        labels = _format_labels(tuple(self._labels), tuple(self._labels.values()))
+        self._stats = [
+            (p, l, c) for p, l, c in self._stats if (p, l) != (prefix, labels)
+        ] + [(prefix, labels, callback)]
+
+    def expose(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.expose())
+        # Samples of one gauge from differently labelled callbacks go under a single TYPE line
+        gauges: Dict[str, List[str]] = {}
+        for prefix, labels, callback in self._stats:
+            try:
+                stats = callback()
+            except Exception as e:
+                logger.error(f"Failed to collect {prefix} stats: {e}")
+                continue
+            for key, value in stats.items():
+                name = f"{prefix}_{key}"
+                gauges.setdefault(name, []).append(f"{name}{labels} {float(value)}")
+        for name, samples in gauges.items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+HANDLER_DURATION = registry.histogram(
+    'bot_handler_duration_seconds', "Time spent in update handler callbacks", ('handler',))
+HANDLER_ERRORS = registry.counter(
+    'bot_handler_errors_total', "Exceptions raised out of update handler callbacks", ('handler',))
+API_DURATION = registry.histogram(
+    'bot_api_request_duration_seconds', "Bot API request latency", ('method',))
+API_ERRORS = registry.counter(
+    'bot_api_errors_total', "Failed Bot API requests by HTTP status or exception", ('method', 'error'))
+DB_DURATION = registry.histogram(
+    'bot_db_query_duration_seconds', "Time spent in Database methods", ('query',))
+DB_ERRORS = registry.counter(
+    'bot_db_errors_total', "Exceptions raised by Database methods", ('query',))
+
+def _handler_name(handler: BaseHandler) -> str:
+    name = getattr(handler.callback, '__name__', type(handler.callback).__name__)
+    if name == '<lambda>' and isinstance(handler, CommandHandler):
+        return f"command_{min(handler.commands)}"
+    return name
+
+def _timed_callback(callback: Callable, name: str) -> Callable:
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_DURATION.observe(time.perf_counter() - started, name)
+    wrapper.__metrics_wrapped__ = True
+    return wrapper
+
+def _iter_handlers(handlers: Iterable[BaseHandler]) -> Iterable[BaseHandler]:
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            yield from _iter_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                yield from _iter_handlers(state_handlers)
+            yield from _iter_handlers(handler.fallbacks)
+        else:
+            yield handler
+
+def instrument_handlers(application: Application) -> None:
+    """Time every registered handler callback, including those inside conversations"""
+    for group in application.handlers.values():
+        for handler in _iter_handlers(group):
+            if getattr(handler.callback, '__metrics_wrapped__', False):
+                continue
+            handler.callback = _timed_callback(handler.callback, _handler_name(handler))
+
+def instrument_database(db: Any) -> None:
+    """Time the public query methods of a Database instance.
+
+    The methods run on the AsyncDatabase worker threads, so only the query
+    itself is measured, not the time waiting for a thread.
+    """
+    for name in dir(type(db)):
+        if name.startswith('_') or name in ('get_connection', 'init_db', 'close'):
+            continue
+        method = getattr(db, name)
+        if callable(method):
+            setattr(db, name, _timed_query(method, name))
+
+def _timed_query(method: Callable, name: str) -> Callable:
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        except Exception:
+            DB_ERRORS.inc(name)
+            raise
+        finally:
+            DB_DURATION.observe(time.perf_counter() - started, name)
+    return wrapper
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that times every Bot API call by method name"""
+
+    async def do_request(self, url: str, method: str, request_data=None, *args, **kwargs) -> Tuple[int, bytes]:
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        try:
+            status, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+        except Exception as e:
+            API_ERRORS.inc(api_method, type(e).__name__)
+            raise
+        finally:
+            API_DURATION.observe(time.perf_counter() - started, api_method)
+        if status >= 400:
+            API_ERRORS.inc(api_method, str(status))
+        return status, payload
+
+class MetricsServer:
+    """Serves GET /metrics from the bot process"""
+
+    def __init__(self, listen: str = config.METRICS_LISTEN, port: int = config.METRICS_PORT,
+                 metrics: Optional[MetricsRegistry] = None):
+        self.registry = metrics or registry
+        self.http = HTTPServer(listen, port)
+        self.http.route('GET', '/metrics', self.handle_metrics)
+
+    async def handle_metrics(self, request: Request) -> Response:
+        return Response(
+            body=self.registry.expose().encode(),
+            content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
+
+    async def start(self) -> None:
+        await self.http.start()
+
+    async def stop(self) -> None:
+        await self.http.stop()
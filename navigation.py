@@ -0,0 +1,150 @@
+"""
+Menu screens shown by editing the menu message in place
+"""
+
+import asyncio
+import logging
+from pathlib import Path
+from typing import NamedTuple, Optional
+from telegram import Bot, InlineKeyboardMarkup, InputMediaPhoto, Message
+from telegram.error import BadRequest
+import metrics
+from media_cache import MediaRegistry, is_file_id_error
+
+logger = logging.getLogger(__name__)
+
+# Telegram's limit for photo captions
+CAPTION_LIMIT = 1024
+
+SCREENS_SHOWN = metrics.registry.counter(
+    'bot_screens_total', "Menu screens shown, by the Bot API call that showed them", ('method',))
+
+class Screen(NamedTuple):
+    """One menu screen: text with an inline keyboard, optionally under a photo"""
+    text: str
+    keyboard: InlineKeyboardMarkup
+    photo: Optional[Path] = None
+    parse_mode: Optional[str] = 'MarkdownV2'
+
+    @property
+    def fits_caption(self) -> bool:
+        # Counts MarkdownV2 escapes too, so this errs on the safe side
+        return len(self.text) <= CAPTION_LIMIT
+
+def _not_modified(error: BadRequest) -> bool:
+    return 'message is not modified' in error.message.lower()
+
+class Navigator:
+    """Moves a menu message from screen to screen with one Bot API call where possible.
+
+    A button tap edits the message it was tapped on:
+
+    - a screen with a photo, on a photo message: edit_message_media, by
+      cached file_id, so the photo is only uploaded once
+    - a text screen, on a text message: edit_message_text
+    - a text screen that fits in a caption, on a photo message:
+      edit_message_caption, keeping the photo
+
+    A text message can't get a photo and a photo can't lose it, so the
+    other cases send the screen as a new message and delete the old one.
+    So does a message Telegram refuses to edit.
+    """
+
+    def __init__(self, media: MediaRegistry):
+        self.media = media
+
+    async def send(self, bot: Bot, chat_id: int, screen: Screen) -> Message:
+        """Show screen as a new message"""
+        if screen.photo and screen.photo.exists():
+            try:
+                message = await self.media.send_photo(
+                    bot,
+                    chat_id=chat_id,
+                    photo_path=screen.photo,
+                    caption=screen.text,
+                    parse_mode=screen.parse_mode,
+                    reply_markup=screen.keyboard
+                )
+                SCREENS_SHOWN.inc('send_photo')
+                return message
+            except FileNotFoundError:
+                logger.error(f"Photo not found: {screen.photo}")
+        message = await bot.send_message(
+            chat_id=chat_id,
+            text=screen.text,
+            parse_mode=screen.parse_mode,
+            reply_markup=screen.keyboard
+        )
+        SCREENS_SHOWN.inc('send_message')
+        return message
+
+    async def show(self, bot: Bot, message: Message, screen: Screen) -> Message:
+        """Turn message into screen, editing it in place when its type allows"""
+        try:
+            edited = await self._edit(message, screen)
+        except BadRequest as e:
+            if _not_modified(e):
+                # Tapped the button of the screen already shown
+                SCREENS_SHOWN.inc('unchanged')
+                return message
+            logger.warning(f"Can't edit message {message.message_id} in chat {message.chat_id}, resending: {e}")
+            edited = None
+        if isinstance(edited, Message):
+            return edited
+
+        sent = await self.send(bot, message.chat_id, screen)
+        try:
+            await message.delete()
+        except BadRequest as e:
+            logger.warning(f"Failed to delete replaced menu message {message.message_id}: {e}")
+        return sent
+
+    async def _edit(self, message: Message, screen: Screen) -> Optional[Message]:
+        """Edit message into screen with a single call; None if its type doesn't allow it"""
+        photo = screen.photo if screen.photo and screen.photo.exists() else None
+        if message.photo:
+            if photo:
+                return await self._edit_photo(message, screen, photo)
+            if screen.fits_caption:
+                edited = await message.edit_caption(
+                    caption=screen.text,
+                    parse_mode=screen.parse_mode,
+                    reply_markup=screen.keyboard
+                )
+                SCREENS_SHOWN.inc('edit_caption')
+                return edited
+        elif message.text is not None and not photo:
+            edited = await message.edit_text(
+                text=screen.text,
+                parse_mode=screen.parse_mode,
+                reply_markup=screen.keyboard
+            )
+            SCREENS_SHOWN.inc('edit_text')
+            return edited
+        return None
+
+    async def _edit_photo(self, message: Message, screen: Screen, photo: Path) -> Message:
+        file_id = await self.media.get_file_id(photo)
+        if file_id:
+            try:
+                edited = await message.edit_media(
+                    media=InputMediaPhoto(media=file_id, caption=screen.text, parse_mode=screen.parse_mode),
+                    reply_markup=screen.keyboard
+                )
+                SCREENS_SHOWN.inc('edit_media')
+                return edited
+            except BadRequest as e:
+                if not is_file_id_error(e):
+                    raise
+                logger.warning(f"Cached file_id rejected for {photo}, re-uploading: {e}")
+                await self.media.forget(photo)
+
+        fingerprint, data = await asyncio.to_thread(self.media.read, photo)
+        edited = await message.edit_media(
+            media=InputMediaPhoto(media=data, caption=screen.text, parse_mode=screen.parse_mode),
+            reply_markup=screen.keyboard
+        )
+        SCREENS_SHOWN.inc('edit_media')
+        if isinstance(edited, Message) and edited.photo:
+            await self.media.remember(photo, edited.photo[-1].file_id, fingerprint)
+        return edited
@@ -0,0 +1,178 @@
+"""
+Durable outbox for work that follows a committed payment
+"""
+
+import asyncio
+import json
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden, RetryAfter
+import config
+import metrics
+from async_database import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+DELIVER_ACCESS = 'deliver_access'
+
+PROCESSED = metrics.registry.counter(
+    'bot_outbox_processed_total', "Outbox attempts by entry kind and outcome", ('kind', 'status'))
+
+class Undeliverable(Exception):
+    """Raised by a handler when retrying can't help, e.g. the user blocked the bot"""
+
+class OutboxEntry(NamedTuple):
+    id: int
+    kind: str
+    user_id: int
+    chat_id: int
+    payload: dict
+    attempts: int
+
+class Outbox:
+    """Delivers outbox rows written in the same transaction as a payment.
+
+    Handlers are registered per entry kind and called with the bot and the
+    entry; returning means done, raising means try again later. Retries back
+    off exponentially with jitter (RetryAfter waits exactly as long as
+    Telegram asks). Only Undeliverable fails the entry at once, as does
+    running out of attempts. Forbidden and BadRequest are retried too and
+    logged as errors: they often come from the bot's rights in the
+    students chat, which an operator can fix before the attempts run out.
+
+    An entry is marked done only after its handler returns, so a restart in
+    between delivers it again: handlers must tolerate running twice.
+    """
+
+    def __init__(
+        self,
+        db: AsyncDatabase,
+        batch_size: int = config.OUTBOX_BATCH_SIZE,
+        poll_interval: float = config.OUTBOX_POLL_INTERVAL,
+        max_attempts: int = config.OUTBOX_MAX_ATTEMPTS,
+        retry_base: float = config.OUTBOX_RETRY_BASE,
+        retry_max: float = config.OUTBOX_RETRY_MAX
+    ):
+        self.db = db
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._handlers: Dict[str, Callable[[Bot, OutboxEntry], Awaitable[None]]] = {}
+        self._wakeup = asyncio.Event()
+        # Called on every notify(), e.g. to wake the outbox of another process
+        self.listeners: List[Callable[[], None]] = []
+        self._task: Optional[asyncio.Task] = None
+        self.delivered = 0
+        self.retried = 0
+        self.failed = 0
+        metrics.registry.register_stats('bot_outbox', self.stats)
+
+    def register(self, kind: str, handler: Callable[[Bot, OutboxEntry], Awaitable[None]]) -> None:
+        self._handlers[kind] = handler
+
+    def notify(self) -> None:
+        """Wake the worker after queueing an entry"""
+        self.wake()
+        for listener in self.listeners:
+            listener()
+
+    def wake(self) -> None:
+        """Look for due entries now rather than at the next poll"""
+        self._wakeup.set()
+
+    async def start(self, bot: Bot) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._run(bot))
+
+    async def stop(self) -> None:
+        """Cancel the worker; entries being handled stay pending for the next start"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self, bot: Bot) -> None:
+        while True:
+            self._wakeup.clear()
+            try:
+                rows = await self.db.get_due_outbox(time.time(), self.batch_size)
+                if rows:
+                    results = await asyncio.gather(*(
+                        self._process(bot, OutboxEntry(*row[:4], json.loads(row[4]), row[5]))
+                        for row in rows
+                    ), return_exceptions=True)
+                    errors = [result for result in results if isinstance(result, Exception)]
+                    for error in errors:
+                        logger.error(f"Error processing outbox entry: {error}")
+                    if errors:
+                        # Entries that couldn't be updated are still due; don't spin on them
+                        await asyncio.sleep(self.poll_interval)
+                    # More may be due already
+                    continue
+                next_attempt = await self.db.get_next_outbox_attempt()
+            except Exception as e:
+                logger.error(f"Failed to read outbox: {e}")
+                next_attempt = None
+
+            # Sleep until the next retry is due, a new entry is queued or the poll interval passes
+            timeout = self.poll_interval
+            if next_attempt is not None:
+                timeout = min(timeout, max(0.0, next_attempt - time.time()))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.retry_max, self.retry_base * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _process(self, bot: Bot, entry: OutboxEntry) -> None:
+        attempts = entry.attempts + 1
+        handler = self._handlers.get(entry.kind)
+        if handler is None:
+            await self._fail(entry, attempts, f"No handler for outbox entry kind {entry.kind!r}")
+            return
+        try:
+            await handler(bot, entry)
+        except Undeliverable as e:
+            await self._fail(entry, attempts, str(e))
+        except Exception as e:
+            if attempts >= self.max_attempts:
+                await self._fail(entry, attempts, str(e))
+                return
+            delay = e.retry_after if isinstance(e, RetryAfter) else self._backoff(attempts)
+            message = (f"Outbox #{entry.id} ({entry.kind}) attempt {attempts} failed: {e}. "
+                       f"Retrying in {delay:.1f}s")
+            if isinstance(e, (Forbidden, BadRequest)):
+                # Won't pass on its own, e.g. the bot lost admin rights in the students chat
+                logger.error(f"{message}; check the bot's rights")
+            else:
+                logger.warning(message)
+            await self.db.retry_outbox(entry.id, attempts, time.time() + delay, str(e))
+            self.retried += 1
+            PROCESSED.inc(entry.kind, 'retry')
+        else:
+            await self.db.finish_outbox(entry.id, 'done', attempts)
+            self.delivered += 1
+            PROCESSED.inc(entry.kind, 'done')
+            if attempts > 1:
+                logger.info(f"Outbox #{entry.id} ({entry.kind}) delivered after {attempts} attempts")
+
+    async def _fail(self, entry: OutboxEntry, attempts: int, error: str) -> None:
+        logger.error(f"Outbox #{entry.id} ({entry.kind}) for user {entry.user_id} failed "
+                     f"after {attempts} attempts, needs manual attention: {error}")
+        await self.db.finish_outbox(entry.id, 'failed', attempts, error)
+        self.failed += 1
+        PROCESSED.inc(entry.kind, 'failed')
+
+    def stats(self) -> dict:
+        return {
+            'delivered': self.delivered,
+            'retried': self.retried,
+            'failed': self.failed,
+        }
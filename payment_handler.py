@@ -3,20 +3,24 @@ Payment Handler for Course Sales Bot
 Created by RainZerg on 2025-03-08 12:56:07 UTC
 """
 
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
+from pathlib import Path
 from typing import Optional, Dict, Any, Callable
 import logging
-from telegram import LabeledPrice, Update, ChatInviteLink
+from telegram import Bot, LabeledPrice, Update, ChatInviteLink
 from telegram.ext import ContextTypes
 from telegram.error import TelegramError
 from database import Database
+from async_database import AsyncDatabase
+from invite_pool import InviteLinkPool
+from invoices import PRE_CHECKOUTS, InvoiceRegistry
 import config
+import templates
 from text_constants import (
     COURSE_DESCRIPTION,
     COURSE_TITLE,
-    ACCESS_PAYMENT_SUCCESS,
-    ACCESS_PAYMENT_SUCCESS_NO_LINK,
-    escape_markdown
+    PRE_CHECKOUT_ERROR,
+    PRE_CHECKOUT_ERRORS
 )
 
 INVOICE_DESCRIPTION = "Полный доступ к курсу. Включает все материалы и поддержку."
@@ -35,33 +39,56 @@ class PaymentHandler:
         provider_token: str, 
         currency: str, 
         students_chat_id: str,
-        handle_successful_payment: Optional[Callable] = None
+        handle_successful_payment: Optional[Callable] = None,
+        db_file: Path = config.DB_FILE,
+        db: Optional[AsyncDatabase] = None,
+        course_title: str = COURSE_TITLE,
+        course_price: int = config.COURSE_PRICE
     ):
         self.provider_token = provider_token
         self.currency = currency
         self.students_chat_id = students_chat_id
-        self.db = Database()
+        self.db = db or AsyncDatabase(Database(db_file, init_schema=False))
+        self.invite_pool = InviteLinkPool(self.db, students_chat_id)
+        self.invoices = InvoiceRegistry(self.db)
         self._custom_payment_handler = handle_successful_payment
 
-    def create_invoice_payload(self, 
-                             chat_id: int, 
-                             title: str,
-                             description: str,
-                             amount: int,
-                             customer_info: CustomerInfo) -> Dict[str, Any]:
-        """Creates a complete invoice payload with fiscalization data"""
-
-        return {
-            "chat_id": chat_id,
-            "title": title,
-            "description": description,
-            "payload": f"course_payment_{chat_id}",
-            "provider_token": self.provider_token,
-            "currency": self.currency,
+        # Everything in an invoice except the chat, payload and customer is the same every time
+        self.course_title = course_title
+        self.amount = course_price
+        self._invoice_static = {
+            "title": course_title,
+            "description": INVOICE_DESCRIPTION,
+            "provider_token": provider_token,
+            "currency": currency,
             "need_email": True,
             "send_email_to_provider": True,
-            "prices": [LabeledPrice(label="К оплате", amount=amount)],
+            "prices": [LabeledPrice(label="К оплате", amount=self.amount)],
             "start_parameter": "course_purchase",
+        }
+        self._receipt_static = {
+            "items": [
+                {
+                    "description": course_title,
+                    "quantity": 1,
+                    "amount": {
+                        "value": self.amount / 100,  # Convert kopeks to rubles
+                        "currency": currency
+                    },
+                    "vat_code": config.VAT_CODE,
+                    "payment_mode": "full_payment",
+                    "payment_subject": "commodity"
+                }
+            ],
+            "tax_system_code": config.TAX_SYSTEM_CODE
+        }
+
+    def create_invoice_payload(self, chat_id: int, payload: str, customer_info: CustomerInfo) -> Dict[str, Any]:
+        """Creates a complete invoice payload with fiscalization data"""
+        return {
+            **self._invoice_static,
+            "chat_id": chat_id,
+            "payload": payload,
             "provider_data": {
                 "receipt": {
                     "customer": {
@@ -69,20 +96,7 @@ class PaymentHandler:
                         "email": customer_info.email,
                         "phone": customer_info.phone
                     },
-                    "items": [
-                        {
-                            "description": title,
-                            "quantity": 1,
-                            "amount": {
-                                "value": amount / 100,  # Convert kopeks to rubles
-                                "currency": self.currency
-                            },
-                            "vat_code": config.VAT_CODE,
-                            "payment_mode": "full_payment",
-                            "payment_subject": "commodity"
-                        }
-                    ],
-                    "tax_system_code": config.TAX_SYSTEM_CODE
+                    **self._receipt_static
                 }
             }
         }
@@ -91,46 +105,49 @@ class PaymentHandler:
                           update: Update, 
                           context: ContextTypes.DEFAULT_TYPE,
                           customer_info: CustomerInfo):
-        """Sends an invoice to the user"""
-        chat_id = update.effective_chat.id
-
-        invoice_payload = self.create_invoice_payload(
-            chat_id=chat_id,
-            title=COURSE_TITLE,
-            description=INVOICE_DESCRIPTION,
-            amount=config.COURSE_PRICE,
-            customer_info=customer_info
-        )
-
+        """Registers and sends an invoice to the user"""
         try:
-            await context.bot.send_invoice(**invoice_payload)
+            payload = await self.invoices.issue(
+                update.effective_user.id, self.amount, self.currency, asdict(customer_info)
+            )
+            await context.bot.send_invoice(
+                **self.create_invoice_payload(update.effective_chat.id, payload, customer_info)
+            )
         except Exception as e:
             logger.error(f"Error sending invoice: {e}")
             raise
 
+    async def obtain_invite_link(self, user_id: int, bot: Bot) -> str:
+        """Get existing or create new invite link, raising if none can be created"""
+        # First check if user already has an invite link
+        _, existing_link = await self.db.get_access_status(user_id)
+        if existing_link:
+            logger.info(f"Found existing invite link for user {user_id}")
+            return existing_link
+
+        # Then hand out a pre-generated one
+        pooled_link = await self.invite_pool.claim(user_id)
+        if pooled_link:
+            return pooled_link
+
+        logger.info(f"Invite pool empty, creating new invite link for user {user_id}")
+        # Create new invite link
+        chat_invite = await bot.create_chat_invite_link(
+            chat_id=self.students_chat_id,
+            member_limit=1,
+            expire_date=None
+        )
+
+        # Store and return the invite link
+        invite_link = chat_invite.invite_link
+        logger.info(f"Successfully created new invite link for user {user_id}")
+        await self.db.record_chat_invite(user_id, invite_link)
+        return invite_link
+
     async def create_invite_link(self, user_id: int, context: ContextTypes.DEFAULT_TYPE) -> Optional[str]:
         """Get existing or create new invite link"""
         try:
-            # First check if user already has an invite link
-            existing_link = self.db.get_chat_invite(user_id)
-            if existing_link:
-                logger.info(f"Found existing invite link for user {user_id}")
-                return existing_link
-                
-            logger.info(f"Creating new invite link for user {user_id}")
-            # Create new invite link
-            chat_invite = await context.bot.create_chat_invite_link(
-                chat_id=self.students_chat_id,
-                member_limit=1,
-                expire_date=None
-            )
-
-            # Store and return the invite link
-            invite_link = chat_invite.invite_link
-            logger.info(f"Successfully created new invite link for user {user_id}")
-            self.db.record_chat_invite(user_id, invite_link)
-            return invite_link
-
+            return await self.obtain_invite_link(user_id, context.bot)
         except Exception as e:
             logger.error(f"Failed to create invite link for user {user_id}: {e}")
             if isinstance(e, TelegramError):
@@ -140,16 +157,23 @@ class PaymentHandler:
     async def handle_pre_checkout_query(self, 
                                       update: Update, 
                                       context: ContextTypes.DEFAULT_TYPE):
-        """Handles the pre-checkout query"""
+        """Approves the checkout only for a pending invoice of a user who hasn't paid yet"""
         query = update.pre_checkout_query
         try:
-            await query.answer(ok=True)
+            has_paid, _ = await self.db.get_access_status(query.from_user.id)
+            reason = 'paid' if has_paid else self.invoices.check(
+                query.from_user.id, query.invoice_payload, query.total_amount, query.currency
+            )
+            PRE_CHECKOUTS.inc(reason or 'ok')
+            if reason:
+                logger.warning(f"Rejected pre-checkout from user {query.from_user.id}: {reason}")
+                await query.answer(ok=False, error_message=PRE_CHECKOUT_ERRORS[reason])
+            else:
+                await query.answer(ok=True)
         except Exception as e:
             logger.error(f"Error in pre-checkout: {e}")
-            await query.answer(
-                ok=False, 
-                error_message="Payment processing error, please try again later."
-            )
+            PRE_CHECKOUTS.inc('error')
+            await query.answer(ok=False, error_message=PRE_CHECKOUT_ERROR)
 
     async def handle_successful_payment(self, 
                                       update: Update, 
@@ -162,7 +186,7 @@ class PaymentHandler:
 
         # Record the payment
         try:
-            self.db.record_payment(
+            await self.db.record_payment(
                 user_id=user.id,
                 username=user.username,
                 customer_info=context.user_data,
@@ -181,17 +205,16 @@ class PaymentHandler:
             invite_link = await self.create_invite_link(user.id, context)
             
             if invite_link:
-                escaped_link = escape_markdown(invite_link)
                 await update.message.reply_text(
-                    ACCESS_PAYMENT_SUCCESS.format(
+                    templates.ACCESS_PAYMENT_SUCCESS.render(
                         transaction_id=payment_info.provider_payment_charge_id,
-                        invite_link=escaped_link
+                        invite_link=invite_link
                     ),
                     parse_mode='MarkdownV2'
                 )
             else:
                 await update.message.reply_text(
-                    ACCESS_PAYMENT_SUCCESS_NO_LINK.format(
+                    templates.ACCESS_PAYMENT_SUCCESS_NO_LINK.render(
                         transaction_id=payment_info.provider_payment_charge_id
                     ),
                     parse_mode='MarkdownV2'
@@ -206,6 +229,4 @@ class PaymentHandler:
 
     async def get_access_status(self, user_id: int) -> tuple[bool, Optional[str]]:
         """Check user's access status and return invite link if available"""
-        has_paid = self.db.get_payment_status(user_id)
-        invite_link = self.db.get_chat_invite(user_id) if has_paid else None
-        return has_paid, invite_link
+        return await self.db.get_access_status(user_id)
@@ -0,0 +1,145 @@
+"""
+SQLite persistence for user_data and conversation states
+"""
+
+import asyncio
+import json
+import logging
+from typing import Any, Dict, Optional, Set, Tuple, Union
+from telegram.ext import BasePersistence, PersistenceInput
+import config
+from async_database import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+ConversationKey = Tuple[Union[int, str], ...]
+ConversationDict = Dict[ConversationKey, object]
+
+class SQLitePersistence(BasePersistence):
+    """Stores user_data and ConversationHandler states in course_bot.db.
+
+    The Application hands over changed entries every `update_interval`
+    seconds; they are buffered here and written in a single transaction,
+    so a burst of updates costs one commit instead of one per update.
+    user_data is loaded lazily: nothing at startup, and each user's row on
+    the first update from that user (via refresh_user_data). Which users
+    are loaded is tracked for as long as the Application holds their
+    user_data, i.e. until drop_user_data.
+    """
+
+    def __init__(self, db: AsyncDatabase, update_interval: float = config.PERSISTENCE_FLUSH_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.db = db
+        self._loaded_users: Set[int] = set()
+        self._dirty_users: Dict[int, Optional[str]] = {}
+        self._dirty_conversations: Dict[Tuple[str, str], Optional[str]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _encode_key(key: ConversationKey) -> str:
+        return json.dumps(list(key))
+
+    @staticmethod
+    def _decode_key(key: str) -> ConversationKey:
+        return tuple(json.loads(key))
+
+    def _schedule_flush(self) -> None:
+        # The Application passes all changes of one run concurrently; the
+        # flush task starts after them and writes them together
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._write_buffered())
+
+    async def _write_buffered(self) -> None:
+        if not self._dirty_users and not self._dirty_conversations:
+            return
+        users, self._dirty_users = self._dirty_users, {}
+        conversations, self._dirty_conversations = self._dirty_conversations, {}
+        try:
+            await self.db.save_persistence_batch(
+                list(users.items()),
+                [(name, key, state) for (name, key), state in conversations.items()]
+            )
+        except Exception as e:
+            logger.error(f"Failed to persist state, will retry on next flush: {e}")
+            # Newer changes made while writing win over the failed batch
+            self._dirty_users = {**users, **self._dirty_users}
+            self._dirty_conversations = {**conversations, **self._dirty_conversations}
+
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        # Loaded per user in refresh_user_data
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]) -> None:
+        if user_id in self._loaded_users:
+            return
+        self._loaded_users.add(user_id)
+        if user_id in self._dirty_users:
+            # Dropped and back before the flush: what's buffered is newer than the database
+            stored = self._dirty_users[user_id]
+        else:
+            stored = await self.db.load_user_data(user_id)
+        if stored:
+            # Keys set before the load (none in practice) take precedence
+            for key, value in json.loads(stored).items():
+                user_data.setdefault(key, value)
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]) -> None:
+        try:
+            self._dirty_users[user_id] = json.dumps(data)
+        except (TypeError, ValueError) as e:
+            logger.error(f"user_data of {user_id} is not JSON serializable: {e}")
+            return
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        # The Application has dropped its entry too; a later update loads afresh
+        self._loaded_users.discard(user_id)
+        self._dirty_users[user_id] = None
+        self._schedule_flush()
+
+    async def get_conversations(self, name: str) -> ConversationDict:
+        return {
+            self._decode_key(key): json.loads(state)
+            for key, state in await self.db.load_conversations(name)
+        }
+
+    async def update_conversation(self, name: str, key: ConversationKey, new_state: Optional[object]) -> None:
+        state = json.dumps(new_state) if new_state is not None else None
+        self._dirty_conversations[(name, self._encode_key(key))] = state
+        self._schedule_flush()
+
+    async def flush(self) -> None:
+        if self._flush_task:
+            await self._flush_task
+        await self._write_buffered()
+
+    # Only user_data and conversations are stored
+    async def get_chat_data(self) -> Dict[int, Any]:
+        return {}
+
+    async def get_bot_data(self) -> Any:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def update_chat_data(self, chat_id: int, data: Any) -> None:
+        pass
+
+    async def update_bot_data(self, data: Any) -> None:
+        pass
+
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Any) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Any) -> None:
+        pass
@@ -0,0 +1,97 @@
+"""
+Reviews album with cached file_ids and pagination
+"""
+
+import asyncio
+import logging
+from pathlib import Path
+from typing import List, Optional
+from telegram import Bot, InputMediaPhoto
+from telegram.error import BadRequest
+from media_cache import MediaRegistry, is_file_id_error
+
+# Telegram doesn't accept albums with more than 10 items
+ALBUM_SIZE = 10
+
+logger = logging.getLogger(__name__)
+
+class ReviewsAlbum:
+    """Sorted manifest of review images split into albums.
+
+    The directory is scanned once and rescanned only when its mtime changes,
+    so taps on "reviews" don't touch the filesystem beyond a single stat.
+    """
+
+    def __init__(self, reviews_path: Path, media: MediaRegistry, album_size: int = ALBUM_SIZE):
+        self.reviews_path = reviews_path
+        self.media = media
+        self.album_size = min(album_size, ALBUM_SIZE)
+        self._manifest: List[Path] = []
+        self._scanned_mtime: Optional[int] = None
+
+    def _directory_mtime(self) -> Optional[int]:
+        try:
+            return self.reviews_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def scan(self) -> List[Path]:
+        """Rebuild manifest from disk"""
+        self._scanned_mtime = self._directory_mtime()
+        if self._scanned_mtime is None:
+            self._manifest = []
+        else:
+            self._manifest = sorted(self.reviews_path.glob('*.jpg'))
+        logger.info(f"Loaded {len(self._manifest)} reviews from {self.reviews_path}")
+        return self._manifest
+
+    @property
+    def manifest(self) -> List[Path]:
+        if self._scanned_mtime is None or self._directory_mtime() != self._scanned_mtime:
+            self.scan()
+        return self._manifest
+
+    @property
+    def page_count(self) -> int:
+        return -(-len(self.manifest) // self.album_size)
+
+    def page(self, number: int) -> List[Path]:
+        start = number * self.album_size
+        return self.manifest[start:start + self.album_size]
+
+    async def _build_media(self, paths: List[Path], use_cache: bool) -> List[InputMediaPhoto]:
+        media = []
+        for path in paths:
+            file_id = await self.media.get_file_id(path) if use_cache else None
+            # Read bytes up front so nothing is closed before the upload happens,
+            # on a thread so a page of uncached photos doesn't stall other updates
+            media.append(InputMediaPhoto(media=file_id or await asyncio.to_thread(path.read_bytes)))
+        return media
+
+    async def send_page(self, bot: Bot, chat_id: int, number: int) -> bool:
+        """Send one album of reviews, returns False if the page is empty"""
+        paths = self.page(number)
+        if not paths:
+            return False
+
+        fingerprints = [self.media.fingerprint(path) for path in paths]
+        try:
+            messages = await bot.send_media_group(
+                chat_id=chat_id,
+                media=await self._build_media(paths, use_cache=True)
+            )
+        except BadRequest as e:
+            if not is_file_id_error(e):
+                raise
+            logger.warning(f"Cached review file_ids rejected, re-uploading page {number}: {e}")
+            for path in paths:
+                await self.media.forget(path)
+            messages = await bot.send_media_group(
+                chat_id=chat_id,
+                media=await self._build_media(paths, use_cache=False)
+            )
+
+        for path, fingerprint, message in zip(paths, fingerprints, messages):
+            if message.photo:
+                await self.media.remember(path, message.photo[-1].file_id, fingerprint)
+        return True
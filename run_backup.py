@@ -1,10 +1,17 @@
 #!/usr/bin/env python3
 
-import shutil
+import gzip
+import sqlite3
+import time
 from datetime import datetime
 import os
 import logging
 from pathlib import Path
+import sys
+from dataclasses import dataclass
+from typing import Optional
+import config
+from media_backup import UNTHROTTLED, IOThrottle, MediaSnapshotStore
 
 # Set up logging
 logging.basicConfig(
@@ -13,41 +20,105 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def create_backup():
-    """Create a backup of the database and media files"""
-    timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-    backup_dir = Path('backups')
-    data_dir = Path('data')
-    media_dir = Path('media')
-    
+COPY_CHUNK_SIZE = 1024 * 1024
+
+@dataclass
+class BackupResult:
+    database: Optional[Path] = None
+    media_manifest: Optional[Path] = None
+    bytes_written: int = 0
+
+def backup_database(
+    db_file: Path,
+    backup_dir: Path,
+    timestamp: str,
+    pages_per_step: int = config.BACKUP_PAGES_PER_STEP,
+    step_sleep: float = config.BACKUP_STEP_SLEEP,
+    compress_level: int = config.BACKUP_COMPRESS_LEVEL,
+    throttle: IOThrottle = UNTHROTTLED
+) -> Optional[Path]:
+    """Consistent online backup of a live database into course_bot_<timestamp>.db.gz
+
+    Pages are copied with the SQLite backup API a few at a time, sleeping
+    between steps so the bot's writes aren't blocked for the whole copy.
+    The copy is checked with PRAGMA integrity_check before it is compressed;
+    nothing is left in backup_dir if any step fails.
+    """
+    snapshot = backup_dir / f'.course_bot_{timestamp}.db.tmp'
+    compressed = backup_dir / f'.course_bot_{timestamp}.db.gz.tmp'
+    target = backup_dir / f'course_bot_{timestamp}.db.gz'
     try:
-        # Create backups directory if it doesn't exist
-        backup_dir.mkdir(exist_ok=True)
-        
-        # Backup database
-        db_file = data_dir / 'course_bot.db'
-        if db_file.exists():
-            backup_db = backup_dir / f'course_bot_{timestamp}.db'
-            shutil.copy2(db_file, backup_db)
-            logger.info(f"Database backed up to {backup_db}")
-        else:
-            logger.warning("Database file not found, skipping database backup")
-        
-        # Backup media files
-        if media_dir.exists() and any(media_dir.iterdir()):
-            backup_media = backup_dir / f'media_{timestamp}.zip'
-            shutil.make_archive(
-                str(backup_media).replace('.zip', ''),
-                'zip',
-                media_dir
+        source = sqlite3.connect(db_file, timeout=config.DB_BUSY_TIMEOUT)
+        destination = sqlite3.connect(snapshot)
+        try:
+            # An open read transaction pins one WAL snapshot for every step.
+            # Without it, each write by the bot would restart the copy.
+            source.execute("BEGIN")
+            source.execute("SELECT count(*) FROM sqlite_master").fetchone()
+            source.backup(
+                destination,
+                pages=pages_per_step,
+                progress=lambda status, remaining, total: time.sleep(step_sleep)
             )
-            logger.info(f"Media files backed up to {backup_media}")
-        else:
-            logger.warning("No media files found, skipping media backup")
+            source.rollback()
+            # Make the copy a standalone file instead of a WAL database
+            destination.execute("PRAGMA journal_mode=DELETE")
+            result = destination.execute("PRAGMA integrity_check").fetchone()[0]
+            if result != 'ok':
+                raise sqlite3.DatabaseError(f"Integrity check failed: {result}")
+        finally:
+            destination.close()
+            source.close()
 
-        # Clean up old backups (keep last 5)
-        cleanup_old_backups(backup_dir)
-        
+        with open(snapshot, 'rb') as src, gzip.open(compressed, 'wb', compresslevel=compress_level) as dst:
+            for chunk in iter(lambda: src.read(COPY_CHUNK_SIZE), b''):
+                dst.write(chunk)
+                throttle.consume(len(chunk))
+        compressed.replace(target)
+        logger.info(f"Database backed up to {target} "
+                    f"({snapshot.stat().st_size} bytes, {target.stat().st_size} compressed)")
+        return target
+    finally:
+        snapshot.unlink(missing_ok=True)
+        compressed.unlink(missing_ok=True)
+
+def run_backup_once(
+    backup_dir: Path = config.BACKUP_DIR,
+    db_file: Path = config.DB_FILE,
+    media_dir: Path = config.MEDIA_DIR,
+    throttle: Optional[IOThrottle] = None
+) -> BackupResult:
+    """Back up the database and media files, raising on failure"""
+    timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
+    throttle = throttle or IOThrottle()
+    result = BackupResult()
+
+    # Create backups directory if it doesn't exist
+    backup_dir.mkdir(parents=True, exist_ok=True)
+
+    # Backup database
+    if db_file.exists():
+        result.database = backup_database(db_file, backup_dir, timestamp, throttle=throttle)
+        result.bytes_written += result.database.stat().st_size
+    else:
+        logger.warning("Database file not found, skipping database backup")
+
+    # Backup media files; only contents not stored by earlier snapshots are copied
+    if media_dir.exists() and any(media_dir.iterdir()):
+        snapshot = MediaSnapshotStore(backup_dir / 'media', throttle=throttle).snapshot(media_dir, timestamp)
+        result.media_manifest = snapshot.manifest
+        result.bytes_written += snapshot.copied_bytes + snapshot.manifest.stat().st_size
+    else:
+        logger.warning("No media files found, skipping media backup")
+
+    # Clean up old backups
+    cleanup_old_backups(backup_dir)
+    return result
+
+def create_backup():
+    """Create a backup of the database and media files"""
+    try:
+        run_backup_once()
         logger.info("Backup completed successfully!")
         return True
     
@@ -55,11 +126,15 @@ def create_backup():
         logger.error(f"Backup failed: {e}")
         return False
 
-def cleanup_old_backups(backup_dir: Path, keep_last: int = 5):
+def cleanup_old_backups(backup_dir: Path, keep_last: int = config.BACKUP_KEEP_LAST):
     """Clean up old backups, keeping only the specified number of most recent ones"""
     try:
-        # Group files by type
-        db_backups = sorted(backup_dir.glob('course_bot_*.db'))
+        # Group files by type; plain .db files are from before compression
+        db_backups = sorted(
+            list(backup_dir.glob('course_bot_*.db')) + list(backup_dir.glob('course_bot_*.db.gz')),
+            key=lambda path: path.name.split('.', 1)[0]
+        )
+        # Full zip archives from before incremental snapshots
         media_backups = sorted(backup_dir.glob('media_*.zip'))
         
         # Remove old database backups
@@ -73,9 +148,25 @@ def cleanup_old_backups(backup_dir: Path, keep_last: int = 5):
             for old_backup in media_backups[:-keep_last]:
                 old_backup.unlink()
                 logger.info(f"Removed old media backup: {old_backup}")
+
+        # Remove old media snapshots and the blobs only they referenced
+        MediaSnapshotStore(backup_dir / 'media').prune(keep_last)
     
     except Exception as e:
         logger.error(f"Error cleaning up old backups: {e}")
 
+def restore_media(snapshot: Path, target_dir: Path) -> bool:
+    """Restore a media snapshot (backups/media/snapshots/media_<timestamp>.json) into target_dir"""
+    try:
+        MediaSnapshotStore(snapshot.parent.parent).restore(snapshot, target_dir)
+        return True
+    except Exception as e:
+        logger.error(f"Media restore failed: {e}")
+        return False
+
 if __name__ == '__main__':
-    create_backup()
\ No newline at end of file
+    # python run_backup.py                              - back up database and media
+    # python run_backup.py restore-media SNAPSHOT DIR   - restore a media snapshot
+    if len(sys.argv) == 4 and sys.argv[1] == 'restore-media':
+        sys.exit(0 if restore_media(Path(sys.argv[2]), Path(sys.argv[3])) else 1)
+    create_backup()
@@ -0,0 +1,484 @@
+"""
+Multi-process mode: one ingress process feeding worker processes sharded by user
+"""
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import secrets
+import signal
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from telegram import Bot, Update
+from telegram.ext import Updater
+import config
+import metrics
+from health import write_heartbeat
+from http_server import Request, Response
+from update_processor import UserOrderedUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+ROUTED = metrics.registry.counter(
+    'bot_shard_updates_total', "Updates routed to each worker process", ('worker',))
+RELAYED = metrics.registry.counter(
+    'bot_shard_events_total', "Invalidation events relayed between worker processes", ('type',))
+
+# Events a worker publishes; the dispatcher relays them to every other worker
+ACCESS_CHANGED = 'access'  # A payment or invite link of user_id was written
+INVITES_ADDED = 'invites'  # The invite pool was refilled
+OUTBOX_QUEUED = 'outbox'  # An outbox entry was queued
+BROADCAST_REQUESTED = 'broadcast'  # An admin started broadcast_id
+
+# Longest line on the socket; updates are far smaller
+MAX_MESSAGE_SIZE = 4 * 1024 * 1024
+
+def shard_for(update: Update, workers: int) -> int:
+    """Index of the worker that handles update; the same for all updates of one user"""
+    key = UserOrderedUpdateProcessor.ordering_key(update)
+    if isinstance(key, tuple):
+        # ('chat', chat_id) for updates without a user
+        key = key[1]
+    return abs(key) % workers if key is not None else 0
+
+def _encode(message: Dict[str, Any]) -> bytes:
+    return json.dumps(message, separators=(',', ':')).encode() + b'\n'
+
+class _Shard:
+    """Dispatcher side of one worker process"""
+
+    def __init__(self, index: int, queue_size: int):
+        self.index = index
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.process: Optional[multiprocessing.Process] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.connected = asyncio.Event()
+        self.health: Optional[dict] = None
+        self.health_received: Optional[float] = None
+        self.restarts = 0
+
+    def status(self) -> dict:
+        fresh = (self.health_received is not None
+                 and time.monotonic() - self.health_received < 3 * config.HEALTH_INTERVAL)
+        return {
+            'ok': self.connected.is_set() and fresh and bool(self.health and self.health['ok']),
+            'connected': self.connected.is_set(),
+            'restarts': self.restarts,
+            'queued': self.queue.qsize(),
+            'health': self.health,
+        }
+
+class _Router:
+    """The dispatcher's update queue: put() hands each update straight to its worker's queue"""
+
+    def __init__(self, shards: List[_Shard]):
+        self.shards = shards
+
+    async def put(self, update: Update) -> None:
+        """Wait for room in the queue of the update's worker"""
+        shard = self.shards[shard_for(update, len(self.shards))]
+        try:
+            line = _encode({'update': update.to_dict()})
+        except (TypeError, ValueError) as e:
+            logger.error(f"Failed to route update {update.update_id}: {e}")
+            return
+        await shard.queue.put(line)
+        ROUTED.inc(str(shard.index))
+
+    def qsize(self) -> int:
+        return sum(shard.queue.qsize() for shard in self.shards)
+
+class Dispatcher:
+    """Receives updates and routes them to worker processes by user.
+
+    Updates come in by long polling or webhook exactly as in single-process
+    mode and are sent on to worker `user_id % workers` over a Unix socket,
+    so each user's conversation state only ever lives in one worker. Every
+    worker runs the full bot against the same SQLite database (WAL lets
+    them read concurrently); what they cache in memory is kept coherent by
+    events a worker publishes after its writes, which the dispatcher
+    relays to all other workers.
+
+    A worker that dies is started again; updates for it wait in its queue
+    meanwhile. Updates it had already received are lost with it: at most
+    SHARD_WORKER_QUEUE_SIZE buffered plus SHARD_WORKER_MAX_PENDING in its
+    processor, and what was still in the socket. A worker with that many
+    stops reading, which pushes back on its sender here.
+
+    No update is dropped once Telegram considers it delivered: when a
+    worker's queue is full, because it is down or falls behind, taking in
+    its updates waits for room. Polling then stops fetching, as the
+    getUpdates offset is shared by all users; the webhook answers 503
+    after WEBHOOK_QUEUE_TIMEOUT, so Telegram redelivers the update later,
+    and only holds up requests for that worker's users.
+    """
+
+    def __init__(
+        self,
+        workers: int = config.SHARD_WORKERS,
+        socket_path: Path = config.SHARD_SOCKET,
+        token: Optional[str] = None,
+        base_url: Optional[str] = None,
+        overrides: Optional[Dict[str, Any]] = None
+    ):
+        self.socket_path = socket_path
+        self.token = token or config.TOKEN
+        self.base_url = base_url
+        # config values set in each worker before it builds the bot, e.g. by benchmarks
+        self.overrides = overrides or {}
+        self.shards = [_Shard(index, config.SHARD_QUEUE_SIZE) for index in range(workers)]
+        self.update_queue = _Router(self.shards)
+        self.bot = Bot(
+            self.token,
+            base_url=f"{base_url}/bot" if base_url else "https://api.telegram.org/bot",
+            request=metrics.InstrumentedRequest(connection_pool_size=8)
+        )
+        self.updater: Optional[Updater] = None
+        self.webhook = None
+        self.metrics_server = metrics.MetricsServer() if config.METRICS_PORT else None
+        if self.metrics_server:
+            self.metrics_server.http.route('GET', '/health', self.handle_health)
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+        self._context = multiprocessing.get_context('spawn')
+        metrics.registry.register_stats('bot_shard', lambda: {
+            'workers': len(self.shards),
+            'workers_connected': sum(shard.connected.is_set() for shard in self.shards),
+            'update_queue': self.update_queue.qsize(),
+        })
+        for shard in self.shards:
+            with metrics.registry.labels(worker=str(shard.index)):
+                metrics.registry.register_stats('bot_shard_worker', lambda shard=shard: {
+                    'connected': int(shard.connected.is_set()),
+                    'queued': shard.queue.qsize(),
+                    'restarts': shard.restarts,
+                })
+
+    def _spawn(self, shard: _Shard) -> None:
+        shard.process = self._context.Process(
+            target=worker_main,
+            args=(shard.index, len(self.shards), str(self.socket_path), self.token,
+                  self.base_url, self.overrides, logging.getLogger().level),
+            name=f"bot-worker-{shard.index}"
+        )
+        shard.process.start()
+
+    @staticmethod
+    def _init_schema() -> None:
+        # Once here, rather than by all workers at the same time
+        from database import Database
+        Database(config.DB_FILE).close()
+
+    async def start(self) -> None:
+        self.socket_path.unlink(missing_ok=True)
+        self._server = await asyncio.start_unix_server(
+            self._handle_worker, path=str(self.socket_path), limit=MAX_MESSAGE_SIZE)
+        await asyncio.to_thread(self._init_schema)
+        for shard in self.shards:
+            self._spawn(shard)
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(shard.connected.wait() for shard in self.shards)),
+                config.SHARD_START_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            await self.stop()
+            raise RuntimeError(f"Not all {len(self.shards)} workers started within {config.SHARD_START_TIMEOUT}s")
+        logger.info(f"{len(self.shards)} workers ready")
+
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._supervise())]
+        self._tasks += [loop.create_task(self._send(shard)) for shard in self.shards]
+        if config.HEALTH_FILE:
+            self._tasks.append(loop.create_task(self._heartbeat()))
+
+        if config.BOT_MODE == "webhook":
+            await self._start_webhook()
+        else:
+            self.updater = Updater(self.bot, self.update_queue)
+            await self.updater.initialize()
+            await self.updater.start_polling()
+        if self.metrics_server:
+            await self.metrics_server.start()
+
+    async def _start_webhook(self) -> None:
+        if not config.WEBHOOK_URL:
+            raise ValueError("WEBHOOK_URL must be set when BOT_MODE=webhook")
+        from webhook import WebhookServer
+        secret_token = config.WEBHOOK_SECRET or secrets.token_urlsafe(32)
+        await self.bot.initialize()
+        self.webhook = WebhookServer(self.bot, self.update_queue, secret_token=secret_token)
+        await self.webhook.start()
+        await self.bot.set_webhook(
+            url=config.WEBHOOK_URL,
+            secret_token=secret_token,
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=config.WEBHOOK_MAX_CONNECTIONS
+        )
+        logger.info(f"Webhook set to {config.WEBHOOK_URL}")
+
+    async def stop(self) -> None:
+        """Stop taking updates, hand the queued ones to the workers, then stop the workers"""
+        self._stopping = True
+        if self.updater:
+            if self.updater.running:
+                await self.updater.stop()
+            await self.updater.shutdown()
+        if self.webhook:
+            await self.webhook.stop()
+            await self.bot.shutdown()
+
+        try:
+            await asyncio.wait_for(self._drain(), config.SHARD_STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Workers did not take all queued updates before shutdown")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        # Closing the socket tells a worker to finish its updates and exit
+        for shard in self.shards:
+            if shard.writer:
+                shard.writer.close()
+        for shard in self.shards:
+            if shard.process:
+                await asyncio.to_thread(shard.process.join, config.SHARD_STOP_TIMEOUT)
+                if shard.process.is_alive():
+                    logger.warning(f"Worker {shard.index} did not exit, terminating it")
+                    shard.process.terminate()
+                    await asyncio.to_thread(shard.process.join)
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        self.socket_path.unlink(missing_ok=True)
+        if self.metrics_server:
+            await self.metrics_server.stop()
+        if config.HEALTH_FILE:
+            config.HEALTH_FILE.unlink(missing_ok=True)
+
+    async def _drain(self) -> None:
+        for shard in self.shards:
+            await shard.queue.join()
+
+    async def _send(self, shard: _Shard) -> None:
+        """Write queued updates to the worker, keeping the one in flight across reconnects"""
+        while True:
+            line = await shard.queue.get()
+            while True:
+                await shard.connected.wait()
+                writer = shard.writer
+                try:
+                    writer.write(line)
+                    await writer.drain()
+                    break
+                except (ConnectionError, AttributeError) as e:
+                    logger.warning(f"Lost connection to worker {shard.index}: {e}")
+                    if shard.writer is writer:
+                        shard.writer = None
+                        shard.connected.clear()
+            shard.queue.task_done()
+
+    async def _handle_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        shard = None
+        try:
+            hello = json.loads(await reader.readline())
+            shard = self.shards[hello['worker']]
+            shard.writer = writer
+            shard.connected.set()
+            logger.info(f"Worker {shard.index} connected (pid {hello['pid']})")
+            while line := await reader.readline():
+                message = json.loads(line)
+                if 'event' in message:
+                    RELAYED.inc(message['event']['type'])
+                    for other in self.shards:
+                        if other is not shard and other.writer:
+                            other.writer.write(line)
+                elif 'health' in message:
+                    shard.health = message['health']
+                    shard.health_received = time.monotonic()
+        except (ConnectionError, ValueError, KeyError, IndexError) as e:
+            logger.error(f"Worker connection failed: {e}")
+        finally:
+            if shard and shard.writer is writer:
+                shard.writer = None
+                shard.connected.clear()
+                if not self._stopping:
+                    logger.warning(f"Worker {shard.index} disconnected")
+            writer.close()
+
+    async def _supervise(self) -> None:
+        """Start workers again after they die"""
+        while True:
+            await asyncio.sleep(config.SHARD_RESTART_DELAY)
+            for shard in self.shards:
+                if shard.process and not shard.process.is_alive() and not self._stopping:
+                    logger.error(f"Worker {shard.index} exited with code {shard.process.exitcode}, restarting it")
+                    shard.restarts += 1
+                    self._spawn(shard)
+
+    def status(self) -> dict:
+        workers = {shard.index: shard.status() for shard in self.shards}
+        return {
+            'ok': all(worker['ok'] for worker in workers.values()),
+            'update_queue': self.update_queue.qsize(),
+            'workers': workers,
+        }
+
+    async def handle_health(self, request: Request) -> Response:
+        status = self.status()
+        return Response(
+            200 if status['ok'] else 503,
+            json.dumps(status).encode(),
+            content_type='application/json'
+        )
+
+    async def _heartbeat(self) -> None:
+        while True:
+            write_heartbeat(config.HEALTH_FILE, self.status())
+            await asyncio.sleep(config.HEALTH_INTERVAL)
+
+class ShardWorker:
+    """One worker process: the full bot, fed updates by the dispatcher.
+
+    Worker 0 is the primary and also runs the background work that must
+    happen once per bot (see BotHandlers).
+    """
+
+    def __init__(self, index: int, socket_path: str, token: str, base_url: Optional[str] = None):
+        self.index = index
+        self.socket_path = socket_path
+        self.token = token
+        self.base_url = base_url
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.handlers = None
+        self.application = None
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        """Tell the other workers about a write; never blocks"""
+        if self.writer and not self.writer.is_closing():
+            self.writer.write(_encode({'event': event}))
+
+    def apply(self, event: Dict[str, Any]) -> None:
+        """Act on an event published by another worker"""
+        if event['type'] == ACCESS_CHANGED:
+            self.handlers.payment_handler.db.access_cache.invalidate(event['user_id'])
+        elif event['type'] == INVITES_ADDED:
+            asyncio.get_running_loop().create_task(self.handlers.payment_handler.invite_pool.load())
+        elif event['type'] == OUTBOX_QUEUED and self.handlers.primary:
+            self.handlers.outbox.wake()
+        elif event['type'] == BROADCAST_REQUESTED and self.handlers.primary:
+            asyncio.get_running_loop().create_task(self.handlers.broadcasts.resume(self.application.bot))
+
+    def _subscribe(self) -> None:
+        payment_handler = self.handlers.payment_handler
+        payment_handler.db.access_cache.listeners.append(
+            lambda user_id: self.publish({'type': ACCESS_CHANGED, 'user_id': user_id}))
+        payment_handler.invite_pool.listeners.append(lambda: self.publish({'type': INVITES_ADDED}))
+        if not self.handlers.primary:
+            # Entries are delivered by the primary worker
+            self.handlers.outbox.listeners.append(lambda: self.publish({'type': OUTBOX_QUEUED}))
+            # And broadcasts too, so that one token bucket paces them
+            self.handlers.broadcasts.listeners.append(
+                lambda broadcast_id: self.publish({'type': BROADCAST_REQUESTED, 'broadcast_id': broadcast_id}))
+
+    async def run(self) -> None:
+        from bot import BotHandlers, build_application
+        from payment_handler import PaymentHandler
+
+        payment_handler = PaymentHandler(
+            provider_token=config.PROVIDER_TOKEN,
+            currency=config.CURRENCY,
+            students_chat_id=config.STUDENTS_CHAT_ID,
+            db_file=config.DB_FILE
+        )
+        self.handlers = BotHandlers(payment_handler, health_file=None, serve_metrics=False, primary=self.index == 0)
+        self.application = build_application(
+            self.handlers,
+            token=self.token,
+            base_url=self.base_url,
+            polling=False,
+            # Little to lose in a crash; a full worker stops reading and the dispatcher queues for it
+            update_queue_size=config.SHARD_WORKER_QUEUE_SIZE,
+            max_pending_updates=config.SHARD_WORKER_MAX_PENDING
+        )
+        # Each worker on its own port after the dispatcher's
+        metrics_server = (metrics.MetricsServer(port=config.METRICS_PORT + 1 + self.index)
+                          if config.METRICS_PORT else None)
+        if metrics_server:
+            metrics_server.http.route('GET', '/health', self.handlers.health.handle_health)
+
+        reader, self.writer = await asyncio.open_unix_connection(self.socket_path, limit=MAX_MESSAGE_SIZE)
+        self._subscribe()
+        await self.application.initialize()
+        await self.handlers.post_init(self.application)
+        await self.application.start()
+        if metrics_server:
+            await metrics_server.start()
+        # Ready: the dispatcher starts routing updates here
+        self.writer.write(_encode({'worker': self.index, 'pid': os.getpid()}))
+        self.handlers.serving()
+
+        loop = asyncio.get_running_loop()
+        health_task = loop.create_task(self._report_health())
+        reading = loop.create_task(self._read(reader))
+        loop.add_signal_handler(signal.SIGTERM, reading.cancel)
+        try:
+            await reading
+        except asyncio.CancelledError:
+            pass
+        finally:
+            logger.info(f"Worker {self.index} stopping...")
+            health_task.cancel()
+            await asyncio.gather(health_task, return_exceptions=True)
+            self.writer.close()
+            await self.application.stop()
+            await self.handlers.post_stop(self.application)
+            await self.application.shutdown()
+            if metrics_server:
+                await metrics_server.stop()
+            payment_handler.db.close()
+
+    async def _read(self, reader: asyncio.StreamReader) -> None:
+        """Until the dispatcher closes the socket"""
+        while line := await reader.readline():
+            message = json.loads(line)
+            if 'update' in message:
+                await self.application.update_queue.put(Update.de_json(message['update'], self.application.bot))
+            elif 'event' in message:
+                self.apply(message['event'])
+
+    async def _report_health(self) -> None:
+        while True:
+            await asyncio.sleep(config.HEALTH_INTERVAL)
+            self.writer.write(_encode({'health': self.handlers.health.status()}))
+
+def worker_main(index: int, workers: int, socket_path: str, token: str, base_url: Optional[str],
+                overrides: Dict[str, Any], log_level: int) -> None:
+    """Entry point of a worker process"""
+    # Ctrl+C reaches the whole process group; the dispatcher decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for name, value in overrides.items():
+        setattr(config, name, value)
+    # Importing bot configures logging
+    import bot
+    logging.getLogger().setLevel(log_level)
+    logger.info(f"Worker {index} of {workers} starting")
+    asyncio.run(ShardWorker(index, socket_path, token, base_url).run())
+
+async def run_sharded() -> None:
+    """Run the dispatcher and its workers until SIGINT or SIGTERM"""
+    dispatcher = Dispatcher()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await dispatcher.start()
+    try:
+        await stop.wait()
+    finally:
+        logger.info("Stopping dispatcher and workers...")
+        await dispatcher.stop()
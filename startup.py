@@ -0,0 +1,43 @@
+"""
+Startup phase timings
+"""
+
+import logging
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+class StartupTimer:
+    """Collects the duration of named startup phases and logs a breakdown.
+
+    Created when this module is first imported, so the first thing bot.py
+    imports is the start of the clock.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+        self.logged = False
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def mark(self, name: str, seconds: float) -> None:
+        self.phases.append((name, seconds))
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.mark(name, time.perf_counter() - started)
+
+    def log(self) -> None:
+        breakdown = ', '.join(f"{name} {seconds:.3f}s" for name, seconds in self.phases)
+        logger.info(f"Serving {self.elapsed():.3f}s after start: {breakdown}")
+        self.logged = True
+
+timer = StartupTimer()
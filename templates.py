@@ -0,0 +1,79 @@
+"""
+Precompiled MarkdownV2 templates for text_constants
+"""
+
+from functools import lru_cache
+from string import Formatter
+from typing import List, Tuple
+import text_constants
+from text_constants import escape_markdown
+
+class Template:
+    """A text_constants template parsed once into literal and field parts.
+
+    Literal parts are kept exactly as written, since text_constants already
+    stores them escaped for MarkdownV2. Field values are escaped on render,
+    and rendered results are memoized so repeated arguments (the same
+    invite link, the same profile name) cost a dict lookup.
+    """
+
+    def __init__(self, source: str, cache_size: int = 1024):
+        self.source = source
+        self._parts: List[Tuple[str, str]] = []
+        for literal, field, format_spec, conversion in Formatter().parse(source):
+            if format_spec or conversion:
+                raise ValueError(f"Unsupported field format in template: {field}")
+            self._parts.append((literal, field))
+        self.fields = frozenset(field for _, field in self._parts if field)
+        self._render_cached = lru_cache(maxsize=cache_size)(self._render)
+
+    def _render(self, values: Tuple[Tuple[str, str], ...]) -> str:
+        escaped = {name: escape_markdown(str(value)) for name, value in values}
+        return ''.join(literal + (escaped[field] if field else '') for literal, field in self._parts)
+
+    def render(self, **values) -> str:
+        """Fill in fields, escaping the values for MarkdownV2"""
+        missing = self.fields - values.keys()
+        if missing:
+            raise KeyError(f"Missing template fields: {', '.join(sorted(missing))}")
+        return self._render_cached(tuple(sorted(values.items())))
+
+USE_PROFILE_NAME_REQUEST = Template(text_constants.USE_PROFILE_NAME_REQUEST)
+ACCESS_PAYMENT_SUCCESS = Template(text_constants.ACCESS_PAYMENT_SUCCESS)
+ACCESS_PAYMENT_SUCCESS_NO_LINK = Template(text_constants.ACCESS_PAYMENT_SUCCESS_NO_LINK)
+PAYMENT_RECEIVED = Template(text_constants.PAYMENT_RECEIVED)
+
+# Name the course or its price
+WELCOME_NEW = Template(text_constants.WELCOME_NEW)
+WELCOME_BACK = Template(text_constants.WELCOME_BACK)
+HELP_TEXT = Template(text_constants.HELP_TEXT)
+PAYMENT_ERROR = Template(text_constants.PAYMENT_ERROR)
+PAYMENT_CANCELLED = Template(text_constants.PAYMENT_CANCELLED)
+ALREADY_PURCHASED = Template(text_constants.ALREADY_PURCHASED)
+ACCESS_SUCCESS = Template(text_constants.ACCESS_SUCCESS)
+ACCESS_SUCCESS_NO_LINK = Template(text_constants.ACCESS_SUCCESS_NO_LINK)
+ACCESS_NOT_PURCHASED = Template(text_constants.ACCESS_NOT_PURCHASED)
+
+class CourseTexts:
+    """The texts that name one course's title or price.
+
+    Every bot renders its own from the title and price its invoices use,
+    so bots hosted together (see tenants.py) each show what they charge.
+    Texts with no other fields are rendered once here.
+    """
+
+    def __init__(self, course_title: str, course_price: int):
+        self.course = {'course_title': course_title, 'course_price': text_constants.format_price(course_price)}
+        self.welcome_new = WELCOME_NEW.render(**self.course)
+        self.welcome_back = WELCOME_BACK.render(**self.course)
+        self.help = HELP_TEXT.render(**self.course)
+        self.payment_error = PAYMENT_ERROR.render(**self.course)
+        self.payment_cancelled = PAYMENT_CANCELLED.render(**self.course)
+        self.access_success_no_link = ACCESS_SUCCESS_NO_LINK.render(**self.course)
+        self.access_not_purchased = ACCESS_NOT_PURCHASED.render(**self.course)
+
+    def already_purchased(self, invite_link: str) -> str:
+        return ALREADY_PURCHASED.render(invite_link=invite_link, **self.course)
+
+    def access_success(self, invite_link: str) -> str:
+        return ACCESS_SUCCESS.render(invite_link=invite_link, **self.course)
@@ -0,0 +1,293 @@
+"""
+Hosting several course bots in one process
+"""
+
+import asyncio
+import json
+import logging
+import os
+import resource
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Set, Tuple
+from telegram.ext import Application
+import config
+import metrics
+from async_database import AsyncDatabase
+from backup_job import BackupJob
+from bot import BotHandlers, build_application
+from database import Database
+from health import write_heartbeat
+from http_server import Request, Response
+from payment_handler import PaymentHandler
+from text_constants import COURSE_TITLE
+
+logger = logging.getLogger(__name__)
+
+def _resolve(value: Optional[str]) -> Optional[str]:
+    """"$NAME" reads environment variable NAME, so tokens can stay out of the tenants file"""
+    if isinstance(value, str) and value.startswith('$'):
+        return os.getenv(value[1:])
+    return value
+
+@dataclass
+class Tenant:
+    """One hosted course bot, as listed in TENANTS_FILE"""
+    name: str
+    token: str
+    provider_token: str
+    students_chat_id: str
+    admin_ids: Set[int] = field(default_factory=set)
+    course_title: str = COURSE_TITLE
+    course_price: int = config.COURSE_PRICE
+    media_dir: Optional[Path] = None
+    db_file: Optional[Path] = None
+
+    def __post_init__(self):
+        self.token = _resolve(self.token)
+        self.provider_token = _resolve(self.provider_token)
+        self.students_chat_id = _resolve(self.students_chat_id)
+        self.admin_ids = {int(user_id) for user_id in self.admin_ids}
+        self.media_dir = Path(self.media_dir) if self.media_dir else config.MEDIA_DIR / self.name
+        self.db_file = Path(self.db_file) if self.db_file else config.DB_DIR / f"{self.name}.db"
+
+def load_tenants(path: Path) -> List[Tenant]:
+    """Read a JSON list of tenants, see tenants.example.json"""
+    with open(path) as f:
+        tenants = [Tenant(**entry) for entry in json.load(f)]
+    names = [tenant.name for tenant in tenants]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f"Duplicate tenant names in {path}: {', '.join(sorted(duplicates))}")
+    for tenant in tenants:
+        if not tenant.token or not tenant.provider_token:
+            raise ValueError(f"Tenant {tenant.name} has no token or provider_token")
+    return tenants
+
+def rss_bytes() -> int:
+    """Resident set size of this process"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # Peak rather than current RSS, but better than nothing off Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class SharedRequest(metrics.InstrumentedRequest):
+    """A connection pool used by several bots, closed when the last of them shuts down"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._users = 0
+
+    async def initialize(self) -> None:
+        self._users += 1
+        await super().initialize()
+
+    async def shutdown(self) -> None:
+        self._users -= 1
+        if self._users <= 0:
+            await super().shutdown()
+
+class HostedBot(NamedTuple):
+    tenant: Tenant
+    handlers: BotHandlers
+    application: Application
+    startup_rss: int
+
+class TenantRunner:
+    """Runs the Applications of several tenants on one event loop.
+
+    Every bot keeps its own database file, media directory and caches;
+    they share the HTTP connection pools, the database worker threads,
+    the metrics endpoint and the heartbeat file. Telegram file_ids belong
+    to the bot that uploaded the file, so media registries stay per bot.
+
+    Tenants are started one after another and the growth of the process
+    RSS while each one starts is recorded as its footprint; the first one
+    also pays for what the others share.
+    """
+
+    def __init__(self, tenants: List[Tenant], base_url: Optional[str] = None, shared: bool = True):
+        self.tenants = tenants
+        self.base_url = base_url
+        self.shared = shared
+        self.bots: List[HostedBot] = []
+        if shared:
+            self.request = SharedRequest(connection_pool_size=config.TENANT_HTTP_POOL_SIZE)
+            # Each bot keeps one long poll open
+            self.get_updates_request = SharedRequest(connection_pool_size=len(tenants) + 1)
+            self.executors: Optional[Tuple[ThreadPoolExecutor, ThreadPoolExecutor]] = (
+                ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer'),
+                ThreadPoolExecutor(max_workers=config.DB_READER_THREADS, thread_name_prefix='db-reader')
+            )
+        else:
+            self.request = self.get_updates_request = None
+            self.executors = None
+        self.metrics_server = metrics.MetricsServer() if config.METRICS_PORT else None
+        if self.metrics_server:
+            self.metrics_server.http.route('GET', '/health', self.handle_health)
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        metrics.registry.register_stats('bot_process', lambda: {'rss_bytes': rss_bytes()})
+
+    def _build(self, tenant: Tenant) -> Tuple[BotHandlers, Application]:
+        with metrics.registry.labels(tenant=tenant.name):
+            db = AsyncDatabase(
+                Database(tenant.db_file, init_schema=False, cache_size_kb=config.TENANT_DB_CACHE_SIZE_KB),
+                executors=self.executors
+            )
+            payment_handler = PaymentHandler(
+                provider_token=tenant.provider_token,
+                currency=config.CURRENCY,
+                students_chat_id=tenant.students_chat_id,
+                db=db,
+                course_title=tenant.course_title,
+                course_price=tenant.course_price
+            )
+            handlers = BotHandlers(
+                payment_handler,
+                media_dir=tenant.media_dir,
+                admin_ids=tenant.admin_ids,
+                health_file=None,
+                serve_metrics=False
+            )
+            application = build_application(
+                handlers,
+                token=tenant.token,
+                base_url=self.base_url,
+                request=self.request,
+                get_updates_request=self.get_updates_request,
+                backup_job=BackupJob(
+                    backup_dir=config.BACKUP_DIR / tenant.name,
+                    db_file=tenant.db_file,
+                    media_dir=tenant.media_dir
+                )
+            )
+        return handlers, application
+
+    async def _start_tenant(self, tenant: Tenant) -> None:
+        before = rss_bytes()
+        tenant.db_file.parent.mkdir(parents=True, exist_ok=True)
+        handlers, application = self._build(tenant)
+        try:
+            await application.initialize()
+            await handlers.post_init(application)
+            await application.updater.start_polling()
+            await application.start()
+        except Exception:
+            await self._stop_bot(handlers, application)
+            raise
+        handlers.serving()
+        bot = HostedBot(tenant, handlers, application, rss_bytes() - before)
+        self.bots.append(bot)
+        with metrics.registry.labels(tenant=tenant.name):
+            metrics.registry.register_stats('bot_tenant', lambda: self.tenant_stats(bot))
+        logger.info(f"Tenant {tenant.name} started as @{application.bot.username}, "
+                    f"+{bot.startup_rss / 2 ** 20:.1f} MiB RSS")
+
+    async def start(self) -> None:
+        """Start every tenant; one that fails to start is logged and skipped"""
+        for tenant in self.tenants:
+            try:
+                await self._start_tenant(tenant)
+            except Exception as e:
+                logger.error(f"Tenant {tenant.name} failed to start: {e}")
+        if not self.bots:
+            raise RuntimeError("No tenant could be started")
+        if self.metrics_server:
+            await self.metrics_server.start()
+        if config.HEALTH_FILE:
+            self._heartbeat_task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self.log_memory_report()
+
+    @staticmethod
+    async def _stop_bot(handlers: BotHandlers, application: Application) -> None:
+        if application.updater and application.updater.running:
+            await application.updater.stop()
+        if application.running:
+            await application.stop()
+        await handlers.post_stop(application)
+        await application.shutdown()
+        handlers.payment_handler.db.close()
+
+    async def stop(self) -> None:
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+            await asyncio.gather(self._heartbeat_task, return_exceptions=True)
+            config.HEALTH_FILE.unlink(missing_ok=True)
+        for bot in reversed(self.bots):
+            try:
+                await self._stop_bot(bot.handlers, bot.application)
+            except Exception as e:
+                logger.error(f"Error stopping tenant {bot.tenant.name}: {e}")
+        self.bots.clear()
+        if self.executors:
+            for executor in self.executors:
+                executor.shutdown(wait=True)
+        if self.metrics_server:
+            await self.metrics_server.stop()
+
+    @staticmethod
+    def tenant_stats(bot: HostedBot) -> dict:
+        cache = bot.handlers.payment_handler.db.access_cache.stats()
+        return {
+            'startup_rss_bytes': bot.startup_rss,
+            'user_data_entries': len(bot.application.user_data),
+            'cached_users': cache['paid_users'] + cache['unpaid_users'],
+            'media_file_ids': len(bot.handlers.media),
+            'pending_invoices': len(bot.handlers.payment_handler.invoices),
+        }
+
+    def memory_report(self) -> List[dict]:
+        return [{'tenant': bot.tenant.name, **self.tenant_stats(bot)} for bot in self.bots]
+
+    def log_memory_report(self) -> None:
+        total = rss_bytes()
+        lines = [f"{len(self.bots)} tenants in {total / 2 ** 20:.1f} MiB RSS"]
+        for row in self.memory_report():
+            lines.append(
+                f"  {row['tenant']}: +{row['startup_rss_bytes'] / 2 ** 20:.1f} MiB at start, "
+                f"{row['user_data_entries']} user_data, {row['cached_users']} cached users, "
+                f"{row['media_file_ids']} file_ids, {row['pending_invoices']} pending invoices"
+            )
+        logger.info('\n'.join(lines))
+
+    def status(self) -> dict:
+        tenants = {bot.tenant.name: bot.handlers.health.status() for bot in self.bots}
+        return {
+            'ok': bool(tenants) and all(status['ok'] for status in tenants.values()),
+            'rss_bytes': rss_bytes(),
+            'tenants': tenants,
+        }
+
+    async def handle_health(self, request: Request) -> Response:
+        status = self.status()
+        return Response(
+            200 if status['ok'] else 503,
+            json.dumps(status).encode(),
+            content_type='application/json'
+        )
+
+    async def _heartbeat(self) -> None:
+        """One heartbeat file for all tenants"""
+        while True:
+            write_heartbeat(config.HEALTH_FILE, self.status())
+            await asyncio.sleep(config.HEALTH_INTERVAL)
+
+async def run_tenants(path: Path) -> None:
+    """Run the tenants listed in path until SIGINT or SIGTERM"""
+    if config.BOT_MODE == "webhook":
+        raise ValueError("Hosting several bots is only supported in polling mode")
+    runner = TenantRunner(load_tenants(path))
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await runner.start()
+    try:
+        await stop.wait()
+    finally:
+        logger.info("Stopping tenants...")
+        await runner.stop()
@@ -3,7 +3,7 @@ Bot Text Constants
 Created by RainZerg on 2025-03-08 12:09:32 UTC
 """
 
-from config import COURSE_PRICE, COURSE_TITLE
+from config import COURSE_TITLE
 
 def escape_markdown(text: str) -> str:
     """Helper function to escape MarkdownV2 special characters"""
@@ -12,12 +12,12 @@ def escape_markdown(text: str) -> str:
         text = text.replace(char, f'\\{char}')
     return text
 
-# Format price for display (e.g., "10 000")
-COURSE_PRICE_RUB = COURSE_PRICE / 100  # Convert kopeks to rubles
-COURSE_PRICE_STR = f"{COURSE_PRICE_RUB:,.0f}".replace(',', ' ')
+def format_price(kopeks: int) -> str:
+    """Format price for display (e.g., 1000000 kopeks -> "10 000")"""
+    return f"{kopeks / 100:,.0f}".replace(',', ' ')
 
-# Escape course title for MarkdownV2
-COURSE_TITLE_ESCAPED = escape_markdown(COURSE_TITLE)
+# Texts with {course_title} or {course_price} are templates, rendered per bot
+# by templates.CourseTexts with that bot's title and price
 
 # Course Description
 COURSE_DESCRIPTION = f"""
@@ -100,9 +100,10 @@ MENU_CONTACT = "👩‍💼 Задать вопрос"
 BACK_BUTTON = "🔙 Назад"
 CANCEL_BUTTON = "🔙 Отмена"
 WRITE_BUTTON = "✍️ Написать"
+MORE_REVIEWS_BUTTON = "➡️ Еще отзывы"
 
 # Welcome Messages
-WELCOME_NEW = f"""
+WELCOME_NEW = """
 Добро пожаловать в меню покупки курса\\! 🎓
 
 📋 Краткая информация о курсе:
@@ -110,11 +111,11 @@ WELCOME_NEW = f"""
 • Старт 23 апреля в 19:00 МСК
 • 7 недель обучения \\(8 живых лекций\\)
 
-*Цена: {escape_markdown(COURSE_PRICE_STR)} рублей*
+*Цена: {course_price} рублей*
 
 Выберите опцию из меню ниже:"""
 
-WELCOME_BACK = f"""
+WELCOME_BACK = """
 С возвращением в меню покупки курса\\! 🎓
 
 📋 Напоминаем о курсе:
@@ -122,7 +123,7 @@ WELCOME_BACK = f"""
 • Старт 23 апреля в 19:00 МСК
 • 7 недель обучения с записью лекций
 
-*Цена: {escape_markdown(COURSE_PRICE_STR)} рублей*
+*Цена: {course_price} рублей*
 
 Выберите опцию из меню ниже:"""
 
@@ -148,12 +149,12 @@ PAYMENT_PHONE_REQUEST = """
 PAYMENT_INFO_THANKS = """
 Спасибо за предоставленную информацию\\! Подготавливаем счет\\.\\.\\."""
 
-PAYMENT_ERROR = f"""
-Извините, произошла ошибка при оформлении покупки курса «{COURSE_TITLE_ESCAPED}»\\. 
+PAYMENT_ERROR = """
+Извините, произошла ошибка при оформлении покупки курса «{course_title}»\\. 
 Пожалуйста, попробуйте позже\\."""
 
-PAYMENT_CANCELLED = f"""
-Процесс оплаты курса «{COURSE_TITLE_ESCAPED}» отменен\\."""
+PAYMENT_CANCELLED = """
+Процесс оплаты курса «{course_title}» отменен\\."""
 
 USE_PROFILE_NAME_REQUEST = """
 Я вижу, что в вашем профиле Telegram указано имя: *{full_name}*
@@ -170,32 +171,32 @@ PAYMENT_PHONE_INVALID = """
 Пожалуйста, введите номер в формате \\+79211234567:"""
 
 # Access Messages
-ALREADY_PURCHASED = f"""
-Вы уже приобрели курс «{COURSE_TITLE_ESCAPED}»\\!
+ALREADY_PURCHASED = """
+Вы уже приобрели курс «{course_title}»\\!
 
 🎓 Доступ к чату для студентов
 
-Вот ваша пригласительная ссылка: {{invite_link}}
+Вот ваша пригласительная ссылка: {invite_link}
 
 Вы можете использовать эту ссылку, чтобы снова присоединиться к чату в любое время\\."""
 
-ACCESS_SUCCESS = f"""
-✅ Вы успешно приобрели курс «{COURSE_TITLE_ESCAPED}»\\!
+ACCESS_SUCCESS = """
+✅ Вы успешно приобрели курс «{course_title}»\\!
 
 🎓 *Доступ к чату для студентов*
-Вот ваша пригласительная ссылка: {{invite_link}}
+Вот ваша пригласительная ссылка: {invite_link}
 
 Вы можете использовать эту ссылку, чтобы снова присоединиться к чату в любое время\\."""
 
-ACCESS_SUCCESS_NO_LINK = f"""
-✅ Вы успешно приобрели курс «{COURSE_TITLE_ESCAPED}»\\!
+ACCESS_SUCCESS_NO_LINK = """
+✅ Вы успешно приобрели курс «{course_title}»\\!
 
 ❗ Однако возникла проблема с вашей пригласительной ссылкой\\.
 Пожалуйста, обратитесь в службу поддержки\\."""
 
-ACCESS_NOT_PURCHASED = f"""
-Вы еще не приобрели курс «{COURSE_TITLE_ESCAPED}»\\.
-*Стоимость курса: {{course_price}} рублей\\.*
+ACCESS_NOT_PURCHASED = """
+Вы еще не приобрели курс «{course_title}»\\.
+*Стоимость курса: {course_price} рублей\\.*
 Используйте опцию 💳 Купить в главном меню, чтобы получить доступ\\."""
 
 MENU_UPDATED = """
@@ -203,7 +204,7 @@ MENU_UPDATED = """
 Используйте кнопку «🎓 Доступ к курсу» для получения ссылки на чат\\."""
 
 # Help Message
-HELP_TEXT = f"""
+HELP_TEXT = """
 *Доступные команды:*
 /start \\- Запустить бота и показать главное меню
 /help \\- Показать это справочное сообщение
@@ -212,7 +213,7 @@ HELP_TEXT = f"""
 *Опции меню:*
 • 📚 Подробнее о курсе \\- Просмотр подробной информации о курсе
 • 👨‍🏫 О ведущей курса \\- Узнать о преподавателе
-• 💳 Купить \\- Приобрести курс \\(*{escape_markdown(COURSE_PRICE_STR)} руб\\.*\\)
+• 💳 Купить \\- Приобрести курс \\(*{course_price} руб\\.*\\)
 
 Нужна помощь? Свяжитесь с нами: \\[контактная информация\\]"""
 
@@ -241,5 +242,31 @@ ID транзакции: `{transaction_id}`
 Наша служба поддержки свяжется с вами в ближайшее время для предоставления доступа\\.
 Приносим извинения за доставленные неудобства\\."""
 
+PAYMENT_RECEIVED = """
+🎉 Спасибо за покупку\\!
+
+Платеж получен\\. ID транзакции: `{transaction_id}`
+
+Готовим ваш доступ к чату студентов, ссылка придет следующим сообщением\\."""
+
+# Pre-checkout rejections (plain text, shown by Telegram in the payment form)
+PRE_CHECKOUT_ERRORS = {
+    'unknown': "Этот счет устарел. Пожалуйста, оформите покупку заново через меню бота.",
+    'mismatch': "Сумма счета не совпадает с ценой курса. Пожалуйста, оформите покупку заново.",
+    'paid': "Вы уже приобрели этот курс. Ссылка на чат доступна в меню «🎓 Доступ к курсу».",
+    'in_progress': "Оплата другого счета уже выполняется. Пожалуйста, подождите пару минут.",
+}
+PRE_CHECKOUT_ERROR = "Ошибка обработки платежа, пожалуйста, попробуйте позже."
+
+# Admin Messages (sent without parse_mode)
+BROADCAST_USAGE = "Использование: /broadcast <текст> или ответьте командой /broadcast на сообщение, которое нужно разослать."
+BROADCAST_STARTED = "Рассылка #{broadcast_id} запущена."
+BROADCAST_FINISHED = "Рассылка #{broadcast_id} завершена: отправлено {sent}, не доставлено {failed}, {rate:.1f} сообщ./с"
+FUNNEL_USAGE = "Использование: /funnel [дней], без аргумента - за все время."
+FUNNEL_HEADER = "Воронка за {period}:"
+FUNNEL_PERIOD_ALL = "все время"
+FUNNEL_PERIOD_DAYS = "{days} дн."
+FUNNEL_STEP = "{step}: {users:.0f} ({from_previous:.1f}% от предыдущего, {from_first:.1f}% от первого шага)"
+
 # Error Messages
 GENERAL_ERROR = """Извините, что\\-то пошло не так\\. Пожалуйста, попробуйте позже\\."""
@@ -0,0 +1,176 @@
+"""
+Concurrent update processing with per-user ordering
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Dict, Hashable, Optional
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+import config
+
+logger = logging.getLogger(__name__)
+
+class _UserSlot:
+    __slots__ = ("lock", "refs")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.refs = 0
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates of different users in parallel, each user's in order.
+
+    Every update first takes its user's lock (FIFO), then one of `workers`
+    slots, so a user with a burst of updates waits on their own lock without
+    occupying worker slots that other users could use. ConversationHandler
+    state is therefore only ever touched by one update per user at a time.
+
+    PTB takes every update off the update queue as soon as it arrives and
+    starts a task for it, so its max_concurrent_updates only limits how
+    many of those tasks run, not how many exist. `max_pending` (waiting
+    plus running) is enforced before that instead: AdmissionQueue hands
+    an update to PTB only once admit() got one of its slots, and the
+    rest stay in the bounded queue, which then pushes back on polling or
+    the webhook. `workers` bounds the updates that actually run.
+    """
+
+    __slots__ = ("workers", "max_pending", "_worker_slots", "_capacity", "_admitted", "_users",
+                 "_waiting", "_running", "_wait_count", "_wait_total", "_wait_max", "last_processed")
+
+    def __init__(self, workers: int = config.UPDATE_WORKERS, max_pending: int = config.UPDATE_MAX_PENDING):
+        super().__init__(max_concurrent_updates=max(workers, max_pending))
+        self.workers = workers
+        self.max_pending = max(workers, max_pending)
+        self._worker_slots = asyncio.Semaphore(workers)
+        self._capacity = asyncio.Semaphore(self.max_pending)
+        self._admitted = 0
+        self._users: Dict[Hashable, _UserSlot] = {}
+        self._waiting = 0
+        self._running = 0
+        self._wait_count = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self.last_processed: Optional[float] = None  # time.monotonic() of the last finished update
+
+    @staticmethod
+    def ordering_key(update: object) -> Optional[Hashable]:
+        """Key whose updates must be processed sequentially"""
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return ('chat', update.effective_chat.id)
+        return None
+
+    async def admit(self) -> None:
+        """Wait until another update may leave the update queue"""
+        await self._capacity.acquire()
+        self._admitted += 1
+
+    def release(self) -> None:
+        """Give back the slot of an admitted update"""
+        # Updates that didn't come through AdmissionQueue hold no slot
+        if self._admitted > 0:
+            self._admitted -= 1
+            self._capacity.release()
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        try:
+            await self._process_in_order(update, coroutine)
+        finally:
+            self.release()
+
+    async def _process_in_order(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self.ordering_key(update)
+        enqueued = time.monotonic()
+        slot = None
+        if key is not None:
+            slot = self._users.get(key)
+            if slot is None:
+                slot = self._users[key] = _UserSlot()
+            slot.refs += 1
+
+        self._waiting += 1
+        waiting = True
+        try:
+            if slot is not None:
+                await slot.lock.acquire()
+            try:
+                async with self._worker_slots:
+                    self._waiting -= 1
+                    waiting = False
+                    self._record_wait(time.monotonic() - enqueued)
+                    self._running += 1
+                    try:
+                        await coroutine
+                    finally:
+                        self._running -= 1
+                        self.last_processed = time.monotonic()
+            finally:
+                if slot is not None:
+                    slot.lock.release()
+        finally:
+            if waiting:
+                # Cancelled while still queued
+                self._waiting -= 1
+            if slot is not None:
+                slot.refs -= 1
+                if slot.refs == 0:
+                    del self._users[key]
+
+    def _record_wait(self, wait: float) -> None:
+        self._wait_count += 1
+        self._wait_total += wait
+        self._wait_max = max(self._wait_max, wait)
+
+    async def initialize(self) -> None:
+        logger.info(f"Processing updates with {self.workers} workers")
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        """Queue depth and per-user wait time since startup.
+
+        queue_depth counts the admitted updates that don't run yet, parked
+        on their user's lock or on a worker slot; updates still in the
+        update queue are reported by whoever fills it.
+        """
+        return {
+            'workers': self.workers,
+            'max_pending': self.max_pending,
+            'admitted': self._admitted,
+            'queue_depth': max(self._waiting, self._admitted - self._running),
+            'running': self._running,
+            'active_users': len(self._users),
+            'wait_count': self._wait_count,
+            'wait_avg': self._wait_total / self._wait_count if self._wait_count else 0.0,
+            'wait_max': self._wait_max,
+        }
+
+class AdmissionQueue(asyncio.Queue):
+    """Update queue that releases an update only when the processor has room for it.
+
+    PTB's update fetcher loops on get() and starts a task per update right
+    away. Waiting for UserOrderedUpdateProcessor.admit() first keeps the
+    updates that don't fit here, in the bounded queue, so a full queue
+    blocks the poller's put() and makes the webhook answer 503.
+    """
+
+    def __init__(self, processor: UserOrderedUpdateProcessor, maxsize: int = 0):
+        super().__init__(maxsize)
+        self.processor = processor
+
+    async def get(self) -> Any:
+        await self.processor.admit()
+        try:
+            item = await super().get()
+        except BaseException:
+            self.processor.release()
+            raise
+        if type(item) is object:
+            # PTB's stop signal, which the fetcher consumes itself
+            self.processor.release()
+        return item
@@ -0,0 +1,121 @@
+"""
+Webhook mode: receive updates over HTTP instead of long polling
+"""
+
+import asyncio
+import hmac
+import json
+import logging
+import secrets
+import signal
+from typing import Callable, Optional
+from telegram import Bot, Update
+from telegram.ext import Application
+import config
+from http_server import HTTPServer, Request, Response
+import metrics
+
+logger = logging.getLogger(__name__)
+
+class WebhookServer:
+    """Accepts Telegram webhook POSTs and feeds them to an update queue.
+
+    The queue is bounded, and bot.build_application makes it an
+    AdmissionQueue that is only drained as fast as the update processor
+    takes updates in: when handlers fall behind, a POST waits up to
+    queue_timeout for a free slot and is then answered with 503, so
+    Telegram backs off and redelivers the update later instead of the
+    process buffering an unbounded backlog in memory.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        update_queue: asyncio.Queue,
+        listen: str = config.WEBHOOK_LISTEN,
+        port: int = config.WEBHOOK_PORT,
+        url_path: str = config.WEBHOOK_PATH,
+        secret_token: Optional[str] = None,
+        queue_timeout: float = config.WEBHOOK_QUEUE_TIMEOUT
+    ):
+        self.bot = bot
+        self.update_queue = update_queue
+        self.secret_token = secret_token
+        self.queue_timeout = queue_timeout
+        self.http = HTTPServer(listen, port)
+        self.http.route('POST', url_path, self.handle_update)
+        self.accepted = 0
+        self.rejected = 0
+
+    async def handle_update(self, request: Request) -> Response:
+        if self.secret_token is not None:
+            received = request.headers.get('x-telegram-bot-api-secret-token', '')
+            if not hmac.compare_digest(received.encode(), self.secret_token.encode()):
+                logger.warning("Rejected webhook request with invalid secret token")
+                return Response(403, b'Forbidden')
+
+        try:
+            update = Update.de_json(json.loads(request.body), self.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Rejected malformed webhook update: {e}")
+            return Response(400, b'Bad Request')
+
+        try:
+            await asyncio.wait_for(self.update_queue.put(update), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            logger.warning(f"Update queue full ({self.update_queue.qsize()}), asking Telegram to retry")
+            return Response(503, b'Service Unavailable', headers={'Retry-After': '1'})
+
+        self.accepted += 1
+        return Response(200, b'OK')
+
+    async def start(self) -> None:
+        await self.http.start()
+
+    async def stop(self) -> None:
+        await self.http.stop()
+
+async def run_webhook(application: Application, on_serving: Optional[Callable[[], None]] = None) -> None:
+    """Run application in webhook mode until SIGINT/SIGTERM; on_serving is called once the webhook is set"""
+    if not config.WEBHOOK_URL:
+        raise ValueError("WEBHOOK_URL must be set when BOT_MODE=webhook")
+
+    # Telegram echoes this back on every request; a fresh one per start is fine
+    secret_token = config.WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    server = WebhookServer(application.bot, application.update_queue, secret_token=secret_token)
+    metrics.registry.register_stats('bot_webhook', lambda: {
+        'accepted': server.accepted,
+        'rejected': server.rejected,
+        'queue_size': application.update_queue.qsize()
+    })
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await server.start()
+        await application.bot.set_webhook(
+            url=config.WEBHOOK_URL,
+            secret_token=secret_token,
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=config.WEBHOOK_MAX_CONNECTIONS
+        )
+        logger.info(f"Webhook set to {config.WEBHOOK_URL}")
+        if on_serving:
+            on_serving()
+
+        await stop_event.wait()
+
+        logger.info("Stopping webhook server...")
+        await server.stop()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+    if application.post_shutdown:
+        await application.post_shutdown(application)